@@ -0,0 +1,249 @@
+"""
+Attribute extraction shared by the Nielsen (Flow 2) and 7-Eleven flows.
+
+Both flows extract the same product facts with different prompts, schemas and caches
+(normalize_item_llm -> LLM_CACHE_STORAGE, _call_711_llm -> 7-eleven_llm_cache). Every successful
+Nielsen extraction is also published here in one canonical form, keyed on a source-neutral product
+key (the spelling-normalized token set of the description), in ATTRIBUTE_CACHE. When the 7-Eleven
+import misses its own cache, the canonical entry of the same product is converted to the six
+7-Eleven fields and reused instead of calling the LLM.
+
+Reuse is one-way (REUSE_FROM): 7-Eleven results carry no brand and no confidence, which Flow 2
+groups on, so they never serve Nielsen items. Nielsen-to-Nielsen reuse of reworded descriptions
+is the semantic cache's job (FLOW2_SEMANTIC_CACHE and its confidence guard), not this module's.
+
+ATTRIBUTE_CACHE is derived data, not a third source of extractions: each entry is a converted
+copy of one LLM_CACHE_STORAGE result, keyed for lookup by product and dropped when that result is
+invalidated (forget_attributes). The source caches stay the per-source
+views (guards, versioning, invalidation, snapshots work as before); entries filled from the
+canonical cache are stored there with tier="shared". Canonical entries and their shared copies
+carry the version of the extraction they came from (llm_cache.origin_version), so they go stale
+together with it.
+
+SHARED_ATTRIBUTE_CACHE=off disables reuse and publishing.
+"""
+import os
+import re
+import threading
+from datetime import datetime
+
+try:
+    from backend.database import get_collection
+    from backend.llm_cache import TwoTierLLMCache, register_cache, origin_version, current_origin_version
+    from backend.llm_usage import usage_recorder
+except ImportError:
+    # Fallback: if imported from inside the backend folder
+    from database import get_collection
+    from llm_cache import TwoTierLLMCache, register_cache, origin_version, current_origin_version
+    from llm_usage import usage_recorder
+
+ATTRIBUTE_CACHE_COL = "ATTRIBUTE_CACHE"
+SHARED_ATTRIBUTES_ENABLED = os.getenv("SHARED_ATTRIBUTE_CACHE", "on").lower() != "off"
+
+# Canonical attribute schema (source-neutral):
+#   brand, product_line, variant, flavour, product_form - upper-case names, None when unknown
+#   unit_size ("18G"), pack_count (6), total_size ("108G"), is_sugar_free, confidence (None when the source has none)
+#   origin: {"source", "key", "version"} of the extraction it came from
+CANONICAL_FIELDS = ["brand", "product_line", "variant", "flavour", "product_form",
+                    "unit_size", "pack_count", "total_size", "is_sugar_free", "confidence"]
+# Which source's canonical entries a source may reuse (Nielsen publishes, 7-Eleven reuses)
+REUSE_FROM = {"7eleven": "nielsen"}
+
+# Canonical entries are stamped with origin_version() of their extraction (no version of their own)
+attribute_cache = register_cache(TwoTierLLMCache(
+    ATTRIBUTE_CACHE_COL, "product_key", name="attributes",
+    version_fn=lambda key, stored=None: current_origin_version(stored)
+))
+
+shared_stats = {"published": 0, "reused": {"7eleven": 0}}
+_stats_lock = threading.Lock()
+
+_UNIT = r"(KG|GRAM|GM|GR|G|MLS|ML|LTR|L)"
+_PACK_THEN_SIZE = re.compile(rf"\b(\d+)\s*[X*]\s*(\d+(?:\.\d+)?)\s*{_UNIT}\b", re.I)
+_SIZE_THEN_PACK = re.compile(rf"(\d+(?:\.\d+)?)\s*{_UNIT}\s*[X*]\s*(\d+)\b", re.I)
+_SIZE = re.compile(rf"(\d+(?:\.\d+)?)\s*{_UNIT}\b", re.I)
+_PACK = re.compile(r"\bX\s*(\d+)\b|\b(\d+)\s*[SX]\b", re.I)
+_UNIT_NAMES = {"GRAM": "G", "GM": "G", "GR": "G", "MLS": "ML", "LTR": "L"}
+_PLAIN = {"NORMAL", "PLAIN", "REGULAR", "ORIGINAL", "UNKNOWN"}
+_EMPTY = {"", "NONE", "NULL", "NA", "N/A"}
+
+
+def _size(number, unit):
+    number = number.rstrip("0").rstrip(".") if "." in number else number
+    unit = unit.upper()
+    return f"{number}{_UNIT_NAMES.get(unit, unit)}"
+
+
+def _total_size(unit_size, pack_count):
+    number, unit = re.match(r"([\d.]+)(\D+)", unit_size).groups()
+    return _size(f"{float(number) * pack_count:g}", unit)
+
+
+def parse_pack_size(text):
+    """(unit_size, pack_count) from a description: '6X18G' -> ('18G', 6), '10Gx10' -> ('10G', 10)."""
+    s = str(text or "")
+    m = _PACK_THEN_SIZE.search(s)
+    if m:
+        return _size(m.group(2), m.group(3)), int(m.group(1))
+    m = _SIZE_THEN_PACK.search(s)
+    if m:
+        return _size(m.group(1), m.group(2)), int(m.group(3))
+    m = _SIZE.search(s)
+    p = _PACK.search(_SIZE.sub(" ", s))
+    return (_size(m.group(1), m.group(2)) if m else None), (int(p.group(1) or p.group(2)) if p else 1)
+
+
+def strip_pack_size(text):
+    """Description without weights and pack sizes (original casing kept)."""
+    for pattern in (_PACK_THEN_SIZE, _SIZE_THEN_PACK, _SIZE, _PACK):
+        text = pattern.sub(" ", text)
+    return " ".join(text.split())
+
+
+def _name(value):
+    value = str(value or "").strip().upper()
+    return None if value in _EMPTY else value
+
+
+def product_key(text):
+    """Source-neutral key: the spelling-normalized token set of the description."""
+    from backend.processor import semantic_token_key
+    return semantic_token_key(text)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Source adapters: source result <-> canonical attributes
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _origin_stamp(origin):
+    """origin_version() of the extraction a canonical entry came from ({"source", "key", "version"})."""
+    if origin.get("source") not in ADAPTERS:
+        return None
+    return origin_version(ADAPTERS[origin["source"]].cache_name, origin["key"], origin.get("version"))
+
+
+class NielsenAdapter:
+    """Flow 2 results (LLM_CACHE_STORAGE): published in canonical form."""
+    source = "nielsen"
+    cache_name = "flow2"
+
+    def to_canonical(self, item, result):
+        unit_size, pack_count = parse_pack_size(item)
+        return {
+            "brand": _name(result.get("brand")),
+            "product_line": _name(result.get("product_line")),
+            "variant": _name(result.get("variant")),
+            "flavour": _name(result.get("flavour")),
+            "product_form": _name(result.get("product_form")),
+            "unit_size": unit_size,
+            "pack_count": pack_count,
+            "total_size": _name(result.get("size")),
+            "is_sugar_free": result.get("is_sugar_free"),
+            "confidence": result.get("confidence"),
+        }
+
+
+class SevenElevenAdapter:
+    """7-Eleven enrichment results (7-eleven_llm_cache, six fields): filled from Nielsen entries."""
+    source = "7eleven"
+    cache_name = "7eleven"
+    flow = "7eleven_shared"
+
+    def from_canonical(self, desc, attrs):
+        from backend.processor import SEMANTIC_MIN_CONFIDENCE
+        if float(attrs.get("confidence") or 0) < SEMANTIC_MIN_CONFIDENCE:
+            return None
+        unit_size, pack_count = parse_pack_size(desc)
+        if not unit_size:
+            unit_size, pack_count = attrs.get("unit_size"), attrs.get("pack_count") or 1
+        series = attrs.get("product_line")
+        if not series or series == attrs.get("brand"):
+            series = attrs.get("variant") if attrs.get("variant") not in _PLAIN else None
+        flavour = attrs.get("flavour")
+        return {
+            "ArticleDescription_clean": strip_pack_size(str(desc)) or str(desc),
+            "7E_Nrmsize": unit_size,
+            "7E_MPack": f"X{pack_count}",
+            "7E_Variant": series or "NONE",
+            "7E_product_form": attrs.get("product_form") or "NONE",
+            # 7-Eleven convention: plain versions are ORIGINAL
+            "7E_flavour": "ORIGINAL" if flavour in _PLAIN else (flavour or "NONE"),
+        }
+
+    def store(self, desc, result, origin):
+        from backend.llm_cache import seven_eleven_cache
+        seven_eleven_cache.put(desc, result, tier="shared", cached_at=datetime.utcnow().isoformat(),
+                               version=_origin_stamp(origin), reused_from=origin.get("key"))
+
+
+ADAPTERS = {a.source: a for a in (NielsenAdapter(), SevenElevenAdapter())}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Service
+# ─────────────────────────────────────────────────────────────────────────────
+
+def publish_attributes(source, text, result, version=None):
+    """Record a fresh extraction of `text` from `source` (stamped `version` in its source cache) in canonical form."""
+    publish_attributes_many(source, [(text, result, version)])
+
+
+def publish_attributes_many(source, extractions):
+    """publish_attributes for many (text, result, version) at once (queued for one bulk write)."""
+    if not SHARED_ATTRIBUTES_ENABLED or source not in REUSE_FROM.values():
+        return
+    adapter = ADAPTERS[source]
+    now = datetime.utcnow().isoformat()
+    published = 0
+    for text, result, version in extractions:
+        key = product_key(text) if result else None
+        if not key:
+            continue
+        attrs = adapter.to_canonical(text, result)
+        attrs["origin"] = {"source": source, "key": text, "version": version}
+        attribute_cache.put(key, attrs, source=source, cached_at=now, version=_origin_stamp(attrs["origin"]))
+        published += 1
+    with _stats_lock:
+        shared_stats["published"] += published
+
+
+def reuse_shared_attributes(source, texts):
+    """
+    Serve cache misses of `source` from canonical entries of the same product published by
+    REUSE_FROM[source] (one $in lookup). Converted results are written to the source cache
+    (tier="shared") and returned as {text: result}.
+    """
+    if not SHARED_ATTRIBUTES_ENABLED or source not in REUSE_FROM or not texts:
+        return {}
+    adapter = ADAPTERS[source]
+    keys = {text: product_key(text) for text in dict.fromkeys(texts)}
+    found = attribute_cache.get_many([k for k in keys.values() if k])
+    reused = {}
+    for text, key in keys.items():
+        attrs = found.get(key)
+        origin = (attrs or {}).get("origin") or {}
+        if not attrs or origin.get("source") != REUSE_FROM[source] or origin.get("key") == text:
+            continue
+        result = adapter.from_canonical(text, attrs)
+        if result is None:
+            continue
+        adapter.store(text, result, attrs.get("origin") or {})
+        reused[text] = result
+    if reused:
+        usage_recorder.record_cache_hit(adapter.flow, len(reused))
+        with _stats_lock:
+            shared_stats["reused"][source] += len(reused)
+    return reused
+
+
+def forget_attributes(source, texts, chunk_size=1000):
+    """Drop canonical entries published by `source` for these texts (used when its cache entries are invalidated)."""
+    keys = list(dict.fromkeys(k for k in (product_key(t) for t in texts) if k))
+    attribute_cache.flush()
+    coll = get_collection(ATTRIBUTE_CACHE_COL)
+    deleted = 0
+    for i in range(0, len(keys), chunk_size):
+        deleted += coll.delete_many({"product_key": {"$in": keys[i:i + chunk_size]},
+                                     "result.origin.source": source}).deleted_count
+    attribute_cache.discard(keys)
+    return deleted
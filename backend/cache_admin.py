@@ -0,0 +1,248 @@
+"""
+Targeted invalidation of the LLM result caches.
+
+One entry point for what used to be a dozen one-off clear_*_cache.py scripts: select entries in
+LLM_CACHE_STORAGE (Flow 2) and/or 7-eleven_llm_cache by brand, regex, clean key, date range or
+prompt version, delete them from MongoDB and the in-process LRU, and optionally re-enrich the
+affected items in the background at bulk priority.
+
+Usage:
+    python -m backend.cache_admin --cache flow2 --brand NABATI --dry-run
+    python -m backend.cache_admin --cache flow2 --regex "BOURBON|GOKOKU" --reenrich
+    python -m backend.cache_admin --cache 7eleven --since 2026-01-01 --until 2026-02-01
+    python -m backend.cache_admin --cache all --outdated
+"""
+import argparse
+import json
+import re
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bson import ObjectId
+
+try:
+    from backend.database import get_collection
+    from backend.llm_cache import get_cache
+except ImportError:
+    # Fallback: if imported from inside the backend folder
+    from database import get_collection
+    from llm_cache import get_cache
+
+CACHE_NAMES = ["flow2", "7eleven"]
+DELETE_CHUNK = 1000
+
+# Background re-enrichment jobs: job_id -> progress
+reenrich_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _parse_date(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def _date_filter(since, until):
+    """
+    Entries written since `cached_at` was recorded are matched on it (ISO strings sort
+    chronologically); older entries fall back to the ObjectId creation time.
+    """
+    since, until = _parse_date(since), _parse_date(until)
+    iso, oid = {}, {}
+    if since:
+        iso["$gte"] = since.isoformat()
+        oid["$gte"] = ObjectId.from_datetime(since)
+    if until:
+        iso["$lt"] = until.isoformat()
+        oid["$lt"] = ObjectId.from_datetime(until)
+    return {"$or": [{"cached_at": iso}, {"cached_at": {"$exists": False}, "_id": oid}]}
+
+
+def build_query(cache, brand=None, regex=None, since=None, until=None, prompt_hash=None, query=None):
+    """MongoDB filter for the selectors that can be evaluated server-side."""
+    key_field = get_cache(cache).key_field
+    clauses = []
+    if query:
+        clauses.append(query)
+    if brand:
+        brand_re = {"$regex": rf"\b{re.escape(brand.strip())}\b", "$options": "i"}
+        if cache == "flow2":
+            clauses.append({"$or": [{"result.brand": {"$regex": f"^{re.escape(brand.strip())}$", "$options": "i"}},
+                                    {key_field: brand_re}]})
+        else:
+            # 7-Eleven results carry no brand field; the description starts with it
+            clauses.append({key_field: brand_re})
+    if regex:
+        clauses.append({key_field: {"$regex": regex, "$options": "i"}})
+    if since or until:
+        clauses.append(_date_filter(since, until))
+    if prompt_hash:
+        clauses.append({"version.prompt_hash": {"$regex": f"^{re.escape(prompt_hash)}"}})
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def find_keys(cache, brand=None, regex=None, clean_keys=None, since=None, until=None,
+              prompt_hash=None, outdated=False, query=None):
+    """
+    Cache keys (Flow 2 context items / 7-Eleven article descriptions) matching every given selector.
+
+    clean_keys: item names or clean keys (simple_clean_item); matches every cached spelling of them.
+    outdated:   only entries whose prompt / model / guard fingerprint differs from the current one.
+    """
+    target = get_cache(cache)
+    key_field = target.key_field
+    mongo_filter = build_query(cache, brand, regex, since, until, prompt_hash, query)
+    if not mongo_filter and not clean_keys and not outdated:
+        raise ValueError("Refusing to invalidate a whole cache without a selector; use clear_llm_cache() for that")
+
+    wanted = None
+    if clean_keys:
+        from backend.processor import simple_clean_item
+        wanted = {simple_clean_item(k) for k in clean_keys} | set(clean_keys)
+
+    keys = []
+    cursor = get_collection(target.collection).find(mongo_filter, {"_id": 0, key_field: 1, "version": 1})
+    for doc in cursor:
+        key = doc.get(key_field)
+        if not key:
+            continue
+        if wanted is not None and simple_clean_item(key) not in wanted:
+            continue
+        if outdated and target.is_current(key, doc):
+            continue
+        keys.append(key)
+    return keys
+
+
+def delete_keys(cache, keys):
+    """Delete entries from MongoDB (chunked $in) and drop them from the in-process LRU."""
+    target = get_cache(cache)
+    target.flush()  # pending writes would otherwise resurrect deleted entries
+    coll = get_collection(target.collection)
+    deleted = 0
+    for i in range(0, len(keys), DELETE_CHUNK):
+        deleted += coll.delete_many({target.key_field: {"$in": keys[i:i + DELETE_CHUNK]}}).deleted_count
+    target.discard(keys)
+    if cache == "flow2":
+        # Canonical copies would otherwise re-serve the invalidated results to the 7-Eleven flow
+        from backend.attribute_extraction import forget_attributes
+        forget_attributes("nielsen", keys)
+    return deleted
+
+
+def reenrich_keys(cache, keys, max_workers=4, job=None):
+    """Re-run the LLM extraction for `keys` (bulk priority) and write the fresh results to the cache."""
+    if cache == "flow2":
+        # Caches the result itself; None when the LLM failed
+        from backend.processor import request_item_attributes
+        work = request_item_attributes
+    else:
+        from backend.seven_eleven import _call_711_llm, _save_711_cache
+
+        def work(desc):
+            result, failed = _call_711_llm(desc)
+            if failed:
+                return None
+            _save_711_cache(desc, result)
+            return result
+
+    # Failed keys get no cache entry (nor a fallback copy in 7-eleven_data or the shared attributes)
+    done = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for key, result in zip(keys, executor.map(work, keys)):
+            if result is not None:
+                done.append(key)
+            if job is not None:
+                job["done"] += 1
+    get_cache(cache).flush()
+    if cache == "7eleven" and done:
+        # Push the fresh results into the imported 7-eleven_data rows
+        from backend.seven_eleven import sync_data_with_cache
+        sync_data_with_cache(done)
+    return {"reenriched": len(done), "failed": len(keys) - len(done)}
+
+
+def start_reenrichment(cache, keys, max_workers=4):
+    """Run reenrich_keys in a background thread. Returns the job id (see reenrich_jobs)."""
+    job_id = f"reenrich-{cache}-{uuid.uuid4().hex[:8]}"
+    job = {"job_id": job_id, "cache": cache, "status": "running", "total": len(keys), "done": 0,
+           "started_at": datetime.utcnow().isoformat()}
+    with _jobs_lock:
+        reenrich_jobs[job_id] = job
+
+    def run():
+        try:
+            job.update(reenrich_keys(cache, keys, max_workers=max_workers, job=job))
+            job["status"] = "completed"
+            print(f"♻️ Re-enrichment {job_id}: {job['reenriched']} refreshed, {job['failed']} failed")
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            print(f"⚠️ Re-enrichment {job_id} failed: {e}")
+        job["finished_at"] = datetime.utcnow().isoformat()
+
+    threading.Thread(target=run, name=job_id, daemon=True).start()
+    return job_id
+
+
+def invalidate(cache="flow2", brand=None, regex=None, clean_keys=None, since=None, until=None,
+               prompt_hash=None, outdated=False, query=None, dry_run=False, reenrich=False,
+               background=True, max_workers=4):
+    """
+    Invalidate matching entries in one cache ("flow2", "7eleven") or both ("all").
+
+    dry_run:    only report what would be deleted.
+    reenrich:   re-extract the deleted items afterwards; in a background job unless background=False.
+    Returns a per-cache report with match counts, a sample of keys and any re-enrichment job id.
+    """
+    caches = CACHE_NAMES if cache == "all" else [cache]
+    report = {"dry_run": dry_run, "caches": {}}
+    for name in caches:
+        if name not in CACHE_NAMES:
+            raise ValueError(f"Unknown cache '{name}' (expected one of {CACHE_NAMES + ['all']})")
+        keys = find_keys(name, brand, regex, clean_keys, since, until, prompt_hash, outdated, query)
+        entry = {"matched": len(keys), "sample": keys[:20]}
+        if not dry_run and keys:
+            entry["deleted"] = delete_keys(name, keys)
+            print(f"🧹 Invalidated {entry['deleted']} {name} cache entries")
+            if reenrich:
+                if background:
+                    entry["reenrich_job"] = start_reenrichment(name, keys, max_workers)
+                else:
+                    entry.update(reenrich_keys(name, keys, max_workers))
+        report["caches"][name] = entry
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Invalidate LLM cache entries (and optionally re-enrich them)")
+    parser.add_argument("--cache", choices=CACHE_NAMES + ["all"], default="flow2")
+    parser.add_argument("--brand", help="Brand name (Flow 2: result.brand or item text; 7-Eleven: description text)")
+    parser.add_argument("--regex", help="Case-insensitive regex on the cache key")
+    parser.add_argument("--clean-key", action="append", dest="clean_keys",
+                        help="Item name or clean key; matches every cached spelling (repeatable)")
+    parser.add_argument("--since", help="Cached at or after this ISO date/time")
+    parser.add_argument("--until", help="Cached before this ISO date/time")
+    parser.add_argument("--prompt-hash", help="Entries stamped with this prompt hash (prefix match)")
+    parser.add_argument("--outdated", action="store_true", help="Entries whose prompt/model/guard fingerprint is outdated")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--reenrich", action="store_true", help="Re-extract invalidated items (bulk priority)")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    report = invalidate(
+        args.cache, brand=args.brand, regex=args.regex, clean_keys=args.clean_keys,
+        since=args.since, until=args.until, prompt_hash=args.prompt_hash, outdated=args.outdated,
+        dry_run=args.dry_run, reenrich=args.reenrich, background=False, max_workers=args.workers,
+    )
+    print(json.dumps(report, indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
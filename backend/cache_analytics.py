@@ -0,0 +1,177 @@
+from datetime import datetime
+
+from bson import ObjectId
+
+try:
+    from backend.database import get_collection
+    from backend.llm_cache import get_cache
+    from backend.llm_usage import LLM_USAGE_COL, usage_recorder
+except ImportError:
+    # Fallback: if imported from inside the backend folder
+    from database import get_collection
+    from llm_cache import get_cache
+    from llm_usage import LLM_USAGE_COL, usage_recorder
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  LLM cache analytics (GET /cache/stats)
+#  Entry counts per brand, hit ratio per run (from LLM_USAGE), age distribution,
+#  entries produced by older prompt / model / guard versions and the most re-requested items.
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Usage flows that count as a lookup of each cache
+CACHE_FLOWS = {"flow2": ["flow2", "flow2_semantic"], "7eleven": ["7eleven", "7eleven_shared"]}
+AGE_BUCKETS = [("<1d", 1), ("1-7d", 7), ("7-30d", 30), ("30-90d", 90), ("90-365d", 365), (">365d", None)]
+
+
+def _entry_time(doc):
+    cached_at = doc.get("cached_at")
+    if cached_at:
+        try:
+            return datetime.fromisoformat(str(cached_at))
+        except ValueError:
+            pass
+    oid = doc.get("_id")
+    return oid.generation_time.replace(tzinfo=None) if isinstance(oid, ObjectId) else None
+
+
+def _age_bucket(age_days):
+    for label, limit in AGE_BUCKETS:
+        if limit is None or age_days < limit:
+            return label
+
+
+def brand_counts(cache, limit=50):
+    """Entry count per brand (Flow 2: result.brand; 7-Eleven: first word of the description)."""
+    target = get_cache(cache)
+    if cache == "flow2":
+        brand = {"$ifNull": ["$result.brand", "UNKNOWN"]}
+    else:
+        brand = {"$toUpper": {"$arrayElemAt": [{"$split": [f"${target.key_field}", " "]}, 0]}}
+    rows = get_collection(target.collection).aggregate([
+        {"$group": {"_id": brand, "entries": {"$sum": 1}, "hits": {"$sum": {"$ifNull": ["$hit_count", 0]}}}},
+        {"$sort": {"entries": -1}},
+        {"$limit": limit},
+    ])
+    return [{"brand": r["_id"] or "UNKNOWN", "entries": r["entries"], "hits": r["hits"]} for r in rows]
+
+
+def version_and_age(cache):
+    """
+    One pass over the collection: age histogram plus how many entries carry an outdated
+    fingerprint, broken down by which part changed (prompt / model / guards / unversioned).
+    """
+    target = get_cache(cache)
+    now = datetime.utcnow()
+    ages = {label: 0 for label, _ in AGE_BUCKETS}
+    ages["unknown"] = 0
+    versions = {"current": 0, "outdated": 0, "unversioned": 0, "changed": {}}
+    by_prompt = {}
+
+    projection = {target.key_field: 1, "cached_at": 1, "version": 1}
+    for doc in get_collection(target.collection).find({}, projection):
+        ts = _entry_time(doc)
+        if ts is None:
+            ages["unknown"] += 1
+        else:
+            ages[_age_bucket((now - ts).total_seconds() / 86400)] += 1
+
+        stored = doc.get("version")
+        key = doc.get(target.key_field)
+        if target.version_fn is None or not key:
+            continue
+        if not stored:
+            versions["unversioned"] += 1
+            continue
+        current = target.version_fn(key, stored)
+        if stored == current:
+            versions["current"] += 1
+            continue
+        versions["outdated"] += 1
+        for part in current:
+            if stored.get(part) != current[part]:
+                versions["changed"][part] = versions["changed"].get(part, 0) + 1
+        prompt_hash = stored.get("prompt_hash", "unknown")
+        by_prompt[prompt_hash] = by_prompt.get(prompt_hash, 0) + 1
+
+    versions["outdated_by_prompt_hash"] = dict(sorted(by_prompt.items(), key=lambda kv: -kv[1])[:20])
+    return ages, versions
+
+
+def top_requested(cache, limit=20):
+    target = get_cache(cache)
+    cursor = get_collection(target.collection).find(
+        {"hit_count": {"$gt": 0}},
+        {"_id": 0, target.key_field: 1, "hit_count": 1, "last_hit_at": 1, "cached_at": 1},
+    ).sort("hit_count", -1).limit(limit)
+    return [{"key": d[target.key_field], "hit_count": d["hit_count"], "last_hit_at": d.get("last_hit_at"),
+             "cached_at": d.get("cached_at")} for d in cursor]
+
+
+def run_hit_ratios(runs=10):
+    """Per pipeline run: LLM calls made vs calls saved by each cache (from LLM_USAGE)."""
+    usage_recorder.flush()
+    coll = get_collection(LLM_USAGE_COL)
+    flows = [f for names in CACHE_FLOWS.values() for f in names]
+    recent = coll.aggregate([
+        {"$match": {"flow": {"$in": flows}}},
+        {"$group": {"_id": "$run_id", "started": {"$min": "$ts"}}},
+        {"$sort": {"started": -1}},
+        {"$limit": runs},
+    ])
+    started = {r["_id"]: r["started"] for r in recent}
+    if not started:
+        return []
+
+    rows = coll.aggregate([
+        {"$match": {"run_id": {"$in": list(started)}, "flow": {"$in": flows}}},
+        {"$group": {
+            "_id": {"run_id": "$run_id", "flow": "$flow"},
+            "calls": {"$sum": {"$cond": [{"$eq": ["$outcome", "cache_hit"]}, 0, 1]}},
+            "cache_hits": {"$sum": {"$cond": [{"$eq": ["$outcome", "cache_hit"]}, {"$ifNull": ["$count", 1]}, 0]}},
+        }},
+    ])
+    per_run = {}
+    for r in rows:
+        run_id, flow = r["_id"]["run_id"], r["_id"]["flow"]
+        cache = next(name for name, names in CACHE_FLOWS.items() if flow in names)
+        entry = per_run.setdefault(run_id, {"run_id": run_id, "started": started[run_id], "caches": {}})
+        c = entry["caches"].setdefault(cache, {"llm_calls": 0, "cache_hits": 0})
+        c["llm_calls"] += r["calls"]
+        c["cache_hits"] += r["cache_hits"]
+        if flow == "flow2_semantic":
+            c["semantic_hits"] = c.get("semantic_hits", 0) + r["cache_hits"]
+        elif flow.endswith("_shared"):
+            c["shared_hits"] = c.get("shared_hits", 0) + r["cache_hits"]
+
+    for entry in per_run.values():
+        for c in entry["caches"].values():
+            requested = c["llm_calls"] + c["cache_hits"]
+            c["hit_ratio"] = round(c["cache_hits"] / requested, 4) if requested else 0
+    return sorted(per_run.values(), key=lambda e: e["started"], reverse=True)
+
+
+def cache_report(caches=("flow2", "7eleven"), runs=10, top=20):
+    """Full analytics report for GET /cache/stats."""
+    report = {"generated_at": datetime.utcnow().isoformat(), "caches": {}}
+    for name in caches:
+        target = get_cache(name)
+        target.flush(force=True)  # persist buffered hit counts first
+        ages, versions = version_and_age(name)
+        report["caches"][name] = {
+            "collection": target.collection,
+            "entries": get_collection(target.collection).estimated_document_count(),
+            "memory": target.stats(),
+            "brands": brand_counts(name),
+            "age_days": ages,
+            "versions": versions,
+            "top_requested": top_requested(name, top),
+        }
+    report["runs"] = run_hit_ratios(runs)
+    saved = sum(c["cache_hits"] for r in report["runs"] for c in r["caches"].values())
+    made = sum(c["llm_calls"] for r in report["runs"] for c in r["caches"].values())
+    report["totals"] = {
+        "llm_calls": made,
+        "calls_saved_by_cache": saved,
+        "hit_ratio": round(saved / (saved + made), 4) if saved + made else 0,
+    }
+    return report
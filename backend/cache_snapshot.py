@@ -0,0 +1,282 @@
+"""
+Compact on-disk snapshot of the LLM caches (LLM_CACHE_STORAGE and 7-eleven_llm_cache).
+
+The snapshot is a single SQLite file (one WITHOUT ROWID table keyed on (cache, key), compact
+JSON results, memory-mapped reads). It replaces ad-hoc JSON dumps such as LLM_CACHE_STORAGE.json:
+
+  - check_script tools read cache entries from it instead of querying MongoDB
+  - fresh backend workers warm their in-process LRU from it on startup (LLM_CACHE_SNAPSHOT_WARM)
+  - it can be restored into MongoDB on a new machine
+
+Readers open the file read-only and immutable, so any number of processes can share it. Exports
+are written to a temporary file and swapped in atomically, so readers never see a partial file.
+Flow 2 results are exported with the rule guards applied; readers skip re-applying them unless
+the guards changed since the export.
+
+Usage:
+    python -m backend.cache_snapshot export
+    python -m backend.cache_snapshot info
+    python -m backend.cache_snapshot import --into-mongo
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from pymongo import UpdateOne
+
+try:
+    from backend.database import get_collection
+    from backend.llm_cache import get_cache
+except ImportError:
+    # Fallback: if imported from inside the backend folder
+    from database import get_collection
+    from llm_cache import get_cache
+
+SNAPSHOT_PATH = Path(os.getenv("LLM_CACHE_SNAPSHOT", Path(__file__).parent.parent / "llm_cache_snapshot.sqlite"))
+MMAP_BYTES = int(os.getenv("LLM_CACHE_SNAPSHOT_MMAP_MB", "256")) * 1024 * 1024
+# lookup() ignores snapshots exported longer ago than this and reads the live cache instead
+MAX_AGE_HOURS = float(os.getenv("LLM_CACHE_SNAPSHOT_MAX_AGE_HOURS", "24"))
+CACHE_NAMES = ["flow2", "7eleven"]
+# Stored next to the result so an import restores the full document
+META_FIELDS = ["version", "tier", "cached_at", "clean_key", "token_key", "reused_from", "reuse_match",
+               "hit_count", "last_hit_at"]
+
+_SCHEMA = """
+CREATE TABLE entries (
+    cache  TEXT NOT NULL,
+    key    TEXT NOT NULL,
+    result TEXT NOT NULL,
+    meta   TEXT,
+    PRIMARY KEY (cache, key)
+) WITHOUT ROWID;
+CREATE TABLE info (name TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+"""
+
+
+def _on_load_fingerprint(name):
+    """
+    Version of the load-time rule guards. Flow 2 results are stored with the guards already
+    applied, so readers only re-apply them when the guards changed after the export.
+    """
+    if name != "flow2":
+        return None
+    try:
+        from backend.processor import FLOW2_LOAD_GUARD_VERSION
+    except ImportError:
+        from processor import FLOW2_LOAD_GUARD_VERSION
+    return FLOW2_LOAD_GUARD_VERSION
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def export_snapshot(path=SNAPSHOT_PATH, caches=CACHE_NAMES, batch_size=5000):
+    """Write the given caches from MongoDB to a fresh snapshot file. Returns {cache: entries}."""
+    path = Path(path)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    started = time.time()
+    counts = {}
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;" + _SCHEMA)
+        for name in caches:
+            cache = get_cache(name)
+            cache.flush(force=True)  # hit counts are exported with the entries
+            counts[name] = 0
+            rows = []
+            for doc in get_collection(cache.collection).find({}, {"_id": 0}):
+                key = doc.get(cache.key_field)
+                if not key or doc.get("result") is None:
+                    continue
+                result = cache.on_load(key, doc["result"]) if cache.on_load else doc["result"]
+                meta = {f: doc[f] for f in META_FIELDS if f in doc}
+                rows.append((name, key, _dumps(result), _dumps(meta) if meta else None))
+                if len(rows) >= batch_size:
+                    conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", rows)
+                    counts[name] += len(rows)
+                    rows = []
+            if rows:
+                conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", rows)
+                counts[name] += len(rows)
+        info = [("exported_at", datetime.utcnow().isoformat()), ("counts", _dumps(counts))]
+        for name in caches:
+            fingerprint = _on_load_fingerprint(name)
+            if fingerprint:
+                info.append((f"on_load:{name}", fingerprint))
+        conn.executemany("INSERT INTO info VALUES (?, ?)", info)
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+    size_mb = path.stat().st_size / (1024 * 1024)
+    print(f"💾 LLM cache snapshot: {counts} -> {path} ({size_mb:.1f} MB, {time.time() - started:.1f}s)")
+    return counts
+
+
+class SnapshotReader:
+    """Read-only, memory-mapped access to a snapshot file; safe to share across processes."""
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"No LLM cache snapshot at {self.path} (run: python -m backend.cache_snapshot export)")
+        self.conn = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro&immutable=1", uri=True,
+                                    check_same_thread=False)
+        self.conn.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def info(self):
+        info = dict(self.conn.execute("SELECT name, value FROM info"))
+        info["counts"] = json.loads(info.get("counts", "{}"))
+        info["path"] = str(self.path)
+        info["size_mb"] = round(self.path.stat().st_size / (1024 * 1024), 2)
+        return info
+
+    def age_hours(self):
+        """Hours since the snapshot was exported (None if unknown)."""
+        row = self.conn.execute("SELECT value FROM info WHERE name = 'exported_at'").fetchone()
+        if not row:
+            return None
+        return (datetime.utcnow() - datetime.fromisoformat(row[0])).total_seconds() / 3600
+
+    def needs_on_load(self, cache):
+        """True if results must go through the cache's on_load hook (guards changed since export)."""
+        fingerprint = _on_load_fingerprint(cache)
+        if fingerprint is None:
+            return False
+        row = self.conn.execute("SELECT value FROM info WHERE name = ?", (f"on_load:{cache}",)).fetchone()
+        return not row or row[0] != fingerprint
+
+    def get(self, cache, key):
+        row = self.conn.execute("SELECT result FROM entries WHERE cache = ? AND key = ?", (cache, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, cache, keys, chunk_size=500):
+        """Stored results for the given keys, as exported. Returns {key: result}."""
+        keys = list(dict.fromkeys(k for k in keys if k))
+        found = {}
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            marks = ",".join("?" * len(chunk))
+            query = f"SELECT key, result FROM entries WHERE cache = ? AND key IN ({marks})"
+            for key, result in self.conn.execute(query, [cache, *chunk]):
+                found[key] = json.loads(result)
+        return found
+
+    def documents(self, cache):
+        """Iterate (key, result, meta) for every entry of one cache."""
+        for key, result, meta in self.conn.execute(
+                "SELECT key, result, meta FROM entries WHERE cache = ?", (cache,)):
+            yield key, json.loads(result), json.loads(meta) if meta else {}
+
+
+def lookup(cache, keys, path=SNAPSHOT_PATH, live=False, max_age_hours=MAX_AGE_HOURS):
+    """
+    Cached results for scripts: from the snapshot when one exists and was exported within
+    `max_age_hours`, otherwise from the live cache. Pass live=True to skip the snapshot, e.g. to
+    verify a cache fix made since the last export. Flow 2 results reflect the current rule guards
+    either way.
+    """
+    target = get_cache(cache)
+    if live or not Path(path).exists():
+        return target.get_many(keys)
+    with SnapshotReader(path) as reader:
+        age = reader.age_hours()
+        if age is None or age > max_age_hours:
+            print(f"Snapshot {path} is older than {max_age_hours}h - reading the live {cache} cache")
+            return target.get_many(keys)
+        found = reader.get_many(cache, keys)
+        if target.on_load and reader.needs_on_load(cache):
+            found = {key: target.on_load(key, result) for key, result in found.items()}
+    return found
+
+
+def warm_cache(cache, path=SNAPSHOT_PATH, limit=None):
+    """
+    Fill a cache's in-process tier from the snapshot (no MongoDB round-trips). Entries are subject
+    to the cache's version policy. Returns the number of entries loaded.
+    """
+    target = get_cache(cache)
+    loaded = 0
+    limit = limit or target.max_entries
+    with SnapshotReader(path) as reader:
+        on_load = target.on_load if reader.needs_on_load(cache) else None
+        for key, result, meta in reader.documents(cache):
+            if not target._accept(key, meta):
+                continue
+            target.put_local(key, on_load(key, result) if on_load else result)
+            loaded += 1
+            if loaded >= limit:
+                break
+    return loaded
+
+
+def import_snapshot(path=SNAPSHOT_PATH, caches=CACHE_NAMES, batch_size=1000):
+    """Restore a snapshot into MongoDB (upsert per key). Returns {cache: entries}."""
+    counts = {}
+    with SnapshotReader(path) as reader:
+        for name in caches:
+            cache = get_cache(name)
+            coll = get_collection(cache.collection)
+            counts[name] = 0
+            ops = []
+            for key, result, meta in reader.documents(name):
+                ops.append(UpdateOne({cache.key_field: key},
+                                     {"$set": {cache.key_field: key, "result": result, **meta}}, upsert=True))
+                if len(ops) >= batch_size:
+                    coll.bulk_write(ops, ordered=False)
+                    counts[name] += len(ops)
+                    ops = []
+            if ops:
+                coll.bulk_write(ops, ordered=False)
+                counts[name] += len(ops)
+    print(f"📥 Restored LLM cache snapshot {path}: {counts}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export / import / inspect the LLM cache snapshot")
+    parser.add_argument("command", choices=["export", "import", "warm", "info"])
+    parser.add_argument("--path", default=str(SNAPSHOT_PATH))
+    parser.add_argument("--cache", choices=CACHE_NAMES + ["all"], default="all")
+    parser.add_argument("--into-mongo", action="store_true", help="import: upsert the snapshot into MongoDB")
+    args = parser.parse_args()
+    caches = CACHE_NAMES if args.cache == "all" else [args.cache]
+
+    if args.command == "export":
+        result = export_snapshot(args.path, caches)
+    elif args.command == "import":
+        if not args.into_mongo:
+            parser.error("import writes to MongoDB; pass --into-mongo to confirm")
+        result = import_snapshot(args.path, caches)
+    elif args.command == "warm":
+        started = time.time()
+        result = {name: warm_cache(name, args.path) for name in caches}
+        result["seconds"] = round(time.time() - started, 3)
+    else:
+        with SnapshotReader(args.path) as reader:
+            result = reader.info()
+    print(json.dumps(result, indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
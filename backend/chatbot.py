@@ -7,6 +7,7 @@ from backend.database import get_collection
 from datetime import datetime
 from backend.database import get_collection, MASTER_STOCK_COL
 from backend.llm_client import llm_client, flow2_client
+from backend.llm_schemas import CHATBOT_MASTER_NODE_SCHEMA, CHATBOT_QUERY_SCHEMA
 
 # Path for Domain Knowledge
 DOMAIN_KNOWLEDGE_PATH = os.path.join(os.path.dirname(__file__), "CHATBOT_DOMAIN_KNOWLEDGE.txt")
@@ -90,13 +91,16 @@ Question: "Show Pocky details in Malaysia for reach"
 Output: {{"BRAND": "GLICO", "ITEM": "POCKY", "MARKET": "Pen Malaysia", "FACTS": "Weighted Distribution", "SORT": -1, "LIMIT": 20}}
 """
     try:
-        master_node_raw = llm_client.chat_completion(
+        master_node_json = llm_client.chat_json(
             system_prompt=master_node_prompt,
             user_message=question,
+            schema=CHATBOT_MASTER_NODE_SCHEMA,
+            flow="chatbot",
             temperature=0
         )
-        master_node_json = json.loads(master_node_raw.strip())
     except:
+        master_node_json = None
+    if not master_node_json:
         master_node_json = {"question": question, "ITEM": question_lower} # Fallback
 
     # -------------------------------------------------------------------------
@@ -138,28 +142,21 @@ Database: {total_count} products (MongoDB).
 
     try:
         # Step A: OpenAI Query Generation (Using llm_client for Azure Claude)
-        raw_content = llm_client.chat_completion(
+        result = llm_client.chat_json(
             system_prompt=system_prompt,
             user_message=question,
+            schema=CHATBOT_QUERY_SCHEMA,
+            flow="chatbot",
             temperature=0
         )
-        
-        raw_content = raw_content.strip()
-        # Find the outermost { } to extract JSON even if there's surrounding text
-        start = raw_content.find("{")
-        end = raw_content.rfind("}")
-        if start != -1 and end != -1:
-            raw_content = raw_content[start:end+1]
-
-        try:
-            result = json.loads(raw_content)
-        except json.JSONDecodeError:
+
+        if result is None:
             return {
                 "answer": "I understood your technical request, but I had trouble formatting the database command properly. Please try asking in plain English (e.g., 'Show me Oreo items with more than one UPC').",
                 "data": [],
                 "query_used": {},
                 "result_count": 0,
-                "explanation": f"JSON Parsing Error. Raw: {raw_content[:100]}"
+                "explanation": "JSON Parsing Error. The AI did not return a valid query after schema retries."
             }
 
         query = result.get("query", {})
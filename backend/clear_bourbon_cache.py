@@ -1,13 +1,12 @@
-from pymongo import MongoClient
-import re
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
 
-client = MongoClient('mongodb://localhost:27017')
-db = client['fmcg_mastering']
-cache_coll = db['LLM_CACHE_STORAGE']
+from backend.cache_admin import invalidate
 
 # Match any cached item name containing Bourbon keywords
 terms = ['BOURBON', 'GOKOKU', 'CEBEURE']
 pattern = '|'.join(terms)
 
-result = cache_coll.delete_many({'item': {'$regex': pattern, '$options': 'i'}})
-print(f"Deleted {result.deleted_count} stale cache entries for BOURBON items.")
+report = invalidate("flow2", regex=pattern)
+print(f"Deleted {report['caches']['flow2'].get('deleted', 0)} stale cache entries for BOURBON items.")
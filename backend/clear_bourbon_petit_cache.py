@@ -1,11 +1,11 @@
+import re
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
 
-from pymongo import MongoClient
+from backend.cache_admin import invalidate
 
 def clear_specific_cache():
-    client = MongoClient('mongodb://localhost:27017')
-    db = client['fmcg_mastering']
-    cache_coll = db['LLM_CACHE_STORAGE']
-    
     # Target items reported by user
     # Note: cache stores the "context-aware" item name used during LLM call
     targets = [
@@ -15,10 +15,8 @@ def clear_specific_cache():
     
     print(f"--- Selective Cache Clear ---")
     for item in targets:
-        # Standardize matching to how processor.py lookups work
-        # Sometimes brand is prepended in context, so we check both
-        res = cache_coll.delete_many({"item": {"$regex": item, "$options": "i"}})
-        print(f"Deleted {res.deleted_count} cache entries for: {item}")
+        report = invalidate("flow2", regex=re.escape(item))
+        print(f"Deleted {report['caches']['flow2'].get('deleted', 0)} cache entries for: {item}")
 
 if __name__ == "__main__":
     clear_specific_cache()
@@ -1,11 +1,11 @@
+import re
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
 
-from pymongo import MongoClient
+from backend.cache_admin import invalidate
 
 def clear_langue_de_chat_cache():
-    client = MongoClient('mongodb://localhost:27017')
-    db = client['fmcg_mastering']
-    cache_coll = db['LLM_CACHE_STORAGE']
-    
     targets = [
         "BOURBON PETIT LANGUE DE CHA CHCLTE 47G",
         "BOURBON PETIT LANGUE DE CH WCHCLTE 47G"
@@ -13,8 +13,8 @@ def clear_langue_de_chat_cache():
     
     print(f"--- Selective Cache Clear (Langue de Chat) ---")
     for item in targets:
-        res = cache_coll.delete_many({"item": {"$regex": item, "$options": "i"}})
-        print(f"Deleted {res.deleted_count} cache entries for: {item}")
+        report = invalidate("flow2", regex=re.escape(item))
+        print(f"Deleted {report['caches']['flow2'].get('deleted', 0)} cache entries for: {item}")
 
 if __name__ == "__main__":
     clear_langue_de_chat_cache()
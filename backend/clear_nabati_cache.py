@@ -2,25 +2,24 @@
 Clear stale LLM cache entries for Nabati, Richeese, Nextar items.
 This forces Flow 2 to re-call the LLM with the updated prompt/rules.
 """
-from pymongo import MongoClient
-import re
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
 
-client = MongoClient('mongodb://localhost:27017')
-db = client['fmcg_mastering']
-cache_coll = db['LLM_CACHE_STORAGE']
+from backend.cache_admin import invalidate, find_keys
 
 # Match any cached item name containing these keywords
 terms = ['NABATI', 'RICHEESE', 'NEXTAR']
 pattern = '|'.join(terms)
 
-result = cache_coll.delete_many({'item': {'$regex': pattern, '$options': 'i'}})
-print(f"Deleted {result.deleted_count} stale cache entries for NABATI/RICHEESE/NEXTAR items.")
+report = invalidate("flow2", regex=pattern)
+print(f"Deleted {report['caches']['flow2'].get('deleted', 0)} stale cache entries for NABATI/RICHEESE/NEXTAR items.")
 
 # Also show what's remaining related
-remaining = list(cache_coll.find({'item': {'$regex': pattern, '$options': 'i'}}, {'item': 1}))
+remaining = find_keys("flow2", regex=pattern)
 if remaining:
     print(f"WARNING: {len(remaining)} entries still remain:")
-    for r in remaining:
-        print(f"  - {r['item']}")
+    for item in remaining:
+        print(f"  - {item}")
 else:
     print("Cache clean for these brands.")
@@ -1,11 +1,11 @@
+import re
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
 
-from pymongo import MongoClient
+from backend.cache_admin import invalidate
 
 def clear_pocky_cache():
-    client = MongoClient('mongodb://localhost:27017')
-    db = client['fmcg_mastering']
-    cache_coll = db['LLM_CACHE_STORAGE']
-    
     targets = [
         "GLICO POCKY BISC FAMILY P CHCLTE 176GM",
         "POCKY FAMILY PACK CHOCOLATE 176G"
@@ -14,8 +14,8 @@ def clear_pocky_cache():
     print(f"--- Selective Cache Clear (Pocky) ---")
     for item in targets:
         # Match using regex to handle varying context-aware names
-        res = cache_coll.delete_many({"item": {"$regex": item, "$options": "i"}})
-        print(f"Deleted {res.deleted_count} cache entries for: {item}")
+        report = invalidate("flow2", regex=re.escape(item))
+        print(f"Deleted {report['caches']['flow2'].get('deleted', 0)} cache entries for: {item}")
 
 if __name__ == "__main__":
     clear_pocky_cache()
@@ -22,6 +22,8 @@ db = client[DB_NAME]
 RAW_DATA_COL = "raw_data"
 SINGLE_STOCK_COL = "single_stock_data"
 MASTER_STOCK_COL = "master_stock_data"
+# Flow 2 incremental mastering: pre-group key + result hash per single-stock doc content
+FLOW2_STATE_COL = "flow2_mastering_state"
 
 def get_collection(name):
     return db[name]
@@ -32,6 +34,7 @@ def reset_main_collections():
         db[RAW_DATA_COL].delete_many({})
         db[SINGLE_STOCK_COL].delete_many({})
         db[MASTER_STOCK_COL].delete_many({})
+        db[FLOW2_STATE_COL].delete_many({})
         print(f"🧹 Reset complete: {RAW_DATA_COL}, {SINGLE_STOCK_COL}, {MASTER_STOCK_COL} cleared.")
     except Exception as e:
         print(f"⚠️ Reset error: {e}")
@@ -44,6 +47,18 @@ def clear_llm_cache():
     except Exception as e:
         print(f"⚠️ Cache clear error: {e}")
 
+def _dedupe_collection(coll, key):
+    """Keep only the newest document per `key` so a unique index can be built. Returns the number removed."""
+    removed = 0
+    dupes = coll.aggregate([
+        {"$group": {"_id": f"${key}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    for group in dupes:
+        stale = sorted(group["ids"])[:-1]
+        removed += coll.delete_many({"_id": {"$in": stale}}).deleted_count
+    return removed
+
 def create_indexes():
     """
     Create MongoDB indexes for faster upserts and queries.
@@ -63,6 +78,12 @@ def create_indexes():
                                    name="merged_from_docs_idx",
                                    background=True)
         print(f"✅ Created index: {MASTER_STOCK_COL} (merged_from_docs)")
+
+        # MASTER_STOCK: Multikey index for incremental Flow 2 (replace records of touched pre-groups)
+        master_stock.create_index([("pre_group_keys", ASCENDING)],
+                                   name="pre_group_keys_idx",
+                                   background=True)
+        print(f"✅ Created index: {MASTER_STOCK_COL} (pre_group_keys)")
         
         # SINGLE_STOCK: Index (Fixed Collection)
         single_stock = db[SINGLE_STOCK_COL]
@@ -83,11 +104,71 @@ def create_indexes():
                                name="sheet_name_idx",
                                background=True)
         print(f"✅ Created index: {RAW_DATA_COL} (sheet_name)")
-        
+
+        # LLM_CACHE_STORAGE: Unique item lookup (every Flow 2 cache check / upsert)
+        if "item_unique_idx" not in db["LLM_CACHE_STORAGE"].index_information():
+            removed = _dedupe_collection(db["LLM_CACHE_STORAGE"], "item")
+            if removed:
+                print(f"🧹 Removed {removed} duplicate LLM_CACHE_STORAGE entries before indexing")
+        db["LLM_CACHE_STORAGE"].create_index([("item", ASCENDING)],
+                                             name="item_unique_idx",
+                                             unique=True,
+                                             background=True)
+        print("✅ Created index: LLM_CACHE_STORAGE (item, unique)")
+
+        # LLM_CACHE_STORAGE: Secondary keys for reusing results of reworded items
+        for field in ("clean_key", "token_key"):
+            db["LLM_CACHE_STORAGE"].create_index([(field, ASCENDING)],
+                                                 name=f"{field}_idx",
+                                                 sparse=True,
+                                                 background=True)
+        print("✅ Created index: LLM_CACHE_STORAGE (clean_key, token_key)")
+
+        # 7-eleven_llm_cache: Unique article_description lookup ($in prefetch / bulk upserts on import)
+        if "article_description_unique_idx" not in db["7-eleven_llm_cache"].index_information():
+            removed = _dedupe_collection(db["7-eleven_llm_cache"], "article_description")
+            if removed:
+                print(f"🧹 Removed {removed} duplicate 7-eleven_llm_cache entries before indexing")
+        db["7-eleven_llm_cache"].create_index([("article_description", ASCENDING)],
+                                              name="article_description_unique_idx",
+                                              unique=True,
+                                              background=True)
+        print("✅ Created index: 7-eleven_llm_cache (article_description, unique)")
+
+        # 7-eleven_data: Article code upserts on import
+        for field in ("ArticleCode", "Article_Code"):
+            db["7-eleven_data"].create_index([(field, ASCENDING)],
+                                             name=f"{field}_idx",
+                                             sparse=True,
+                                             background=True)
+        print("✅ Created index: 7-eleven_data (ArticleCode / Article_Code)")
+
+        # ATTRIBUTE_CACHE: Canonical attributes shared by the Nielsen and 7-Eleven flows
+        db["ATTRIBUTE_CACHE"].create_index([("product_key", ASCENDING)],
+                                           name="product_key_unique_idx",
+                                           unique=True,
+                                           background=True)
+        print("✅ Created index: ATTRIBUTE_CACHE (product_key, unique)")
+
+        # 7-eleven_data: GTIN key for incremental imports without an article code
+        db["7-eleven_data"].create_index([("GTIN", ASCENDING)], name="GTIN_idx", sparse=True, background=True)
+
+        # 7-eleven_changes: Pending change sets for incremental mapping
+        db["7-eleven_changes"].create_index([("mapped_at", ASCENDING), ("created_at", ASCENDING)],
+                                            name="mapped_at_created_at_idx",
+                                            background=True)
+        print("✅ Created index: 7-eleven_data (GTIN), 7-eleven_changes (mapped_at)")
+
+        # LLM_USAGE: Per-run summaries
+        db["LLM_USAGE"].create_index([("run_id", ASCENDING), ("ts", ASCENDING)],
+                                     name="run_id_ts_idx",
+                                     background=True)
+        print("✅ Created index: LLM_USAGE (run_id + ts)")
+
         print("🚀 All MongoDB indexes created successfully!")
         
     except Exception as e:
         print(f"⚠️ Index creation error (might already exist): {e}")
 
 # Export db for direct access when needed (e.g., reset endpoint)
-__all__ = ['get_collection', 'db', 'create_indexes', 'reset_main_collections', 'RAW_DATA_COL', 'SINGLE_STOCK_COL', 'MASTER_STOCK_COL']
+__all__ = ['get_collection', 'db', 'create_indexes', 'reset_main_collections', 'RAW_DATA_COL', 'SINGLE_STOCK_COL', 'MASTER_STOCK_COL', 'FLOW2_STATE_COL']
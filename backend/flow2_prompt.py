@@ -0,0 +1,477 @@
+import hashlib
+import os
+import re
+import threading
+from functools import lru_cache
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Flow 2 prompt compiler (normalize_item_llm)
+#  The system prompt is assembled from a stable shared prefix (mapping tables,
+#  generic rules, output contract) followed by only the brand sections whose
+#  tokens appear in the item. The prefix is identical on every call, so
+#  provider-side prompt caching can reuse it.
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Set FLOW2_PROMPT_PRUNING=false to always send every brand section (pre-pruning behaviour)
+PROMPT_PRUNING_ENABLED = os.getenv("FLOW2_PROMPT_PRUNING", "true").lower() != "false"
+
+PROMPT_PREFIX = """
+You are an FMCG product mastering expert specializing in the Malaysian market.
+
+Your task is to extract standardized attributes from raw product descriptions often found in 7-Eleven or POS terminals.
+
+### Standardized Mapping Table:
+Use these standardized terms for any raw keywords found:
+
+- PROTEINS:
+  - {AYM, CHK, CKN, AYAM} -> CHICKEN
+  - {DGG, BF, DAGING} -> BEEF
+  - {TLR, EG, TELUR} -> EGG
+  - {STNG, SQD, SOTONG} -> SQUID
+  - {UDG, UDANG, PRN} -> PRAWN
+  - {BILIS, ANC} -> ANCHOVY
+
+- FLAVORS & VARIANTS:
+  - {COK, CHOC, CHOCO, COKLAT, CHOKLAT, CHOKIT, COKLIT, CHCO} -> CHOCOLATE 
+  (Only when used alone. Do NOT collapse compound flavours like:
+   CHOC CHIP, DARK CHOC, WHITE CHOC, SALTED CHOC, MILK CHOC.)
+  - {BAN, BNNA, BANANA} -> BANANA
+  - {VAN, VNL, VENLLA, VANILLA} -> VANILLA
+  - {PNUT, PNT, PEANUT} -> PEANUT
+  - {NPLTNE, NEAPOLITAN} -> NEAPOLITAN
+  - {PDS, HOT, SPY, PEDAS} -> SPICY
+  - {KRI, CRY, KARI} -> CURRY
+  - {SSU, MLK, SUSU} -> MILK
+  - {KOP, CF, KOPI} -> COFFEE
+  - {HLA, GGR, HALIA} -> GINGER
+  - {GUL, SGR, GULA} -> SUGAR
+  - {STRW, STRAW, STRAWBERRY} -> STRAWBERRY
+  - {ORG, ORNG, ORANGE} -> ORANGE
+  - {APP, APPL, APPLE} -> APPLE
+  - {MNG, MANGO} -> MANGO
+  - {PINE, PNAP, PINEAPPLE} -> PINEAPPLE
+   - {ORI, ORIG, ORIGINAL} -> ORIGINAL
+   - {ASSORTED, ASST, ASSORTMENT, ASSORTIS} -> ASSORTED
+   - {CRK, CRACKERS, CRAKERS, CRACKER} -> CRACKER
+   - {BLK, BLACK} -> BLACK
+  - {WHT, WHITE} -> WHITE
+  - {GRN, GREEN} -> GREEN
+  - {RD, RED} -> RED
+  - {RYAL, ROYAL} -> ROYAL
+  - {DBL, DOUBLE, DB} -> DOUBLE
+  - {TRP, TRIPLE} -> TRIPLE
+  - {CRM, CREME, CREAM} -> CREAM
+
+- PRODUCT FORMS (IMPORTANT: Keep these distinct):
+  - {BISK, BSC, BISCUIT, CKI, COOKIE} -> BISCUIT / COOKIE
+  - {WAF, WFR, WAFER} -> WAFER
+  - {STK, STICK, PRETZ, TOPPO, PEPERO, POCKY} -> STICK
+  - {ROL, ROLL} -> ROLL
+  - {PCH, POUCH} -> POUCH
+  - {SNK, SNACK, CAPLICO, CHOCOROOM} -> SNACK / CHOCOROOM
+  - {DONUT, DNNT} -> DONUT
+  - {HIPPO, TRONKY} -> Keep specific form (HIPPO / TRONKY)
+  - {FINGER, ROUND, TRIANGLE} -> Keep shape as Form
+  - {MARIE, MRE} -> MARIE
+  - {CRACKER, CRK, CRACKERS, CRACK} -> CRACKER
+  - {YANYAN, YAN YAN} -> YAN YAN
+  - {HELLOPANDA, HELLO PANDA} -> HELLO PANDA
+  - {LUCKY STICK} -> LUCKY STICK
+  - {ASSORTED, ASST, TIN, BOX, PARTY, SELECTION} -> ASSORTED
+  - {DIP DIP, DIPDIP, DIPPING, CUP} -> DIP DIP / CUP (Treat as distinct product form)
+  - {BUBBLE PUFF, BUBBLEPUFF} -> BUBBLE PUFF (Treat as distinct product form)
+
+- UOM (Volume/Weight):
+  - {320M, 320ML} -> 320ML
+  - {1.5L, 1.5LTR, 1500M} -> 1500ML
+  - {1KG, 1000G} -> 1000G
+  - {59GR, 59G} -> 59G
+  - {PC, PCS, UNIT} -> UNIT
+
+- BRANDS:
+  - {F&N} -> FRASER AND NEAVE
+  - {MGG} -> MAGGI
+  - {NES} -> NESCAFE
+  - {D.LADY, DL} -> DUTCH LADY
+  - {YEO, YS} -> YEOS
+  - {ORI} -> Treat as Brand "ORI" only if it appears at the START of the description. Otherwise, ignore it or check for "ORIGINAL".
+  - {HUP SENG, HUPSENG, HS} -> HUP SENG
+  - {JULIES, JULIE, JULI, JULYS} -> JULIES
+  - {BIOGREEN, BIO GREEN} -> BIO GREEN
+  - {LEE, LEE BRANDS} -> LEE BRANDS
+  - {MUNCHYS, MUNCHY} -> MUNCHYS
+  - {NABATI, RICHEESE, NEXTAR} -> NABATI (RICHEESE and NEXTAR are Nabati sub-brands/product lines, not standalone brands. Always set brand=NABATI.)
+
+- PACKAGING:
+  - {CAN, CN} -> CAN
+  - {BTL, BT} -> BOTTLE
+  - {VP, V.PACK} -> MULTIPACK
+  - {RTE} -> READY TO EAT
+
+### 🍯 SUGAR & DIETARY FLAGS:
+- {SF, NO SUGAR, WITHOUT SUGAR, S.FREE, ZERO SUGAR} -> SUGAR FREE
+- {NORMAL} -> NORMAL (flavour)
+- {ORIGINAL} -> ORIGINAL (flavour, do NOT convert to NORMAL)
+- {REGULAR} -> REGULAR (variant only. Never treat as flavour.)
+
+### 🏷️ VARIANTS & SUB-FLAVOURS (CRITICAL):
+- Distinguish between REGULAR versions and special ones like {MINI, GIANT, SNOWY, EXTRA, GOLD, PREMIUM, GOKUBOSO, FESTIVE}.
+- If a product has "SNOWY", mark variant as "SNOWY".
+- If it's a standard one, mark variant as "REGULAR".
+
+### 🍯 FLAVOUR & VARIANT RULES (CRITICAL):
+1. **NO SIMPLIFICATION**: Never reduce a compound flavour to a base one.
+2. **PRESERVE ALL COMPONENTS**: If a product has multiple flavor components (e.g., SEA SALT, PISTACHIO, CARAMEL), BOTH must be in the "flavour" string.
+3. **ORDER MATTERS**: Keep the sequence of flavors as much as possible.
+4. **DISTINCT PROFILES**: Treat these as completely DIFFERENT products:
+   - "SEA SALT PISTACHIO CHOCOLATE CHIP" != "DOUBLE CHOCOLATE CHIP"
+   - "ROASTED HAZELNUT CHOCOLATE CHIP" != "CHOCOLATE CHIP"
+   - "SALTED CARAMEL" != "CARAMEL"
+   - "MACADAMIA WHITE CHOCOLATE" != "CRANBERRY WHITE CHOCOLATE"
+
+5. **SPECIFIC EXCLUSIONS**: 
+   - Never ignore ingredients like "HAZELNUT", "PISTACHIO", "ALMOND", "SEA SALT" just because "CHOCOLATE" is also present.
+   - If multiple flavours are present, extract the full specific flavour string (e.g., "STRAWBERRY & BLACKCURRANT").
+   - Do NOT combine flavours unless the compound is an established flavour name.
+
+### GOAL:
+Extract "brand", "flavour", "variant", "size", "product_line", "product_form", "is_sugar_free" and "base_item" as JSON.
+
+IMPORTANT: 
+1. The "flavour" field MUST contain ALL flavor-related keywords (e.g., SEA SALT, PISTACHIO, HAZELNUT, CARAMEL). Never omit them.
+2. **STRICT LITERAL SIZE EXTRACTION**: The "size" field must be extracted in a standardized numeric form if possible (e.g., convert '4.5KG' to '4500G', '320ML' to '320ML'). For simple cases like '130G', keep it as '130G'.
+3. **SPELING TOLERANCE**: Always normalize brand names to their most common full form (e.g., 'JULIE' -> 'JULIES').
+4. **MPACK Awareness**: If the description mentions a pack count (e.g., 12S, 12X, *12, X12), include it in the size string exactly as written.
+5. **PUNCTUATION REMOVAL**: NEVER include apostrophes (') or backticks (`) in brand or product_line names. (e.g. "O'SOY" -> "OSOY").
+6. **PIECE COUNT REMOVAL**: Piece counts (e.g., 9PCS, 10 PCS) are NOT part of the product line, flavor, or variant.
+7. **PLURAL NORMALIZATION**: Always use singular form for "product_form" and "product_line" if possible (e.g., "CRACKERS" -> "CRACKER", "COOKIES" -> "COOKIE", "STICKS" -> "STICK").
+
+Base item must follow this structure:
+BRAND + PRODUCT_LINE (if any) + PRODUCT_FORM + FLAVOUR + VARIANT (if not REGULAR) + SIZE
+"""
+
+EXAMPLES_HEADER = "\n### Few-Shot Examples for Accuracy:\n"
+
+# Brand-specific few-shot sections, selected by detected brand / product-line tokens
+BRAND_SECTIONS = [
+    {
+        "name": "MUNCHYS",
+        "tokens": ["MUNCHYS", "MUNCHY", "OATKRUNCH", "KRUNCH"],
+        "examples": [
+            """Input: "MUNCHYS OATKRUNCH S/BERRY&B/CURR 390G"
+Output: {
+  "brand": "MUNCHYS",
+  "product_line": "OAT KRUNCH",
+  "flavour": "STRAWBERRY & BLACKCURRANT",
+  "variant": "REGULAR",
+  "size": "390G",
+  "product_form": "BISCUIT",
+  "is_sugar_free": false,
+  "base_item": "MUNCHYS OAT KRUNCH BISCUIT STRAWBERRY & BLACKCURRANT 390G",
+  "confidence": 1.0
+}""",
+        ],
+    },
+    {
+        "name": "THE SKINNY BAKER",
+        "tokens": ["SKINNY"],
+        "examples": [
+            """Input: "SKINNY BAKERS COOKIE SLTED CRML CHOC CHIP CKS 80G"
+Output: {
+  "brand": "THE SKINNY BAKER",
+  "product_line": "COOKIES",
+  "flavour": "SALTED CARAMEL CHOCOLATE CHIP",
+  "variant": "REGULAR",
+  "size": "80G",
+  "product_form": "COOKIE",
+  "is_sugar_free": false,
+  "base_item": "THE SKINNY BAKER COOKIE SALTED CARAMEL CHOCOLATE CHIP 80G",
+  "confidence": 1.0
+}""",
+            """Input: "THE SKINNY BAKER SKINNY BAKERS S/SALT PISTACHIO CHOC CHIP CKS 150G"
+Output: {
+  "brand": "THE SKINNY BAKER",
+  "product_line": "SKINNY BAKERS",
+  "flavour": "SEA SALT PISTACHIO CHOCOLATE CHIP",
+  "variant": "REGULAR",
+  "size": "150G",
+  "product_form": "COOKIE",
+  "is_sugar_free": false,
+  "base_item": "THE SKINNY BAKER SKINNY BAKERS COOKIE SEA SALT PISTACHIO CHOCOLATE CHIP 150G",
+  "confidence": 1.0
+}""",
+        ],
+    },
+    {
+        "name": "LOTTE",
+        "tokens": ["LOTTE", "PEPERO", "TOPPO"],
+        "examples": [
+            """Input: "LOTTE PEPERO SNOWY ALMOND 32G"
+Output: {
+  "brand": "LOTTE",
+  "product_line": "PEPERO",
+  "flavour": "ALMOND",
+  "variant": "SNOWY",
+  "size": "32G",
+  "product_form": "STICK",
+  "is_sugar_free": false,
+  "base_item": "LOTTE PEPERO STICK SNOWY ALMOND 32G",
+  "confidence": 1.0
+}""",
+        ],
+    },
+    {
+        "name": "GLICO",
+        "tokens": ["GLICO", "POCKY", "PRETZ"],
+        "examples": [
+            """Input: "GLICO POCKY CHOCOLATE GOKUBOSO 71G"
+Output: {
+  "brand": "GLICO",
+  "product_line": "POCKY",
+  "flavour": "CHOCOLATE",
+  "variant": "GOKUBOSO",
+  "size": "71G",
+  "product_form": "STICK",
+  "is_sugar_free": false,
+  "base_item": "GLICO POCKY STICK CHOCOLATE GOKUBOSO 71G",
+  "confidence": 1.0
+}""",
+        ],
+    },
+    {
+        "name": "NABATI",
+        "tokens": ["NABATI", "NEXTAR", "RICHEESE"],
+        "examples": [
+            """Input: "NABATI NEXTAR BROWNIES CHOCOLATE 272G"
+Output: {
+  "brand": "NABATI",
+  "product_line": "NEXTAR BROWNIES",
+  "flavour": "CHOCOLATE",
+  "variant": "REGULAR",
+  "size": "272G",
+  "product_form": "BISCUIT",
+  "is_sugar_free": false,
+  "base_item": "NABATI NEXTAR BROWNIES BISCUIT CHOCOLATE 272G",
+  "confidence": 1.0
+}""",
+            """Input: "NABATI FESTIVE NEXTAR BROWNIES 272G"
+Output: {
+  "brand": "NABATI",
+  "product_line": "NEXTAR BROWNIES",
+  "flavour": "CHOCOLATE",
+  "variant": "REGULAR",
+  "size": "272G",
+  "product_form": "BISCUIT",
+  "is_sugar_free": false,
+  "base_item": "NABATI NEXTAR BROWNIES BISCUIT CHOCOLATE 272G",
+  "confidence": 1.0
+}""",
+            """Input: "NABATI RICHEESE WAFER 145GM"
+Output: {
+  "brand": "NABATI",
+  "product_line": "RICHEESE",
+  "flavour": "CHEESE",
+  "variant": "REGULAR",
+  "size": "145G",
+  "product_form": "WAFER",
+  "is_sugar_free": false,
+  "base_item": "NABATI RICHEESE WAFER CHEESE 145G",
+  "confidence": 1.0
+}""",
+            """Input: "NABATI NEXTAR STRAWBERRY 106G"
+Output: {
+  "brand": "NABATI",
+  "product_line": "NEXTAR",
+  "flavour": "STRAWBERRY",
+  "variant": "REGULAR",
+  "size": "106G",
+  "product_form": "BISCUIT",
+  "is_sugar_free": false,
+  "base_item": "NABATI NEXTAR BISCUIT STRAWBERRY 106G",
+  "confidence": 1.0
+}""",
+        ],
+    },
+    {
+        "name": "HUP SENG",
+        "tokens": ["HUP SENG", "HUPSENG"],
+        "examples": [
+            """Input: "HUP SENG CRM CRACKER 428GMX12"
+Output: {
+  "brand": "HUP SENG",
+  "product_line": "CREAM CRACKERS",
+  "flavour": "NORMAL",
+  "variant": "REGULAR",
+  "size": "428GMX12",
+  "product_form": "CRACKER",
+  "is_sugar_free": false,
+  "base_item": "HUP SENG CREAM CRACKERS 428GMX12",
+  "confidence": 1.0
+}""",
+        ],
+    },
+    {
+        "name": "JULIES",
+        "tokens": ["JULIES", "JULIE", "JULI", "JULYS"],
+        "examples": [
+            """Input: "JULIE CHEESE STICKS 4.5KG"
+Output: {
+  "brand": "JULIES",
+  "product_line": "CHEESE STICKS",
+  "flavour": "CHEESE",
+  "variant": "REGULAR",
+  "size": "4500G",
+  "product_form": "STICK",
+  "is_sugar_free": false,
+  "base_item": "JULIES STICK CHEESE 4500G",
+  "confidence": 1.0
+}""",
+        ],
+    },
+    {
+        "name": "BOURBON",
+        "tokens": ["BOURBON"],
+        "examples": [
+            """Input: "BOURBON BUTTER COOKIES 9PCS 100G"
+Output: {
+  "brand": "BOURBON",
+  "product_line": "COOKIES",
+  "flavour": "BUTTER",
+  "variant": "REGULAR",
+  "size": "100G",
+  "product_form": "BISCUIT",
+  "is_sugar_free": false,
+  "base_item": "BOURBON BISCUIT BUTTER 100G",
+  "confidence": 1.0
+}""",
+            """Input: "BOURBON GOKOKU NO BISCUT 32P 133G"
+Output: {
+  "brand": "BOURBON",
+  "product_line": "GOKOKU NO BISCUIT",
+  "flavour": "NORMAL",
+  "variant": "REGULAR",
+  "size": "133G",
+  "product_form": "BISCUIT",
+  "is_sugar_free": false,
+  "base_item": "BOURBON GOKOKU NO BISCUIT 133G",
+  "confidence": 1.0
+}""",
+            """Input: "BOURBON CEBEURE (14 X 8 G) 112 G"
+Output: {
+  "brand": "BOURBON",
+  "product_line": "CEBEURE",
+  "flavour": "NORMAL",
+  "variant": "REGULAR",
+  "size": "112G",
+  "product_form": "BISCUIT",
+  "is_sugar_free": false,
+  "base_item": "BOURBON CEBEURE 112G",
+  "confidence": 1.0
+}""",
+        ],
+    },
+]
+
+# Used when no brand section matches, so the model still sees the output format
+# and the compound-flavour handling on an unknown brand
+FALLBACK_SECTIONS = ["MUNCHYS", "THE SKINNY BAKER"]
+
+_SECTION_PATTERNS = [
+    (section, re.compile(r"\b(?:" + "|".join(re.escape(t) for t in section["tokens"]) + r")\b"))
+    for section in BRAND_SECTIONS
+]
+
+
+def detect_sections(item):
+    """Names of the brand sections relevant to an item description."""
+    text = re.sub(r"[^A-Z0-9& ]", " ", str(item).upper())
+    return [section["name"] for section, pattern in _SECTION_PATTERNS if pattern.search(text)]
+
+
+def _render(section_names):
+    examples = []
+    for section in BRAND_SECTIONS:
+        if section["name"] in section_names:
+            examples.extend(section["examples"])
+    body = "\n\n".join(f"{i}. {example}" for i, example in enumerate(examples, 1))
+    return PROMPT_PREFIX + EXAMPLES_HEADER + body + "\n"
+
+
+FULL_PROMPT = _render([section["name"] for section in BRAND_SECTIONS])
+
+
+def approx_tokens(text):
+    """Rough token count (~4 characters per token), good enough for before/after comparisons."""
+    return len(text) // 4
+
+
+class PromptStats:
+    """Tracks compiled vs. full prompt size for the LLM calls of a run."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.full_tokens = 0
+            self.compiled_tokens = 0
+            self.section_hits = {}
+
+    def record(self, compiled_prompt, sections):
+        with self._lock:
+            self.calls += 1
+            self.full_tokens += approx_tokens(FULL_PROMPT)
+            self.compiled_tokens += approx_tokens(compiled_prompt)
+            for name in sections:
+                self.section_hits[name] = self.section_hits.get(name, 0) + 1
+
+    def summary(self):
+        with self._lock:
+            if not self.calls:
+                return {"calls": 0, "pruning_enabled": PROMPT_PRUNING_ENABLED}
+            avg_full = self.full_tokens / self.calls
+            avg_compiled = self.compiled_tokens / self.calls
+            return {
+                "calls": self.calls,
+                "pruning_enabled": PROMPT_PRUNING_ENABLED,
+                "prefix_tokens": approx_tokens(PROMPT_PREFIX),
+                "avg_prompt_tokens_before": round(avg_full, 1),
+                "avg_prompt_tokens_after": round(avg_compiled, 1),
+                "reduction_pct": round(100 * (1 - avg_compiled / avg_full), 1) if avg_full else 0,
+                "section_hits": dict(self.section_hits),
+            }
+
+
+prompt_stats = PromptStats()
+
+
+def _sections_for(item):
+    if not PROMPT_PRUNING_ENABLED:
+        return [section["name"] for section in BRAND_SECTIONS]
+    return detect_sections(item) or FALLBACK_SECTIONS
+
+
+def compile_system_prompt(item):
+    """
+    Build the Flow 2 system prompt for one item.
+    Returns (prompt, section_names) and records the size against the full prompt.
+    """
+    sections = _sections_for(item)
+    prompt = FULL_PROMPT if not PROMPT_PRUNING_ENABLED else _render(sections)
+    prompt_stats.record(prompt, sections)
+    return prompt, sections
+
+
+@lru_cache(maxsize=256)
+def _hash_sections(sections):
+    prompt = FULL_PROMPT if not PROMPT_PRUNING_ENABLED else _render(list(sections))
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def prompt_fingerprint(item):
+    """
+    Hash of the system prompt this item would get (without recording prompt stats).
+    Editing one brand section only changes the fingerprint of items that use it.
+    """
+    return _hash_sections(tuple(_sections_for(item)))
@@ -0,0 +1,294 @@
+"""
+Offline batch mode for bulk Flow 2 attribute extraction.
+
+Instead of pushing thousands of synchronous chat requests through flow2_client, all cache-miss
+prompts are written to a JSONL job file, submitted to a batch backend, polled until complete and
+ingested into LLM_CACHE_STORAGE in bulk. The normal Flow 2 run afterwards is served from cache.
+
+Backends:
+  - azure: Azure OpenAI Batch API (needs a Global-Batch deployment, LLM_BATCH_DEPLOYMENT)
+  - local: runs the job file through the shared deployment pool at bulk priority
+           (point AZURE_OPENAI_ENDPOINT at backend.mock_llm_server for an offline stand-in)
+
+Usage:
+    python -m backend.llm_batch --backend azure --poll-interval 60
+    python full_rerun_pipeline.py --batch
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from pymongo import UpdateOne
+
+from backend.database import get_collection, SINGLE_STOCK_COL
+from backend.llm_client import azure_openai_pool, pooled_chat_completion, _response_format_for, TIER_STRONG
+from backend.llm_schemas import FLOW2_ATTRIBUTES_SCHEMA, extract_json, validate_against_schema
+from backend.llm_scheduler import PRIORITY_BULK
+from backend.llm_usage import usage_recorder
+from backend.flow2_prompt import compile_system_prompt
+from backend.attribute_extraction import publish_attributes_many
+from backend.processor import (
+    build_flow2_user_prompt, finalize_llm_result, select_representative_items, flow2_cache, flow2_cache_version,
+    flow2_index_keys,
+)
+
+LLM_CACHE_COL = "LLM_CACHE_STORAGE"
+BATCH_DIR = Path(os.getenv("LLM_BATCH_DIR", Path(__file__).parent.parent / "llm_batches"))
+BATCH_DEPLOYMENT = os.getenv("LLM_BATCH_DEPLOYMENT")
+FINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+
+
+def collect_flow2_cache_misses(sheet_name="wersel_match"):
+    """Context items Flow 2 would send to the LLM that are not in LLM_CACHE_STORAGE yet."""
+    docs = list(get_collection(SINGLE_STOCK_COL).find({"sheet_name": sheet_name}, {"ITEM": 1, "BRAND": 1}))
+    _, item_to_context, _, _, representative_items = select_representative_items(docs)
+    context_items = list(dict.fromkeys(item_to_context.get(it, it) for it in representative_items))
+
+    cached = set(flow2_cache.get_documents(context_items))
+
+    misses = [it for it in context_items if it not in cached]
+    print(f"Batch: {len(context_items)} representative items, {len(cached)} cached, {len(misses)} to extract")
+    return misses
+
+
+def write_job_file(items, model, job_dir=BATCH_DIR):
+    """
+    Write one chat-completion request per item (OpenAI/Azure batch JSONL format).
+    Returns (job_path, manifest) where manifest maps custom_id -> item.
+    """
+    job_dir = Path(job_dir)
+    job_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    job_path = job_dir / f"flow2-{stamp}.jsonl"
+
+    manifest = {}
+    response_format = _response_format_for(FLOW2_ATTRIBUTES_SCHEMA, "flow2")
+    with open(job_path, "w", encoding="utf-8") as f:
+        for i, item in enumerate(items):
+            custom_id = f"flow2-{i}"
+            manifest[custom_id] = item
+            system_prompt, _ = compile_system_prompt(item)
+            body = {
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": build_flow2_user_prompt(item)},
+                ],
+                "max_tokens": 1000,
+                # Same sampling parameters as OpenAIOnlyClient._complete
+                "temperature": 0,
+                "seed": 42,
+                "top_p": 0.0000000001,
+            }
+            if response_format:
+                body["response_format"] = response_format
+            f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": "/chat/completions", "body": body}) + "\n")
+
+    with open(job_path.with_suffix(".manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    print(f"Batch: wrote {len(items)} requests to {job_path}")
+    return job_path, manifest
+
+
+class AzureBatchBackend:
+    """Azure OpenAI Batch API: upload, create batch, poll, download output."""
+    name = "azure"
+
+    def __init__(self, deployment=None):
+        if not azure_openai_pool:
+            raise RuntimeError("Azure OpenAI is not configured")
+        primary = azure_openai_pool.members(TIER_STRONG)[0]
+        self.client = primary.client
+        self.model = deployment or BATCH_DEPLOYMENT or primary.deployment
+
+    def submit(self, job_path):
+        with open(job_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/chat/completions",
+            completion_window="24h",
+        )
+        print(f"Batch: submitted {batch.id} (input file {uploaded.id})")
+        return batch.id
+
+    def status(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        counts = getattr(batch, "request_counts", None)
+        progress = f"{counts.completed}/{counts.total}" if counts else "?"
+        return batch.status, progress
+
+    def download(self, batch_id, output_path):
+        batch = self.client.batches.retrieve(batch_id)
+        if not batch.output_file_id:
+            raise RuntimeError(f"Batch {batch_id} finished as '{batch.status}' without output")
+        content = self.client.files.content(batch.output_file_id).text
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return output_path
+
+
+class LocalBatchBackend:
+    """
+    Runs a job file through the shared deployment pool (bulk priority), producing an output
+    file in the same format as the Azure Batch API. Completes synchronously on submit.
+    """
+    name = "local"
+
+    def __init__(self, max_workers=10):
+        if not azure_openai_pool:
+            raise RuntimeError("Azure OpenAI is not configured")
+        self.max_workers = max_workers
+        self.model = azure_openai_pool.members(TIER_STRONG)[0].deployment
+        self._outputs = {}
+
+    def _run_line(self, line):
+        request = json.loads(line)
+        body = dict(request["body"])
+        messages = body.pop("messages")
+        body.pop("model", None)
+        max_tokens = body.pop("max_tokens", 1000)
+        content = pooled_chat_completion(
+            azure_openai_pool, messages, max_tokens=max_tokens, label=request["custom_id"],
+            priority=PRIORITY_BULK, flow="flow2_batch", **body
+        )
+        if content is None:
+            return {"custom_id": request["custom_id"], "response": None, "error": {"message": "request failed"}}
+        return {
+            "custom_id": request["custom_id"],
+            "response": {"status_code": 200, "body": {"choices": [{"message": {"role": "assistant", "content": content}}]}},
+            "error": None,
+        }
+
+    def submit(self, job_path):
+        batch_id = Path(job_path).stem
+        with open(job_path, "r", encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            self._outputs[batch_id] = list(executor.map(self._run_line, lines))
+        return batch_id
+
+    def status(self, batch_id):
+        results = self._outputs.get(batch_id, [])
+        return "completed", f"{len(results)}/{len(results)}"
+
+    def download(self, batch_id, output_path):
+        with open(output_path, "w", encoding="utf-8") as f:
+            for result in self._outputs.pop(batch_id, []):
+                f.write(json.dumps(result) + "\n")
+        return output_path
+
+
+def wait_for_batch(backend, batch_id, poll_interval=60, timeout_hours=24):
+    """Poll until the batch reaches a final state. Returns the final status."""
+    deadline = time.time() + timeout_hours * 3600
+    while True:
+        status, progress = backend.status(batch_id)
+        print(f"Batch {batch_id}: {status} ({progress})")
+        if status in FINAL_STATES:
+            return status
+        if time.time() > deadline:
+            raise TimeoutError(f"Batch {batch_id} still '{status}' after {timeout_hours}h")
+        time.sleep(poll_interval)
+
+
+def ingest_results(output_path, manifest, write_batch_size=1000):
+    """
+    Parse a batch output file, validate each reply against the Flow 2 schema, apply the
+    rule guards and bulk-upsert into LLM_CACHE_STORAGE. Failed items are left uncached so
+    the next synchronous Flow 2 run picks them up.
+    """
+    cache_coll = get_collection(LLM_CACHE_COL)
+    ops = []
+    published = []  # (item, result, version) for the shared attribute cache, one lookup per write batch
+    stats = {"ingested": 0, "failed": 0, "invalid": 0}
+
+    def flush():
+        if ops:
+            cache_coll.bulk_write(ops, ordered=False)
+            ops.clear()
+        if published:
+            publish_attributes_many("nielsen", published)
+            published.clear()
+
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            item = manifest.get(record.get("custom_id"))
+            response = record.get("response") or {}
+            if item is None or record.get("error") or response.get("status_code") != 200:
+                stats["failed"] += 1
+                continue
+            try:
+                content = response["body"]["choices"][0]["message"]["content"]
+                data = extract_json(content)
+            except (KeyError, IndexError, ValueError):
+                stats["invalid"] += 1
+                continue
+            if validate_against_schema(data, FLOW2_ATTRIBUTES_SCHEMA) or (not data.get("brand") and not data.get("flavour")):
+                stats["invalid"] += 1
+                continue
+
+            data = finalize_llm_result(item, data)
+            flow2_cache.put_local(item, data)
+            version = flow2_cache_version(item)
+            published.append((item, data, version))
+            ops.append(UpdateOne(
+                {"item": item},
+                {"$set": {"item": item, "result": data, "tier": "batch", "version": version,
+                          "cached_at": datetime.utcnow().isoformat(), **flow2_index_keys(item)}},
+                upsert=True
+            ))
+            stats["ingested"] += 1
+            if len(ops) >= write_batch_size:
+                flush()
+    flush()
+    print(f"Batch: ingested {stats['ingested']} results into {LLM_CACHE_COL} "
+          f"({stats['failed']} failed, {stats['invalid']} invalid)")
+    return stats
+
+
+def run_flow2_batch(sheet_name="wersel_match", backend="azure", poll_interval=60, job_dir=BATCH_DIR):
+    """Collect Flow 2 cache misses, run them as one batch job and fill LLM_CACHE_STORAGE."""
+    misses = collect_flow2_cache_misses(sheet_name)
+    if not misses:
+        return {"status": "success", "submitted": 0, "ingested": 0}
+
+    runner = AzureBatchBackend() if backend == "azure" else LocalBatchBackend()
+    job_path, manifest = write_job_file(misses, runner.model, job_dir)
+
+    run_token = usage_recorder.start_run(f"flow2-batch-{runner.name}")
+    try:
+        batch_id = runner.submit(job_path)
+        status = wait_for_batch(runner, batch_id, poll_interval=poll_interval)
+        if status != "completed":
+            print(f"Batch {batch_id} ended as '{status}' - ingesting any partial output")
+        output_path = runner.download(batch_id, job_path.with_suffix(".output.jsonl"))
+        stats = ingest_results(output_path, manifest)
+    finally:
+        usage_recorder.end_run(run_token)
+
+    return {"status": status, "batch_id": batch_id, "backend": runner.name, "submitted": len(misses), **stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Flow 2 LLM extraction as an offline batch job")
+    parser.add_argument("--sheet", default="wersel_match")
+    parser.add_argument("--backend", choices=["azure", "local"], default=os.getenv("LLM_BATCH_BACKEND", "azure"))
+    parser.add_argument("--poll-interval", type=int, default=60, help="Seconds between status polls")
+    parser.add_argument("--job-dir", default=str(BATCH_DIR))
+    args = parser.parse_args()
+    result = run_flow2_batch(args.sheet, backend=args.backend, poll_interval=args.poll_interval, job_dir=args.job_dir)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,414 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo import UpdateMany, UpdateOne
+
+try:
+    from backend.database import get_collection
+except ImportError:
+    # Fallback: if imported from inside the backend folder
+    from database import get_collection
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Two-tier LLM result cache
+#  Tier 1: bounded in-process LRU (entry and size limits, hit/miss/eviction counters)
+#  Tier 2: MongoDB collection (LLM_CACHE_STORAGE, 7-eleven_llm_cache), read with $in
+#          batches and written with buffered bulk upserts.
+# ─────────────────────────────────────────────────────────────────────────────
+
+DEFAULT_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000"))
+DEFAULT_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "200"))
+# What a lookup does with an entry whose prompt / model / guard fingerprint no longer matches:
+#   stale_ok - serve it and queue it for background revalidation (default)
+#   strict   - treat it as a miss so it is re-extracted immediately
+VERSION_POLICY = os.getenv("LLM_CACHE_VERSION_POLICY", "stale_ok").lower()
+# Buffered hit counts are written at most this often (and at exit), one update per distinct count
+HIT_FLUSH_SECONDS = float(os.getenv("LLM_CACHE_HIT_FLUSH_SECONDS", "60"))
+
+
+def _approx_size(key, value):
+    try:
+        return len(key) + len(json.dumps(value, default=str))
+    except Exception:
+        return len(key) + 1024
+
+
+class TwoTierLLMCache:
+    """
+    LLM result cache keyed by the prompt input (item / article description).
+
+    `on_load(key, result)` is applied to results read from MongoDB before they enter the
+    in-memory tier (Flow 2 uses it to re-apply the latest rule guards).
+
+    `version_fn(key, stored=None)` returns the fingerprint a fresh entry would carry (prompt hash,
+    model, guard version). Every write is stamped with it; entries read back with a different
+    fingerprint are handled according to `policy` (see VERSION_POLICY). When checking an entry,
+    `stored` is its fingerprint, so parts that depend on how it was produced (the model tier)
+    are compared like for like.
+
+    `index_fn(key)` returns secondary lookup fields (e.g. Flow 2 clean key / token set) stamped on
+    every write, so `find_similar` can locate a stored result for a differently worded key.
+    """
+    def __init__(self, collection, key_field, name=None, max_entries=DEFAULT_MAX_ENTRIES, max_mb=DEFAULT_MAX_MB,
+                 on_load=None, flush_size=500, version_fn=None, policy=VERSION_POLICY, index_fn=None):
+        self.collection = collection
+        self.key_field = key_field
+        self.name = name or collection
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.on_load = on_load
+        self.flush_size = flush_size
+        self.version_fn = version_fn
+        self.policy = policy
+        self.index_fn = index_fn
+
+        self._lock = threading.RLock()
+        self._lru = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._pending = {}         # key -> document waiting for the next bulk write
+        self._stale = OrderedDict()  # keys served stale, waiting for revalidation
+        self._hits = {}            # key -> get() hits since the last flush (persisted as hit_count)
+        self._hits_flushed_at = time.time()
+        self.counters = {"memory_hits": 0, "store_hits": 0, "misses": 0, "evictions": 0, "writes": 0,
+                         "stale_served": 0, "version_misses": 0, "similar_hits": 0}
+
+    # ── Tier 1: in-process LRU ──────────────────────────────────────────
+    def _remember(self, key, value):
+        size = _approx_size(key, value)
+        with self._lock:
+            if key in self._lru:
+                self._bytes -= self._lru.pop(key)[1]
+            self._lru[key] = (value, size)
+            self._bytes += size
+            while self._lru and (len(self._lru) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size) = self._lru.popitem(last=False)
+                self._bytes -= evicted_size
+                self.counters["evictions"] += 1
+
+    def _recall(self, key):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                return None
+            self._lru.move_to_end(key)
+            self.counters["memory_hits"] += 1
+            return entry[0]
+
+    def put_local(self, key, value):
+        """Keep a value in memory only (e.g. a fallback result that must not be persisted)."""
+        self._remember(key, value)
+
+    # ── Versioning ──────────────────────────────────────────────────────
+    def set_versioning(self, version_fn, policy=None):
+        self.version_fn = version_fn
+        if policy:
+            self.policy = policy
+
+    def is_current(self, key, doc):
+        return self.version_fn is None or doc.get("version") == self.version_fn(key, doc.get("version"))
+
+    def _accept(self, key, doc):
+        """Apply the version policy to a stored document. Returns False if it must be treated as a miss."""
+        if self.is_current(key, doc):
+            return True
+        with self._lock:
+            if self.policy == "strict":
+                self.counters["version_misses"] += 1
+                return False
+            self.counters["stale_served"] += 1
+            self._stale[key] = True
+            while len(self._stale) > self.max_entries:
+                self._stale.popitem(last=False)
+        return True
+
+    def pop_stale(self, limit=100):
+        """Take up to `limit` keys that were served stale, oldest first."""
+        with self._lock:
+            keys = []
+            while self._stale and len(keys) < limit:
+                keys.append(self._stale.popitem(last=False)[0])
+            return keys
+
+    def scan_stale(self, limit=100, query=None):
+        """Find up to `limit` stored keys whose fingerprint does not match the current one."""
+        if self.version_fn is None:
+            return []
+        stale = []
+        cursor = get_collection(self.collection).find(query or {}, {"_id": 0, self.key_field: 1, "version": 1})
+        for doc in cursor:
+            key = doc.get(self.key_field)
+            if key and not self.is_current(key, doc):
+                stale.append(key)
+                if len(stale) >= limit:
+                    break
+        return stale
+
+    # ── Tier 2: MongoDB ─────────────────────────────────────────────────
+    def _load(self, key, doc):
+        result = doc.get("result")
+        return self.on_load(key, result) if self.on_load else result
+
+    def _count_hit(self, key):
+        with self._lock:
+            self._hits[key] = self._hits.get(key, 0) + 1
+
+    def get(self, key):
+        """
+        Cached result for `key` from memory, pending writes or MongoDB; None on a miss.
+        Every hit is counted towards the entry's persisted hit_count (get_many prefetches are not).
+        """
+        value = self._recall(key)
+        if value is not None:
+            self._count_hit(key)
+            return value
+        with self._lock:
+            pending = self._pending.get(key)
+        doc = pending or get_collection(self.collection).find_one({self.key_field: key}, {"_id": 0})
+        if doc and not self._accept(key, doc):
+            doc = None
+        with self._lock:
+            self.counters["store_hits" if doc else "misses"] += 1
+            if doc:
+                self._hits[key] = self._hits.get(key, 0) + 1
+        if not doc:
+            return None
+        value = self._load(key, doc)
+        self._remember(key, value)
+        return value
+
+    def get_many(self, keys, chunk_size=5000, count_hits=False):
+        """
+        Resolve many keys at once: memory first, then one $in query per chunk. Returns {key: result}.
+        Pass count_hits=True when the results are served directly (not a prefetch ahead of get()).
+        """
+        found, missing = {}, []
+        for key in dict.fromkeys(k for k in keys if k):
+            value = self._recall(key)
+            if value is not None:
+                found[key] = value
+            else:
+                missing.append(key)
+
+        coll = get_collection(self.collection)
+        for i in range(0, len(missing), chunk_size):
+            chunk = missing[i:i + chunk_size]
+            for doc in coll.find({self.key_field: {"$in": chunk}}, {"_id": 0}):
+                key = doc[self.key_field]
+                if not self._accept(key, doc):
+                    continue
+                value = self._load(key, doc)
+                self._remember(key, value)
+                found[key] = value
+        with self._lock:
+            self.counters["store_hits"] += sum(1 for k in missing if k in found)
+            self.counters["misses"] += sum(1 for k in missing if k not in found)
+            if count_hits:
+                for key in found:
+                    self._hits[key] = self._hits.get(key, 0) + 1
+        return found
+
+    def get_documents(self, keys, chunk_size=5000):
+        """Raw MongoDB documents (with metadata such as tier / cached_at) for the given keys."""
+        coll = get_collection(self.collection)
+        keys = list(dict.fromkeys(k for k in keys if k))
+        docs = {}
+        for i in range(0, len(keys), chunk_size):
+            for doc in coll.find({self.key_field: {"$in": keys[i:i + chunk_size]}}, {"_id": 0}):
+                docs[doc[self.key_field]] = doc
+        return docs
+
+    def put(self, key, value, **fields):
+        """Store a result in memory and queue it for the next bulk write to MongoDB."""
+        self._remember(key, value)
+        if self.version_fn is not None and "version" not in fields:
+            fields["version"] = self.version_fn(key)
+        if self.index_fn is not None:
+            fields = {**self.index_fn(key), **fields}
+        with self._lock:
+            self._stale.pop(key, None)
+            self._pending[key] = {self.key_field: key, "result": value, **fields}
+            due = len(self._pending) >= self.flush_size
+        if due:
+            self.flush()
+
+    def flush(self, force=False):
+        """
+        Write all pending entries with one unordered bulk_write. Buffered hit counts go out with
+        their key's pending entry, the rest every HIT_FLUSH_SECONDS (or when `force`d) as one
+        $in update per distinct count.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if force or time.time() - self._hits_flushed_at >= HIT_FLUSH_SECONDS:
+                hits, self._hits = self._hits, {}
+                self._hits_flushed_at = time.time()
+            else:
+                hits = {key: self._hits.pop(key) for key in pending if key in self._hits}
+        if not pending and not hits:
+            return 0
+        now = datetime.utcnow().isoformat()
+        ops = []
+        for key, doc in pending.items():
+            update = {"$set": doc}
+            if key in hits:
+                update = {"$set": {**doc, "last_hit_at": now}, "$inc": {"hit_count": hits.pop(key)}}
+            ops.append(UpdateOne({self.key_field: key}, update, upsert=True))
+        by_count = {}
+        for key, count in hits.items():
+            by_count.setdefault(count, []).append(key)
+        for count, keys in by_count.items():
+            for i in range(0, len(keys), 5000):
+                ops.append(UpdateMany({self.key_field: {"$in": keys[i:i + 5000]}},
+                                      {"$inc": {"hit_count": count}, "$set": {"last_hit_at": now}}))
+        try:
+            get_collection(self.collection).bulk_write(ops, ordered=False)
+            with self._lock:
+                self.counters["writes"] += len(pending)
+        except Exception as e:
+            print(f"⚠️ {self.name} cache flush error ({len(ops)} operations): {e}")
+        return len(pending)
+
+    # ── Secondary index ─────────────────────────────────────────────────
+    def find_similar(self, keys, fields, accept=None, chunk_size=5000):
+        """
+        For keys with no exact entry, find a stored document sharing a secondary index value.
+        `fields` are tried in order (strictest first); `accept(doc)` can reject a candidate.
+        Returns {key: (field, doc)}; the newest acceptable candidate wins.
+        """
+        if self.index_fn is None or not fields:
+            return {}
+        pending = {key: self.index_fn(key) for key in dict.fromkeys(k for k in keys if k)}
+        coll = get_collection(self.collection)
+        found = {}
+        for field in fields:
+            by_value = {}
+            for key, index in pending.items():
+                if index.get(field):
+                    by_value.setdefault(index[field], []).append(key)
+            values = list(by_value)
+            for i in range(0, len(values), chunk_size):
+                cursor = coll.find({field: {"$in": values[i:i + chunk_size]}}, {"_id": 0}).sort("cached_at", -1)
+                for doc in cursor:
+                    for key in by_value.get(doc.get(field), []):
+                        if key in found or doc.get(self.key_field) == key:
+                            continue
+                        if accept is None or accept(doc):
+                            found[key] = (field, doc)
+            pending = {k: v for k, v in pending.items() if k not in found}
+            if not pending:
+                break
+        with self._lock:
+            self.counters["similar_hits"] += len(found)
+        return found
+
+    def backfill_index(self, batch_size=1000):
+        """Stamp secondary index fields on stored entries written before index_fn existed. Returns the count."""
+        if self.index_fn is None:
+            return 0
+        coll = get_collection(self.collection)
+        first_field = next(iter(self.index_fn("")), None)
+        if first_field is None:
+            return 0
+        updated, ops = 0, []
+        for doc in coll.find({first_field: {"$exists": False}}, {"_id": 0, self.key_field: 1}):
+            key = doc.get(self.key_field)
+            if not key:
+                continue
+            ops.append(UpdateOne({self.key_field: key}, {"$set": self.index_fn(key)}))
+            if len(ops) >= batch_size:
+                updated += coll.bulk_write(ops, ordered=False).modified_count
+                ops = []
+        if ops:
+            updated += coll.bulk_write(ops, ordered=False).modified_count
+        return updated
+
+    # ── Maintenance ─────────────────────────────────────────────────────
+    def discard(self, keys=None):
+        """Drop keys (or everything) from the in-memory tier only."""
+        with self._lock:
+            if keys is None:
+                self._lru.clear()
+                self._bytes = 0
+                return
+            for key in keys:
+                entry = self._lru.pop(key, None)
+                if entry:
+                    self._bytes -= entry[1]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["memory_hits"] + self.counters["store_hits"] + self.counters["misses"]
+            hits = self.counters["memory_hits"] + self.counters["store_hits"]
+            return {
+                "name": self.name,
+                "collection": self.collection,
+                "entries": len(self._lru),
+                "max_entries": self.max_entries,
+                "size_mb": round(self._bytes / (1024 * 1024), 2),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+                "pending_writes": len(self._pending),
+                "version_policy": self.policy if self.version_fn else None,
+                "stale_queue": len(self._stale),
+                **self.counters,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0,
+            }
+
+
+_registry = []
+
+
+def register_cache(cache):
+    """Track a cache instance so pending writes are flushed at exit and it shows up in stats."""
+    _registry.append(cache)
+    return cache
+
+
+def all_cache_stats():
+    return [cache.stats() for cache in _registry]
+
+
+def flush_all():
+    for cache in _registry:
+        cache.flush(force=True)
+
+
+atexit.register(flush_all)
+
+SEVEN_ELEVEN_CACHE_COL = "7-eleven_llm_cache"
+
+# 7-Eleven ArticleDescription enrichment (no guards, results are used as stored)
+seven_eleven_cache = register_cache(TwoTierLLMCache(SEVEN_ELEVEN_CACHE_COL, "article_description", name="7eleven"))
+
+
+def origin_version(cache_name, key, version):
+    """
+    Version stamped on an entry copied from another cache's entry (shared attributes): the origin
+    plus its fingerprint, so the copy goes stale together with the entry it came from.
+    """
+    return {"origin_cache": cache_name, "origin_key": key, **(version or {})}
+
+
+def current_origin_version(stored):
+    """What an origin_version() stamp should read now; None if `stored` is not one."""
+    if not isinstance(stored, dict) or not stored.get("origin_cache"):
+        return None
+    own = {k: v for k, v in stored.items() if k not in ("origin_cache", "origin_key")}
+    origin = get_cache(stored["origin_cache"])
+    current = origin.version_fn(stored["origin_key"], own) if origin.version_fn else own
+    return origin_version(stored["origin_cache"], stored["origin_key"], current)
+
+
+def get_cache(name):
+    """Cache by name: "flow2" (LLM_CACHE_STORAGE, defined with its guards in processor) or "7eleven"."""
+    if name == "flow2":
+        try:
+            from backend.processor import flow2_cache
+        except ImportError:
+            from processor import flow2_cache
+        return flow2_cache
+    return seven_eleven_cache
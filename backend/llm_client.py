@@ -2,12 +2,27 @@ import os
 import requests
 import json
 import time
+import hashlib
 import re
+import random
+import threading
+from collections import deque
+import openai
 from openai import OpenAI
 import httpx
 from dotenv import load_dotenv
 from pathlib import Path
 
+try:
+    from backend.llm_schemas import extract_json, validate_against_schema, to_response_format
+    from backend.llm_scheduler import scheduler, priority_for_flow, PRIORITY_BULK
+    from backend.llm_usage import usage_recorder
+except ImportError:
+    # Fallback: if imported from inside the backend folder
+    from llm_schemas import extract_json, validate_against_schema, to_response_format
+    from llm_scheduler import scheduler, priority_for_flow, PRIORITY_BULK
+    from llm_usage import usage_recorder
+
 # Load .env from backend directory OR parent directory
 current_dir = Path(__file__).parent
 env_path = current_dir / '.env'
@@ -17,6 +32,440 @@ if not env_path.exists():
 if env_path.exists():
     load_dotenv(env_path)
 
+# Model tiers for the cheap-first cascade
+TIER_FAST = "fast"
+TIER_STRONG = "strong"
+# auto: cascade whenever both tiers are configured; off: always use every deployment
+LLM_CASCADE = os.getenv("LLM_CASCADE", "auto").lower()
+
+
+class AzureDeployment:
+    """
+    One Azure OpenAI deployment (endpoint + key + deployment name) with its own quota and health state.
+    """
+    def __init__(self, name, endpoint, api_key, deployment, api_version="2025-01-01-preview", weight=1.0, rpm=None,
+                 tier=TIER_STRONG):
+        from openai import AzureOpenAI
+        self.name = name
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.tier = tier  # Model tier used by the cheap-first cascade (fast / strong)
+        self.weight = max(float(weight or 1.0), 0.01)
+        self.rpm = int(rpm) if rpm else None  # Requests-per-minute quota (None = unlimited)
+        self.client = AzureOpenAI(api_key=api_key, api_version=api_version, azure_endpoint=endpoint)
+
+        # Live state (guarded by the pool lock)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.consecutive_failures = 0
+        self.recent_requests = deque()  # Timestamps of requests in the last 60s (for rpm quota)
+        self.max_response_format = "json_schema"  # Downgraded if the model rejects schema output
+
+        # Counters
+        self.total_requests = 0
+        self.successes = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.last_error = None
+
+    def has_quota(self, now):
+        while self.recent_requests and now - self.recent_requests[0] > 60:
+            self.recent_requests.popleft()
+        return self.rpm is None or len(self.recent_requests) < self.rpm
+
+    def next_available_at(self, now):
+        """Earliest time this deployment can take another request."""
+        ready = max(self.cooldown_until, now)
+        if self.rpm is not None and len(self.recent_requests) >= self.rpm:
+            ready = max(ready, self.recent_requests[0] + 60)
+        return ready
+
+    def health(self, now=None):
+        now = now or time.time()
+        if now < self.cooldown_until:
+            status = "COOLING_DOWN"
+        elif self.consecutive_failures > 0:
+            status = "DEGRADED"
+        else:
+            status = "HEALTHY"
+        return {
+            "name": self.name,
+            "deployment": self.deployment,
+            "endpoint": self.endpoint,
+            "tier": self.tier,
+            "weight": self.weight,
+            "rpm": self.rpm,
+            "status": status,
+            "in_flight": self.in_flight,
+            "requests_last_minute": len(self.recent_requests),
+            "cooldown_remaining_s": round(max(self.cooldown_until - now, 0), 2),
+            "total_requests": self.total_requests,
+            "successes": self.successes,
+            "rate_limited": self.rate_limited,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
+
+
+class DeploymentPool:
+    """
+    Routes Azure OpenAI requests across several deployments/regions.
+    Each request goes to the least-loaded deployment (in-flight / weight) that still has quota
+    and is not cooling down after a 429 or repeated errors.
+    """
+    FAILURE_THRESHOLD = 5   # Consecutive errors before a deployment is taken out of rotation
+    FAILURE_COOLDOWN = 30   # Seconds out of rotation after hitting FAILURE_THRESHOLD
+
+    def __init__(self, deployments):
+        self.deployments = deployments
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build the pool from AZURE_OPENAI_DEPLOYMENTS (JSON list) or, if unset,
+        from the single AZURE_OPENAI_ENDPOINT / AZURE_OPENAI_DEPLOYMENT pair.
+
+        AZURE_OPENAI_DEPLOYMENTS example:
+        [{"name": "eastus2", "endpoint": "https://...", "api_key_env": "AZURE_OPENAI_API_KEY_EUS2",
+          "deployment": "gpt-5-nano", "weight": 2, "rpm": 300, "tier": "fast"}]
+
+        With the single-deployment config, AZURE_OPENAI_FAST_DEPLOYMENT adds a cheaper
+        deployment on the same endpoint as the "fast" tier.
+        """
+        default_version = os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview")
+        deployments = []
+        raw = os.getenv("AZURE_OPENAI_DEPLOYMENTS")
+        if raw:
+            try:
+                for i, cfg in enumerate(json.loads(raw)):
+                    api_key = cfg.get("api_key") or os.getenv(cfg.get("api_key_env", ""), "")
+                    deployments.append(AzureDeployment(
+                        name=cfg.get("name") or f"deployment_{i}",
+                        endpoint=cfg["endpoint"],
+                        api_key=api_key,
+                        deployment=cfg.get("deployment", "gpt-4o-mini"),
+                        api_version=cfg.get("api_version", default_version),
+                        weight=cfg.get("weight", 1.0),
+                        rpm=cfg.get("rpm"),
+                        tier=cfg.get("tier", TIER_STRONG),
+                    ))
+            except Exception as e:
+                print(f"Invalid AZURE_OPENAI_DEPLOYMENTS config: {e}")
+                deployments = []
+
+        if not deployments:
+            deployments.append(AzureDeployment(
+                name="default",
+                endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini"),
+                api_version=default_version,
+                rpm=os.getenv("AZURE_OPENAI_RPM"),
+            ))
+            fast_deployment = os.getenv("AZURE_OPENAI_FAST_DEPLOYMENT")
+            if fast_deployment:
+                deployments.append(AzureDeployment(
+                    name="fast",
+                    endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                    deployment=fast_deployment,
+                    api_version=default_version,
+                    rpm=os.getenv("AZURE_OPENAI_FAST_RPM"),
+                    tier=TIER_FAST,
+                ))
+        return cls(deployments)
+
+    def members(self, tier=None):
+        """
+        Deployments of one tier. Untiered calls (chatbot, 7-Eleven, QA, Flow 2 without the cascade)
+        use the strong tier, so a cheap fast deployment only serves the cascade's first pass.
+        All deployments if the pool has none of that tier.
+        """
+        tier = tier or TIER_STRONG
+        return [d for d in self.deployments if d.tier == tier] or self.deployments
+
+    def fingerprint(self, tier=None):
+        """
+        Stable description of the models serving one tier (tier:deployment), used to version cache
+        entries. Replicas of a model count once, so scaling the pool out keeps entries current.
+        """
+        tier = tier or TIER_STRONG
+        return f"{tier}:" + ",".join(sorted({d.deployment for d in self.members(tier)}))
+
+    def has_tiers(self, *tiers):
+        available = {d.tier for d in self.deployments}
+        return all(t in available for t in tiers)
+
+    def acquire(self, tier=None):
+        """
+        Reserve the best deployment (optionally of one tier) for one request.
+        Returns (deployment, 0) on success or (None, wait_seconds) if every deployment is busy.
+        """
+        with self._lock:
+            now = time.time()
+            members = self.members(tier)
+            candidates = [d for d in members if now >= d.cooldown_until and d.has_quota(now)]
+            if not candidates:
+                wait = min(d.next_available_at(now) for d in members) - now
+                return None, max(wait, 0.05)
+            # Least loaded first; ties broken by weighted usage over the last minute (weighted round-robin)
+            best = min(candidates, key=lambda d: (d.in_flight / d.weight, len(d.recent_requests) / d.weight, d.consecutive_failures))
+            best.in_flight += 1
+            best.total_requests += 1
+            best.recent_requests.append(now)
+            return best, 0
+
+    def release(self, deployment, outcome, retry_after=None, error=None):
+        """Return a deployment to the pool and update its health from the call outcome."""
+        with self._lock:
+            deployment.in_flight = max(deployment.in_flight - 1, 0)
+            if outcome == "success":
+                deployment.successes += 1
+                deployment.consecutive_failures = 0
+            elif outcome == "rate_limited":
+                deployment.rate_limited += 1
+                cooldown = (retry_after + 1.5) if retry_after else 10
+                deployment.cooldown_until = max(deployment.cooldown_until, time.time() + min(cooldown, 60))
+                deployment.last_error = error
+            else:
+                deployment.errors += 1
+                deployment.consecutive_failures += 1
+                deployment.last_error = error
+                if deployment.consecutive_failures >= self.FAILURE_THRESHOLD:
+                    deployment.cooldown_until = time.time() + self.FAILURE_COOLDOWN
+
+    def health(self):
+        now = time.time()
+        return [d.health(now) for d in self.deployments]
+
+
+def parse_retry_after(error_text):
+    """Extract wait time from a rate limit error message"""
+    try:
+        # Look for "retry after X seconds" or "wait X seconds" patterns
+        match = re.search(r'retry after (\d+) second', error_text, re.IGNORECASE)
+        if not match:
+            match = re.search(r'wait (\d+) second', error_text, re.IGNORECASE)
+        if match:
+            return int(match.group(1))
+    except:
+        pass
+    return None
+
+
+def is_transient_error(error):
+    """True for errors worth retrying on another attempt/deployment: timeouts, connection errors and 5xx."""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 408 or status >= 500
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, httpx.TimeoutException, httpx.TransportError)):
+        return True
+    return "timed out" in str(error).lower() or "timeout" in type(error).__name__.lower()
+
+
+def _supported_kwargs(deployment, create_kwargs):
+    """Drop or downgrade `response_format` to what this deployment is known to accept."""
+    fmt = create_kwargs.get("response_format")
+    if not fmt or deployment.max_response_format == "json_schema":
+        return create_kwargs
+    kwargs = dict(create_kwargs)
+    if deployment.max_response_format == "json_object":
+        kwargs["response_format"] = {"type": "json_object"}
+    else:
+        kwargs.pop("response_format")
+    return kwargs
+
+
+def pooled_chat_completion(pool, messages, max_tokens=1000, max_retries=10, base_delay=2, label="",
+                           priority=PRIORITY_BULK, tier=None, flow="", **create_kwargs):
+    """
+    Send one chat request through the deployment pool (restricted to `tier` if given).
+    Each attempt waits for a scheduler slot of the given priority class.
+    429s put the deployment into cooldown and the request is retried on the next best deployment;
+    timeouts and 5xx are retried too. Any other error (400, content filter, auth) fails at once.
+    Returns the message content, or None when every attempt failed.
+    Each request is recorded once in LLM usage accounting (tokens, latency, retries, outcome).
+    """
+    started = time.time()
+    last_deployment = None
+
+    def record(outcome, usage=None, attempts=0):
+        usage_recorder.record_call(
+            provider="azure_openai",
+            deployment=last_deployment.deployment if last_deployment else None,
+            flow=flow,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0),
+            completion_tokens=getattr(usage, "completion_tokens", 0),
+            latency_ms=(time.time() - started) * 1000,
+            retries=attempts,
+            outcome=outcome,
+            tier=last_deployment.tier if last_deployment else tier,
+        )
+
+    single_deployment = len(pool.members(tier)) == 1
+    for attempt in range(max_retries):
+        with scheduler.slot(priority):
+            deployment, wait = pool.acquire(tier)
+            if deployment is not None:
+                call_kwargs = _supported_kwargs(deployment, create_kwargs)
+                try:
+                    resp = deployment.client.chat.completions.create(
+                        model=deployment.deployment,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        **call_kwargs
+                    )
+                    error = None
+                except Exception as e:
+                    error = e
+
+        if deployment is None:
+            # Every deployment is cooling down or out of quota: wait for the first one to free up
+            time.sleep(min(wait, 60))
+            continue
+
+        last_deployment = deployment
+        if error is None:
+            pool.release(deployment, "success")
+            record("success", getattr(resp, "usage", None), attempt)
+            return resp.choices[0].message.content
+
+        error_msg = str(error)
+        if "429" in error_msg or "RateLimitReached" in error_msg:
+            retry_after = parse_retry_after(error_msg)
+            pool.release(deployment, "rate_limited", retry_after=retry_after, error=error_msg[:200])
+            print(f"Rate limit hit (429) on '{deployment.name}' for '{label[:30]}...'. "
+                  f"Requested wait: {retry_after if retry_after else 'N/A'}s (Attempt {attempt+1}/{max_retries})")
+            if single_deployment:
+                # Single deployment: keep the old exponential backoff with jitter
+                delay = (retry_after + 1.5) if retry_after else (base_delay * (2 ** attempt)) * random.uniform(0.5, 1.5)
+                time.sleep(min(delay, 60))
+            continue
+
+        if "response_format" in error_msg and "response_format" in call_kwargs:
+            # Model does not support this output mode: remember, degrade one step and retry
+            pool.release(deployment, "success")
+            rejected = call_kwargs["response_format"].get("type")
+            deployment.max_response_format = "json_object" if rejected == "json_schema" else "none"
+            print(f"'{deployment.name}' rejected response_format={rejected} - using {deployment.max_response_format}")
+            continue
+
+        pool.release(deployment, "error", error=error_msg[:200])
+        print(f"OpenAI Error on '{deployment.name}': {error}")
+        if not is_transient_error(error):
+            # Request-level error (bad request, content filter, auth): retrying cannot help
+            record("error", attempts=attempt)
+            return None
+        if single_deployment:
+            time.sleep(min(base_delay * (2 ** attempt) * random.uniform(0.5, 1.5), 60))
+        # Other deployments may still be healthy - try the next one
+
+    print(f"Failed after {max_retries} attempts due to rate limits or transient errors.")
+    record("failed", attempts=max_retries)
+    return None
+
+
+class JSONOutputStats:
+    """
+    Per-flow counters for structured (JSON) LLM output.
+    Makes wasted calls visible: every malformed response is a paid call that produced nothing.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.flows = {}
+
+    def record(self, flow, outcome):
+        with self._lock:
+            counters = self.flows.setdefault(flow, {"calls": 0, "valid": 0, "malformed": 0, "schema_retries": 0, "failed": 0})
+            counters[outcome] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {flow: dict(c) for flow, c in self.flows.items()}
+
+
+json_output_stats = JSONOutputStats()
+
+# "schema" = schema-constrained output, "json_object" = JSON mode only, "off" = plain text + validation
+LLM_JSON_MODE = os.getenv("LLM_JSON_MODE", "schema").lower()
+LLM_SCHEMA_RETRIES = int(os.getenv("LLM_SCHEMA_RETRIES", "2"))
+
+
+def structured_completion(send, schema, flow, label="", schema_retries=None, on_attempt=None):
+    """
+    Run `send(user_suffix)` until it returns JSON that validates against `schema`.
+    Only schema violations are retried (transport retries happen inside `send`).
+    `on_attempt()` is called before every send, schema retries included.
+    Returns the parsed object, or None when the LLM never produced valid output.
+    """
+    if schema_retries is None:
+        schema_retries = LLM_SCHEMA_RETRIES
+
+    user_suffix = ""
+    for attempt in range(schema_retries + 1):
+        json_output_stats.record(flow, "calls")
+        if on_attempt is not None:
+            on_attempt()
+        raw = send(user_suffix)
+        if raw is None:
+            # Transport failure (rate limits / errors already retried) - nothing to validate
+            json_output_stats.record(flow, "failed")
+            return None
+
+        try:
+            data = extract_json(raw)
+            errors = validate_against_schema(data, schema)
+        except ValueError as e:
+            errors = [str(e)]
+
+        if not errors:
+            json_output_stats.record(flow, "valid")
+            return data
+
+        json_output_stats.record(flow, "malformed")
+        print(f"[{flow}] Malformed LLM response for '{label[:40]}' (Attempt {attempt+1}/{schema_retries+1}): {errors[:3]}")
+        if attempt < schema_retries:
+            json_output_stats.record(flow, "schema_retries")
+            user_suffix = (
+                "\n\nYour previous reply was rejected: " + "; ".join(errors[:5]) +
+                "\nReturn ONLY a JSON object that satisfies the required fields and types."
+            )
+
+    json_output_stats.record(flow, "failed")
+    return None
+
+# Record every successful LLM reply to a JSONL cassette (replayed by backend/mock_llm_server.py)
+LLM_RECORD_CASSETTE = os.getenv("LLM_RECORD_CASSETTE")
+_cassette_lock = threading.Lock()
+
+
+def prompt_key(system_prompt, user_message):
+    """Hash of the exact system + user prompt (same key as mock_llm_server.prompt_key)."""
+    return hashlib.sha1(f"{system_prompt}\n\n{user_message}".encode("utf-8")).hexdigest()
+
+
+def record_cassette(system_prompt, user_message, response):
+    """Append one prompt/response pair to the cassette file when recording is enabled."""
+    if not LLM_RECORD_CASSETTE or response is None:
+        return
+    line = json.dumps({"key": prompt_key(system_prompt, user_message), "user": user_message[:200], "response": response})
+    try:
+        with _cassette_lock, open(LLM_RECORD_CASSETTE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except Exception as e:
+        print(f"Cassette write error: {e}")
+
+
+def _response_format_for(schema, flow):
+    """`response_format` payload for the configured LLM_JSON_MODE (None = plain text)."""
+    if LLM_JSON_MODE == "schema" and schema.get("type") == "object":
+        return to_response_format(schema, f"{flow}_response")
+    if LLM_JSON_MODE in ("schema", "json_object"):
+        return {"type": "json_object"}
+    return None
+
+
 class LLMClient:
     def __init__(self):
         # Primary: Azure Claude
@@ -32,19 +481,11 @@ class LLMClient:
         self.azure_api_version = os.getenv("AZURE_CLAUDE_API_VERSION", "2023-06-01")
 
         # Fallback: Azure OpenAI (CEO requirement - use Azure, not direct OpenAI)
-        try:
-            from openai import AzureOpenAI
-            self.azure_openai_client = AzureOpenAI(
-                api_key=os.getenv("AZURE_OPENAI_API_KEY"),  # SDK expects AZURE_OPENAI_API_KEY
-                api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview"),
-                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-            )
-
-            self.azure_openai_deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini")
-            self.has_azure_openai = True
-        except Exception as e:
-            print(f"Azure OpenAI not configured: {e}")
-            self.has_azure_openai = False
+        # Routed through the shared deployment pool so the fallback also spreads load across regions
+        self.pool = azure_openai_pool
+        self.has_azure_openai = self.pool is not None
+        if not self.has_azure_openai:
+            print("Azure OpenAI not configured - no fallback pool")
         
         # Rate limiting
         self.last_request_time = 0
@@ -69,7 +510,26 @@ class LLMClient:
             pass
         return None
 
-    def chat_completion(self, system_prompt, user_message, temperature=0, max_tokens=1000):
+    def chat_completion(self, system_prompt, user_message, temperature=0, max_tokens=1000, flow="chatbot", priority=None):
+        content = self._complete(system_prompt, user_message, temperature, max_tokens,
+                                 priority=priority or priority_for_flow(flow), flow=flow)
+        return content if content is not None else '{}'
+
+    def chat_json(self, system_prompt, user_message, schema, flow="chatbot", temperature=0, max_tokens=1000, priority=None):
+        """
+        Structured variant of chat_completion: returns a dict validated against `schema`, or None.
+        Claude has no JSON mode here, so output is validated and only schema violations are retried;
+        the Azure OpenAI fallback requests schema-constrained output.
+        """
+        def send(user_suffix):
+            return self._complete(system_prompt, user_message + user_suffix, temperature, max_tokens,
+                                  response_format=_response_format_for(schema, flow),
+                                  priority=priority or priority_for_flow(flow), flow=flow)
+        return structured_completion(send, schema, flow, label=user_message)
+
+    def _complete(self, system_prompt, user_message, temperature=0, max_tokens=1000, response_format=None,
+                  priority=PRIORITY_BULK, flow=""):
+        """Claude first, Azure OpenAI pool as fallback. Returns the text or None if every route failed."""
         max_retries = 3
         base_wait_time = 5
         
@@ -94,13 +554,26 @@ class LLMClient:
                         "temperature": temperature
                     }
 
-                    response = requests.post(self.azure_endpoint, headers=headers, json=payload, timeout=300)
+                    started = time.time()
+                    with scheduler.slot(priority):
+                        response = requests.post(self.azure_endpoint, headers=headers, json=payload, timeout=300)
                     
                     if response.status_code == 200:
                         res_json = response.json()
-                        return res_json['content'][0]['text']
+                        text = res_json['content'][0]['text']
+                        usage = res_json.get('usage', {})
+                        usage_recorder.record_call(
+                            provider="azure_claude", deployment=self.azure_model, flow=flow,
+                            prompt_tokens=usage.get('input_tokens', 0), completion_tokens=usage.get('output_tokens', 0),
+                            latency_ms=(time.time() - started) * 1000, retries=attempt)
+                        record_cassette(system_prompt, user_message, text)
+                        return text
                     
-                    elif response.status_code == 429:
+                    usage_recorder.record_call(
+                        provider="azure_claude", deployment=self.azure_model, flow=flow,
+                        prompt_tokens=0, completion_tokens=0, latency_ms=(time.time() - started) * 1000,
+                        retries=attempt, outcome="rate_limited" if response.status_code == 429 else "error")
+                    if response.status_code == 429:
                         print(f"Azure Claude Rate Limit (429) - Switching to Azure OpenAI fallback...")
                         break 
                     
@@ -121,123 +594,113 @@ class LLMClient:
         # Fallback to Azure OpenAI after all Azure Claude retries exhausted or 429
         if self.has_azure_openai:
             print("Using Azure OpenAI fallback...")
-            # Reuse logic from OpenAIOnlyClient for the fallback
-            fb_retries = 5
-            fb_base_delay = 2
-            for fb_attempt in range(fb_retries):
-                try:
-                    resp = self.azure_openai_client.chat.completions.create(
-                        model=self.azure_openai_deployment,
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_message}
-                        ],
-                        temperature=temperature,
-                        max_tokens=max_tokens
-                    )
-                    print("Azure OpenAI fallback successful")
-                    return resp.choices[0].message.content
-                except Exception as e:
-                    error_msg = str(e)
-                    if "429" in error_msg or "RateLimitReached" in error_msg:
-                        retry_after = self._parse_retry_after(error_msg)
-                        if retry_after:
-                            delay = retry_after + 1.5
-                        else:
-                            import random
-                            delay = (fb_base_delay * (2 ** fb_attempt)) * random.uniform(0.5, 1.5)
-                        
-                        print(f"Fallback Rate Limit (429). Waiting {delay:.2f}s (Attempt {fb_attempt+1}/{fb_retries})")
-                        delay = min(delay, 60) # ✅ Cap delay to 60s
-                        time.sleep(delay)
-                        continue
-                    
-                    print(f"❌ Azure OpenAI Fallback Error: {e}")
-                    break
+            extra = {"response_format": response_format} if response_format else {}
+            content = pooled_chat_completion(
+                self.pool,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_message}
+                ],
+                max_tokens=max_tokens,
+                max_retries=5,
+                label=user_message,
+                priority=priority,
+                flow=flow,
+                temperature=temperature,
+                **extra
+            )
+            if content is not None:
+                print("Azure OpenAI fallback successful")
+                record_cassette(system_prompt, user_message, content)
+                return content
         else:
             print("Azure OpenAI not configured - no fallback available")
         
-        return '{}'
+        return None
 
 
 class OpenAIOnlyClient:
     """
     OpenAI-only client for Flow 2 processing.
     Faster and more reliable than Claude for bulk processing.
+    Requests are load-balanced across every deployment in the shared pool.
     """
     def __init__(self):
-        try:
-            from openai import AzureOpenAI
-            self.client = AzureOpenAI(
-                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-                api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview"),
-                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-            )
-            self.deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini")
-            print("OpenAI-only client initialized for Flow 2")
-        except Exception as e:
-            print(f"OpenAI client initialization failed: {e}")
+        self.pool = azure_openai_pool
+        if self.pool:
+            # Kept for scripts that inspect the primary deployment directly
+            self.client = self.pool.deployments[0].client
+            self.deployment = self.pool.deployments[0].deployment
+            print(f"OpenAI-only client initialized for Flow 2 ({len(self.pool.deployments)} deployment(s))")
+        else:
             self.client = None
-    
+            self.deployment = None
+
     def _parse_retry_after(self, error_text):
         """Extract wait time from rate limit error message"""
-        try:
-            # Look for "retry after X seconds" or "wait X seconds" patterns
-            match = re.search(r'retry after (\d+) second', error_text, re.IGNORECASE)
-            if not match:
-                match = re.search(r'wait (\d+) second', error_text, re.IGNORECASE)
-            
-            if match:
-                return int(match.group(1))
-        except:
-            pass
-        return None
+        return parse_retry_after(error_text)
 
-    def chat_completion(self, system_prompt, user_message, temperature=0, max_tokens=1000):
-        if not self.client:
-            return '{}'
-        
-        max_retries = 10  # Increased for stability in large runs
-        base_delay = 2   # Slightly higher base delay
-        
-        for attempt in range(max_retries):
-            try:
-                resp = self.client.chat.completions.create(
-                    model=self.deployment,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_message}
-                    ],
-                    temperature=0,
-                    seed=42, # Fixed seed for determinism
-                    top_p=0.0000000001, # Extremely low top_p to stick to the best choice
-                    max_tokens=max_tokens
-                )
-                return resp.choices[0].message.content
-            except Exception as e:
-                error_msg = str(e)
-                if "429" in error_msg or "RateLimitReached" in error_msg:
-                    # ✅ SMART RETRY: Follow Azure's recommended wait time
-                    retry_after = self._parse_retry_after(error_msg)
-                    if retry_after:
-                        delay = retry_after + 1.5  # Add small buffer to be 100% safe
-                    else:
-                        import random
-                        jitter = random.uniform(0.5, 1.5)
-                        delay = (base_delay * (2 ** attempt)) * jitter
-                    
-                    print(f"Rate limit hit (429) for '{user_message[:30]}...'. Requested wait: {retry_after if retry_after else 'N/A'}s. Waiting {delay:.2f}s (Attempt {attempt+1}/{max_retries})")
-                    delay = min(delay, 60) # Cap delay at 60s
-                    time.sleep(delay)
-                    continue
-                
-                print(f"OpenAI Error: {e}")
-                return '{}'
+    def get_health(self):
+        """Per-deployment health and quota usage."""
+        return self.pool.health() if self.pool else []
+
+    def chat_completion(self, system_prompt, user_message, temperature=0, max_tokens=1000, flow="flow2", priority=None):
+        content = self._complete(system_prompt, user_message, max_tokens,
+                                 priority=priority or priority_for_flow(flow), flow=flow)
+        return content if content is not None else '{}'
+
+    def cascade_enabled(self):
+        """True when the cheap-first cascade can run (LLM_CASCADE and both tiers configured)."""
+        return LLM_CASCADE != "off" and bool(self.pool) and self.pool.has_tiers(TIER_FAST, TIER_STRONG)
+
+    def chat_json(self, system_prompt, user_message, schema, flow="flow2", temperature=0, max_tokens=1000, priority=None,
+                  tier=None, on_attempt=None):
+        """
+        Structured variant of chat_completion: requests schema-constrained output (LLM_JSON_MODE),
+        validates the reply against `schema` and retries only on schema violations.
+        `tier` restricts the call to fast or strong deployments (cascade mode).
+        `on_attempt()` is called for every request sent (see structured_completion).
+        Returns the parsed dict, or None if no valid output was produced.
+        """
+        def send(user_suffix):
+            return self._complete(system_prompt, user_message + user_suffix, max_tokens,
+                                  response_format=_response_format_for(schema, flow),
+                                  priority=priority or priority_for_flow(flow), tier=tier, flow=flow)
+        return structured_completion(send, schema, flow, label=user_message, on_attempt=on_attempt)
+
+    def _complete(self, system_prompt, user_message, max_tokens=1000, response_format=None, priority=PRIORITY_BULK,
+                  tier=None, flow="flow2"):
+        if not self.pool:
+            return None
         
-        print(f"Failed after {max_retries} attempts due to rate limits.")
-        return '{}'
+        extra = {"response_format": response_format} if response_format else {}
+        content = pooled_chat_completion(
+            self.pool,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            max_tokens=max_tokens,
+            max_retries=10,  # Increased for stability in large runs
+            label=user_message,
+            priority=priority,
+            tier=tier,
+            flow=flow,
+            temperature=0,
+            seed=42, # Fixed seed for determinism
+            top_p=0.0000000001, # Extremely low top_p to stick to the best choice
+            **extra
+        )
+        record_cassette(system_prompt, user_message, content)
+        return content
 
 
 # Singleton instances
+try:
+    azure_openai_pool = DeploymentPool.from_env()  # Shared by both clients
+except Exception as e:
+    print(f"Azure OpenAI not configured: {e}")
+    azure_openai_pool = None
+
 llm_client = LLMClient()  # For chatbot (uses Claude + fallback)
 flow2_client = OpenAIOnlyClient()  # For Flow 2 (OpenAI only)
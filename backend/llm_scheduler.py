@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Priority classes (highest first)
+PRIORITY_INTERACTIVE = "interactive"   # Chatbot, translations - a user is waiting on the screen
+PRIORITY_QA = "qa"                     # QA audits and diagnostics
+PRIORITY_BULK = "bulk"                 # Flow 2, 7-Eleven import, batch re-mastering
+PRIORITY_ORDER = [PRIORITY_INTERACTIVE, PRIORITY_QA, PRIORITY_BULK]
+
+# Default priority for each flow tag used by the LLM callers
+FLOW_PRIORITY = {
+    "chatbot": PRIORITY_INTERACTIVE,
+    "translate": PRIORITY_INTERACTIVE,
+    "qa_audit": PRIORITY_QA,
+    "flow2": PRIORITY_BULK,
+    "7eleven": PRIORITY_BULK,
+}
+
+
+def priority_for_flow(flow):
+    return FLOW_PRIORITY.get(flow, PRIORITY_BULK)
+
+
+class LLMScheduler:
+    """
+    Admission control for outgoing LLM requests, shared by llm_client and flow2_client.
+
+    - At most `max_concurrency` requests are in flight at once.
+    - `interactive_reserved` of those slots can only be used by interactive traffic,
+      so a chat question never queues behind a 10,000-item Flow 2 run.
+    - A freed slot always goes to the highest waiting priority class.
+    """
+    def __init__(self, max_concurrency=16, interactive_reserved=4):
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.interactive_reserved = min(max(int(interactive_reserved), 0), self.max_concurrency - 1)
+        self._cond = threading.Condition()
+        self.active = {p: 0 for p in PRIORITY_ORDER}
+        self.waiting = {p: 0 for p in PRIORITY_ORDER}
+        self.metrics = {
+            p: {"admitted": 0, "total_wait_s": 0.0, "max_wait_s": 0.0, "max_queue_depth": 0, "recent_waits": deque(maxlen=500)}
+            for p in PRIORITY_ORDER
+        }
+
+    def _can_admit(self, priority):
+        in_flight = sum(self.active.values())
+        if in_flight >= self.max_concurrency:
+            return False
+        # Never jump ahead of a waiting higher-priority class
+        for higher in PRIORITY_ORDER[:PRIORITY_ORDER.index(priority)]:
+            if self.waiting[higher]:
+                return False
+        # Reserved slots are for interactive traffic only
+        if priority != PRIORITY_INTERACTIVE and in_flight >= self.max_concurrency - self.interactive_reserved:
+            return False
+        return True
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_BULK):
+        """Hold one request slot for the duration of a single HTTP call."""
+        if priority not in self.active:
+            priority = PRIORITY_BULK
+        queued_at = time.time()
+        with self._cond:
+            self.waiting[priority] += 1
+            m = self.metrics[priority]
+            m["max_queue_depth"] = max(m["max_queue_depth"], self.waiting[priority])
+            while not self._can_admit(priority):
+                self._cond.wait(timeout=1.0)
+            self.waiting[priority] -= 1
+            self.active[priority] += 1
+
+            waited = time.time() - queued_at
+            m["admitted"] += 1
+            m["total_wait_s"] += waited
+            m["max_wait_s"] = max(m["max_wait_s"], waited)
+            m["recent_waits"].append(waited)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active[priority] -= 1
+                self._cond.notify_all()
+
+    def stats(self):
+        """Queue depth, in-flight count and wait-time metrics per priority class."""
+        with self._cond:
+            classes = {}
+            for p in PRIORITY_ORDER:
+                m = self.metrics[p]
+                waits = sorted(m["recent_waits"])
+                classes[p] = {
+                    "queue_depth": self.waiting[p],
+                    "in_flight": self.active[p],
+                    "admitted": m["admitted"],
+                    "avg_wait_s": round(m["total_wait_s"] / m["admitted"], 4) if m["admitted"] else 0,
+                    "p95_wait_s": round(waits[int(len(waits) * 0.95) - 1], 4) if waits else 0,
+                    "max_wait_s": round(m["max_wait_s"], 4),
+                    "max_queue_depth": m["max_queue_depth"],
+                }
+            return {
+                "max_concurrency": self.max_concurrency,
+                "interactive_reserved": self.interactive_reserved,
+                "in_flight": sum(self.active.values()),
+                "classes": classes,
+            }
+
+
+scheduler = LLMScheduler(
+    max_concurrency=os.getenv("LLM_MAX_CONCURRENCY", "16"),
+    interactive_reserved=os.getenv("LLM_INTERACTIVE_RESERVED", "4"),
+)
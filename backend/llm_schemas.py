@@ -0,0 +1,219 @@
+import json
+import re
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Response schemas for every LLM flow (JSON Schema subset)
+#  Used to request schema-constrained output and to validate what comes back.
+# ─────────────────────────────────────────────────────────────────────────────
+
+_STR_OR_NULL = {"type": ["string", "null"]}
+
+# Flow 2: normalize_item_llm (LLM_CACHE_STORAGE)
+FLOW2_ATTRIBUTES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "brand": _STR_OR_NULL,
+        "product_line": _STR_OR_NULL,
+        "flavour": _STR_OR_NULL,
+        "variant": _STR_OR_NULL,
+        "product_form": _STR_OR_NULL,
+        "is_sugar_free": {"type": ["boolean", "null"]},
+        "size": _STR_OR_NULL,
+        "base_item": _STR_OR_NULL,
+        "removed_marketing_terms": {"type": "array", "items": {"type": "string"}},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+    },
+    # variant / product_line / product_form are often omitted by the model and defaulted downstream
+    "required": ["brand", "flavour", "size", "base_item", "confidence"],
+}
+
+# 7-Eleven import: _call_711_llm (7-eleven_llm_cache)
+SEVEN_ELEVEN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ArticleDescription_clean": {"type": "string"},
+        "7E_Nrmsize": _STR_OR_NULL,
+        "7E_MPack": {"type": "string"},
+        "7E_Variant": {"type": "string"},
+        "7E_product_form": {"type": "string"},
+        "7E_flavour": {"type": "string"},
+    },
+    "required": ["ArticleDescription_clean", "7E_Nrmsize", "7E_MPack", "7E_Variant", "7E_product_form", "7E_flavour"],
+}
+
+# 7-Eleven batched enrichment (_request_711_llm_batch): one reply for many descriptions, matched by id.
+# Items are validated one by one against SEVEN_ELEVEN_SCHEMA so a single bad item does not fail the batch.
+SEVEN_ELEVEN_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"id": {"type": "integer"}, **SEVEN_ELEVEN_SCHEMA["properties"]},
+                "required": ["id"],
+            },
+        },
+    },
+    "required": ["items"],
+}
+
+# QA: AI Audit semantic verify (qa_engine.process_audit_logic)
+QA_AUDIT_MATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "matched": {"type": "boolean"},
+        "match_id": {"type": ["string", "number", "null"]},
+        "reason": {"type": "string"},
+    },
+    "required": ["matched", "reason"],
+}
+
+# QA: Mastering audit bucket grouping (mastering_qa_engine.process_mastering_logic)
+MASTERING_QA_GROUPS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "potential_groups": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "group_name": {"type": "string"},
+                    "item_indices": {"type": "array", "items": {"type": "integer"}},
+                    "reason": {"type": "string"},
+                    "confidence": {"type": "number"},
+                },
+                "required": ["group_name", "item_indices", "confidence"],
+            },
+        },
+    },
+    "required": ["potential_groups"],
+}
+
+# QA: Root-cause diagnostics (get_audit_diagnostic / get_mastering_diagnostic)
+DIAGNOSTIC_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "diagnosis": {"type": "string"},
+        "rule_reference": {"type": "string"},
+        "actionable_solution": {"type": "string"},
+    },
+    "required": ["diagnosis", "rule_reference", "actionable_solution"],
+}
+
+# Chatbot: Stage 1 master node and Stage 2 MongoDB query generation
+CHATBOT_MASTER_NODE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "BRAND": _STR_OR_NULL,
+        "ITEM": _STR_OR_NULL,
+        "MARKET": _STR_OR_NULL,
+        "FACTS": _STR_OR_NULL,
+        "SORT": {"type": ["integer", "null"]},
+        "LIMIT": {"type": ["integer", "null"]},
+    },
+    "required": [],
+}
+
+CHATBOT_QUERY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "query": {"type": "object"},
+        "sort": {"type": "array"},
+        "limit": {"type": "integer", "minimum": 1},
+        "explanation": {"type": "string"},
+    },
+    "required": ["query"],
+}
+
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def _matches_type(value, type_name):
+    if type_name == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if type_name == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, _JSON_TYPES.get(type_name, object))
+
+
+def validate_against_schema(data, schema, path="$"):
+    """
+    Minimal JSON Schema validator (type, properties, required, items, enum, minimum, maximum).
+    Returns a list of violation messages; an empty list means the data is valid.
+    """
+    errors = []
+    expected = schema.get("type")
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_matches_type(data, t) for t in types):
+            return [f"{path}: expected {'/'.join(types)}, got {type(data).__name__}"]
+
+    if "enum" in schema and data not in schema["enum"]:
+        errors.append(f"{path}: {data!r} not in {schema['enum']}")
+
+    if isinstance(data, (int, float)) and not isinstance(data, bool):
+        if "minimum" in schema and data < schema["minimum"]:
+            errors.append(f"{path}: {data} < minimum {schema['minimum']}")
+        if "maximum" in schema and data > schema["maximum"]:
+            errors.append(f"{path}: {data} > maximum {schema['maximum']}")
+
+    if isinstance(data, dict):
+        for key in schema.get("required", []):
+            if key not in data:
+                errors.append(f"{path}: missing required field '{key}'")
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in data:
+                errors.extend(validate_against_schema(data[key], sub_schema, f"{path}.{key}"))
+
+    if isinstance(data, list) and "items" in schema:
+        for i, value in enumerate(data):
+            errors.extend(validate_against_schema(value, schema["items"], f"{path}[{i}]"))
+
+    return errors
+
+
+def extract_json(raw_content):
+    """
+    Parse a JSON object/array out of an LLM response.
+    Tolerates ```json fences and surrounding prose. Raises ValueError when nothing parses.
+    """
+    if raw_content is None:
+        raise ValueError("Empty response from LLM")
+    text = raw_content.strip()
+    if not text:
+        raise ValueError("Empty response from LLM")
+
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1).strip()
+
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    # Fall back to the outermost object or array
+    for open_ch, close_ch in (("{", "}"), ("[", "]")):
+        start, end = text.find(open_ch), text.rfind(close_ch)
+        if start != -1 and end > start:
+            try:
+                return json.loads(text[start:end + 1])
+            except json.JSONDecodeError:
+                continue
+    raise ValueError(f"No valid JSON in response: {text[:100]}")
+
+
+def to_response_format(schema, name):
+    """Build the OpenAI/Azure `response_format` payload for schema-constrained output."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "schema": schema, "strict": False},
+    }
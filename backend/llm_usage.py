@@ -0,0 +1,237 @@
+import contextvars
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+try:
+    from backend.database import get_collection
+except ImportError:
+    # Fallback: if imported from inside the backend folder
+    from database import get_collection
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  LLM usage accounting
+#  Every LLM call (and every cache hit that avoided one) is recorded in LLM_USAGE,
+#  tagged with the pipeline run it belongs to. Writes are buffered and flushed in bulk
+#  by a background thread so accounting never adds a round-trip to the hot path.
+#  The current run is a context variable: concurrent runs and chatbot requests each see
+#  their own. Worker threads do not inherit it; wrap their callables with bind_run().
+# ─────────────────────────────────────────────────────────────────────────────
+
+LLM_USAGE_COL = "LLM_USAGE"
+FLUSH_SIZE = int(os.getenv("LLM_USAGE_FLUSH_SIZE", "200"))
+FLUSH_INTERVAL = float(os.getenv("LLM_USAGE_FLUSH_INTERVAL", "5"))
+USAGE_ENABLED = os.getenv("LLM_USAGE_TRACKING", "true").lower() != "false"
+
+
+def _load_pricing():
+    """
+    LLM_PRICING: JSON map of deployment/model name -> USD per 1K tokens, e.g.
+    {"gpt-5-nano": {"input": 0.00005, "output": 0.0004}, "claude-sonnet": {"input": 0.003, "output": 0.015}}
+    """
+    try:
+        return json.loads(os.getenv("LLM_PRICING", "{}"))
+    except Exception as e:
+        print(f"Invalid LLM_PRICING config: {e}")
+        return {}
+
+
+PRICING = _load_pricing()
+
+
+def call_cost(deployment, prompt_tokens, completion_tokens):
+    price = PRICING.get(deployment)
+    if not price:
+        return 0.0
+    return (prompt_tokens or 0) / 1000 * price.get("input", 0) + (completion_tokens or 0) / 1000 * price.get("output", 0)
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0
+    idx = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[idx]
+
+
+_current_run_id = contextvars.ContextVar("llm_usage_run_id", default=None)
+
+
+def bind_run(fn):
+    """Wrap `fn` so it records usage under the caller's run when executed on a worker thread."""
+    run_id = _current_run_id.get()
+
+    def run(*args, **kwargs):
+        token = _current_run_id.set(run_id)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_run_id.reset(token)
+    return run
+
+
+class UsageRecorder:
+    """Buffered writer for LLM_USAGE; the current pipeline run id lives in a context variable."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._cache_hits = {}  # (run_id, flow) -> hits not yet flushed
+        self._wake = threading.Event()
+        self._flusher = None
+
+    @property
+    def run_id(self):
+        return _current_run_id.get()
+
+    def start_run(self, name):
+        """
+        Tag every following call in this context with a new run id (Flow 2 run, 7-Eleven import...).
+        Returns the token to pass to end_run(), which restores the enclosing run (if any).
+        """
+        self.flush()
+        run_id = f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        token = _current_run_id.set(run_id)
+        print(f"📊 LLM usage run started: {run_id}")
+        return token
+
+    def end_run(self, token):
+        self.flush()
+        _current_run_id.reset(token)
+
+    def _current_run(self):
+        return _current_run_id.get() or f"adhoc-{datetime.now().strftime('%Y%m%d')}"
+
+    def record_call(self, provider, deployment, flow, prompt_tokens, completion_tokens, latency_ms,
+                    retries=0, outcome="success", tier=None):
+        if not USAGE_ENABLED:
+            return
+        doc = {
+            "ts": datetime.utcnow(),
+            "run_id": self._current_run(),
+            "provider": provider,
+            "deployment": deployment,
+            "flow": flow or "unknown",
+            "prompt_tokens": prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0,
+            "latency_ms": round(latency_ms, 1),
+            "retries": retries,
+            "outcome": outcome,
+        }
+        if tier:
+            doc["tier"] = tier
+        with self._lock:
+            self._buffer.append(doc)
+            due = len(self._buffer) >= FLUSH_SIZE
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="llm-usage-flush", daemon=True)
+                self._flusher.start()
+        if due:
+            self._wake.set()
+
+    def _flush_loop(self):
+        """Background writer: flushes every FLUSH_INTERVAL seconds, or as soon as the buffer is full."""
+        while True:
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            self.flush()
+
+    def record_cache_hit(self, flow, count=1):
+        """A cache hit is an LLM call that did not have to be made."""
+        if not USAGE_ENABLED:
+            return
+        key = (self._current_run(), flow)
+        with self._lock:
+            self._cache_hits[key] = self._cache_hits.get(key, 0) + count
+
+    def flush(self):
+        with self._lock:
+            docs, self._buffer = self._buffer, []
+            hits, self._cache_hits = self._cache_hits, {}
+        for (run_id, flow), count in hits.items():
+            docs.append({"ts": datetime.utcnow(), "run_id": run_id, "flow": flow, "outcome": "cache_hit", "count": count})
+        if not docs:
+            return
+        try:
+            get_collection(LLM_USAGE_COL).insert_many(docs, ordered=False)
+        except Exception as e:
+            print(f"⚠️ LLM usage flush failed ({len(docs)} records dropped): {e}")
+
+
+usage_recorder = UsageRecorder()
+
+
+def list_runs(limit=20):
+    """Most recent runs with their first/last call time."""
+    coll = get_collection(LLM_USAGE_COL)
+    runs = coll.aggregate([
+        {"$group": {"_id": "$run_id", "started": {"$min": "$ts"}, "ended": {"$max": "$ts"}, "records": {"$sum": 1}}},
+        {"$sort": {"started": -1}},
+        {"$limit": limit},
+    ])
+    return [{"run_id": r["_id"], "started": r["started"], "ended": r["ended"], "records": r["records"]} for r in runs]
+
+
+def summarize_usage(run_id=None):
+    """
+    Per-flow and per-deployment summary for one run (default: the most recent run):
+    calls, tokens, p50/p95 latency, retries, outcomes, calls saved by cache and cost.
+    """
+    usage_recorder.flush()
+    coll = get_collection(LLM_USAGE_COL)
+    if run_id is None:
+        latest = list_runs(limit=1)
+        if not latest:
+            return {"run_id": None, "flows": {}, "deployments": {}, "totals": {}}
+        run_id = latest[0]["run_id"]
+
+    flows, deployments = {}, {}
+    latencies = {}
+    projection = {"_id": 0, "flow": 1, "deployment": 1, "provider": 1, "outcome": 1, "count": 1,
+                  "prompt_tokens": 1, "completion_tokens": 1, "latency_ms": 1, "retries": 1}
+    for doc in coll.find({"run_id": run_id}, projection):
+        flow = doc.get("flow", "unknown")
+        f = flows.setdefault(flow, {"calls": 0, "cache_hits": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                    "retries": 0, "outcomes": {}, "cost_usd": 0.0})
+        if doc.get("outcome") == "cache_hit":
+            f["cache_hits"] += doc.get("count", 1)
+            continue
+
+        cost = call_cost(doc.get("deployment"), doc.get("prompt_tokens"), doc.get("completion_tokens"))
+        f["calls"] += 1
+        f["prompt_tokens"] += doc.get("prompt_tokens", 0)
+        f["completion_tokens"] += doc.get("completion_tokens", 0)
+        f["retries"] += doc.get("retries", 0)
+        f["outcomes"][doc["outcome"]] = f["outcomes"].get(doc["outcome"], 0) + 1
+        f["cost_usd"] += cost
+        latencies.setdefault(flow, []).append(doc.get("latency_ms", 0))
+
+        d = deployments.setdefault(doc.get("deployment") or "unknown", {
+            "provider": doc.get("provider"), "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+        d["calls"] += 1
+        d["prompt_tokens"] += doc.get("prompt_tokens", 0)
+        d["completion_tokens"] += doc.get("completion_tokens", 0)
+        d["cost_usd"] += cost
+
+    for flow, f in flows.items():
+        lat = sorted(latencies.get(flow, []))
+        f["latency_p50_ms"] = _percentile(lat, 50)
+        f["latency_p95_ms"] = _percentile(lat, 95)
+        requested = f["calls"] + f["cache_hits"]
+        f["cache_hit_ratio"] = round(f["cache_hits"] / requested, 4) if requested else 0
+        f["cost_usd"] = round(f["cost_usd"], 6)
+    for d in deployments.values():
+        d["cost_usd"] = round(d["cost_usd"], 6)
+
+    all_lat = sorted(l for lat in latencies.values() for l in lat)
+    totals = {
+        "calls": sum(f["calls"] for f in flows.values()),
+        "calls_saved_by_cache": sum(f["cache_hits"] for f in flows.values()),
+        "prompt_tokens": sum(f["prompt_tokens"] for f in flows.values()),
+        "completion_tokens": sum(f["completion_tokens"] for f in flows.values()),
+        "latency_p50_ms": _percentile(all_lat, 50),
+        "latency_p95_ms": _percentile(all_lat, 95),
+        "cost_usd": round(sum(f["cost_usd"] for f in flows.values()), 6),
+        "priced": bool(PRICING),
+    }
+    return {"run_id": run_id, "flows": flows, "deployments": deployments, "totals": totals}
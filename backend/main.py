@@ -14,6 +14,9 @@ from backend.database import get_collection, create_indexes, RAW_DATA_COL, SINGL
 from backend.auth import validate_credentials, create_session, verify_session, destroy_session, get_user_info
 from backend.qa_engine import audit_all_brands, process_audit_logic, STOP_SIGNALS as QA_STOP_SIGNALS, get_audit_diagnostic, translate_audit_text
 from backend.mastering_qa_engine import process_mastering_logic, STOP_SIGNALS as MASTERING_STOP_SIGNALS, get_mastering_diagnostic, translate_diagnostic_text
+from backend.llm_usage import bind_run, usage_recorder, list_runs, summarize_usage
+from backend.llm_cache import seven_eleven_cache, all_cache_stats
+from pymongo import UpdateOne
 from pydantic import BaseModel
 import io
 import pandas as pd
@@ -30,6 +33,54 @@ app = FastAPI(title="FMCG Product Mastering Platform")
 async def startup_event():
     print("🚀 Creating MongoDB indexes...")
     create_indexes()
+    asyncio.get_event_loop().run_in_executor(None, _backfill_flow2_index_keys)
+    if os.getenv("LLM_CACHE_SNAPSHOT_WARM", "false").lower() == "true":
+        asyncio.get_event_loop().run_in_executor(None, _warm_caches_from_snapshot)
+    interval = int(os.getenv("LLM_CACHE_REVALIDATE_INTERVAL", "0"))
+    if interval > 0:
+        asyncio.get_event_loop().create_task(_background_cache_revalidation(interval))
+
+
+def _backfill_flow2_index_keys():
+    """One-off: add clean_key / token_key to LLM_CACHE_STORAGE entries cached before they were recorded."""
+    from backend.processor import flow2_cache
+    try:
+        updated = flow2_cache.backfill_index()
+        if updated:
+            print(f"🔑 Backfilled clean_key/token_key on {updated} Flow 2 cache entries")
+    except Exception as e:
+        print(f"⚠️ Flow 2 cache key backfill error: {e}")
+
+
+def _warm_caches_from_snapshot():
+    """Fill the in-process LLM cache tiers from the local snapshot file (see cache_snapshot.py)."""
+    from backend.cache_snapshot import warm_cache, CACHE_NAMES, SNAPSHOT_PATH
+    if not SNAPSHOT_PATH.exists():
+        print(f"⚠️ LLM_CACHE_SNAPSHOT_WARM is set but {SNAPSHOT_PATH} does not exist")
+        return
+    try:
+        loaded = {name: warm_cache(name) for name in CACHE_NAMES}
+        print(f"🔥 Warmed LLM caches from snapshot: {loaded}")
+    except Exception as e:
+        print(f"⚠️ Snapshot warm-up error: {e}")
+
+
+async def _background_cache_revalidation(interval: int):
+    """Gradually refresh stale LLM cache entries (LLM_CACHE_REVALIDATE_BATCH per cache every `interval` seconds)."""
+    from backend.processor import revalidate_flow2_cache
+    batch = int(os.getenv("LLM_CACHE_REVALIDATE_BATCH", "50"))
+    loop = asyncio.get_event_loop()
+    print(f"♻️ Background cache revalidation every {interval}s ({batch} entries per cache)")
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            flow2 = await loop.run_in_executor(None, revalidate_flow2_cache, batch)
+            seven = await loop.run_in_executor(None, _revalidate_711_cache, batch)
+            if flow2["revalidated"] or seven["revalidated"] or flow2["failed"] or seven["failed"]:
+                print(f"♻️ Revalidated {flow2['revalidated']} Flow 2 / {seven['revalidated']} 7-Eleven cache entries "
+                      f"({flow2['failed']} / {seven['failed']} failed, kept until the next pass)")
+        except Exception as e:
+            print(f"⚠️ Background cache revalidation error: {e}")
 
 # CORS Configuration - Support direct port access
 app.add_middleware(
@@ -229,12 +280,17 @@ async def upload_excel(file: UploadFile = File(...), request: Request = None):
         )
 
 @app.post("/process/llm-mastering/{sheet_name}")
-async def trigger_llm_mastering(sheet_name: str, request: Request = None):
-    """Flow 2: LLM-based mastering with marketing keyword removal"""
+async def trigger_llm_mastering(sheet_name: str, request: Request = None, incremental: bool = False, brands: str = None):
+    """
+    Flow 2: LLM-based mastering with marketing keyword removal.
+    incremental=true re-clusters only pre-groups touched since the last run.
+    brands=OREO,POCKY re-masters only those brands and replaces only their master records.
+    """
     from backend.processor import process_llm_mastering_flow_2
     
     try:
-        results = await process_llm_mastering_flow_2(sheet_name, request=request)
+        results = await process_llm_mastering_flow_2(sheet_name, request=request, incremental=incremental,
+                                                     brands=brands.split(",") if brands else None)
         return {
             "status": "success",
             "sheet_name": sheet_name,
@@ -246,6 +302,47 @@ async def trigger_llm_mastering(sheet_name: str, request: Request = None):
             "message": str(e)
         }
 
+@app.get("/llm/deployments/health")
+async def get_llm_deployment_health():
+    """Per-deployment load, quota usage and health of the Azure OpenAI pool."""
+    from backend.llm_client import flow2_client
+    deployments = flow2_client.get_health()
+    return {
+        "status": "success",
+        "deployments": deployments,
+        "healthy": sum(1 for d in deployments if d["status"] != "COOLING_DOWN")
+    }
+
+@app.get("/llm/json-stats")
+async def get_llm_json_stats():
+    """Structured-output counters per flow: calls, valid, malformed, schema retries, failed."""
+    from backend.llm_client import json_output_stats
+    flows = json_output_stats.snapshot()
+    for counters in flows.values():
+        counters["malformed_rate"] = round(counters["malformed"] / counters["calls"], 4) if counters["calls"] else 0
+    return {"status": "success", "flows": flows}
+
+@app.get("/llm/scheduler/stats")
+async def get_llm_scheduler_stats():
+    """Queue depth, in-flight requests and admission wait times per priority class."""
+    from backend.llm_scheduler import scheduler
+    return {"status": "success", **scheduler.stats()}
+
+@app.get("/llm/usage/runs")
+async def get_llm_usage_runs(limit: int = 20):
+    """Most recent pipeline runs that made (or avoided) LLM calls."""
+    return {"status": "success", "runs": list_runs(limit=limit)}
+
+@app.get("/llm/usage/summary")
+async def get_llm_usage_summary(run_id: str = None):
+    """Per-flow / per-deployment tokens, p50/p95 latency, calls saved by cache and cost for a run (default: latest)."""
+    return {"status": "success", **summarize_usage(run_id)}
+
+@app.get("/llm/cache/memory")
+async def get_llm_cache_memory_stats():
+    """In-process LRU tier of every LLM cache: entries, size, hits/misses/evictions, pending writes."""
+    return {"status": "success", "caches": all_cache_stats()}
+
 @app.get("/dashboard/summary")
 async def get_summary():
     """Get dashboard summary with merge statistics"""
@@ -772,6 +869,8 @@ async def reset_database(clear_cache: bool = False):
         reset_main_collections()
         if clear_cache:
             clear_llm_cache()
+            from backend.processor import flow2_cache
+            flow2_cache.discard()
             
         return {
             "status": "success", 
@@ -793,7 +892,7 @@ async def reset_database(clear_cache: bool = False):
 async def export_flow1_report():
     """Export single_stock_data (Flow 1 output) as CSV."""
     coll = get_collection(SINGLE_STOCK_COL)
-    docs_cursor = coll.find({}, {"_id": 0})
+    docs_cursor = coll.find({}, {"_id": 0, "content_hash": 0})
 
     def generate():
         import csv
@@ -817,15 +916,21 @@ async def export_flow1_report():
     )
 
 @app.post("/pipeline/run-mapping")
-async def pipeline_run_mapping():
-    """Run Mapping Analysis (Flow 3). Wrapper around existing mapping_analysis.run_mapping() - no logic changes."""
+async def pipeline_run_mapping(incremental: bool = False):
+    """
+    Run Mapping Analysis (Flow 3). Wrapper around existing mapping_analysis.run_mapping().
+    incremental=true re-maps only the articles in pending 7-Eleven change sets (incremental imports).
+    """
     try:
         root = str(Path(__file__).parent.parent)
         if root not in sys.path:
             sys.path.insert(0, root)
-        from mapping_analysis import run_mapping, connect_db
+        from mapping_analysis import run_mapping, connect_db, pending_changes
 
-        run_mapping()
+        changes = pending_changes() if incremental else None
+        if incremental and changes is None:
+            return {"status": "success", "mode": "incremental", "message": "No pending 7-Eleven changes to map."}
+        run = run_mapping(changes)
 
         db, _, _, coll_results = connect_db()
         total = coll_results.count_documents({})
@@ -835,6 +940,9 @@ async def pipeline_run_mapping():
 
         return {
             "status": "success",
+            "mode": run["mode"],
+            "articles_mapped": run["articles_mapped"],
+            "change_sets": changes["change_set_ids"] if changes else [],
             "total_mapped": total,
             "level1_matches": l1,
             "level2_matches": l2,
@@ -881,248 +989,266 @@ async def export_mapping_report():
 #  7-ELEVEN IMPORT — with LLM Cache on ArticleDescription
 # ─────────────────────────────────────────────────────────────────────────────
 
-SEVEN_ELEVEN_COL      = "7-eleven_data"
-SEVEN_ELEVEN_CACHE_COL = "7-eleven_llm_cache"
-
-# 7-Eleven prompt: extract exactly the 6 fields needed
-_711_SYSTEM_PROMPT = """
-You are a strict FMCG Data Scientist. Your task is to extract attributes from Malaysian 7-Eleven descriptions with 100% consistency.
-
-Rules for Logic Stability:
-1. ArticleDescription_clean: MUST remove all weights (e.g., 130g) and pack sizes (e.g., 10s, X10). Clean readable product name in Sentence-case.
-2. 7E_Nrmsize: MUST be only the number + Unit (G/ML). For packs like 10Gx10, extract "10G".
-3. 7E_MPack: If "X<n>", "<n>s", or "<n>x" exists, extract as "X<n>". Default "X1".
-4. 7E_Variant: Extract sub-brands or product series (e.g., DAIRY MILK, MARIE, DUCHESS, CHUNKY, 4D). If it's a distinct sub-line, it is a Variant.
-5. 7E_product_form: Extract the physical form (e.g., BISCUITS, CHIPS, GUMMY, CAKE, WAFER, STICK, CRACKER). If not clear or not applicable, "NONE".
-6. 7E_flavour: Identify the primary taste or flavour profile (e.g., CHOCOLATE, ALMOND, MIXED NUT, FRUIT&NUT, BLACKFOREST, LEMON, STRAWBERRY, BBQ, SALTED, SEAWEED, SPICY, HOT & SPICY, CHEESE, KIMCHI, HONEY BUTTER, SALTED EGG, TIRAMISU). 
-    - IMPORTANT: If it's a plain/standard version, ALWAYS use "ORIGINAL". Do not use "PLAIN" or "REGULAR".
-
-Constraint: 
-- Consistency is priority. 
-- Return ONLY a valid JSON object. No conversational text.
-
-Return format:
-{
-  "ArticleDescription_clean": "...",
-  "7E_Nrmsize": "...",
-  "7E_MPack": "X1",
-  "7E_Variant": "NONE",
-  "7E_product_form": "NONE",
-  "7E_flavour": "NONE"
-}
-
-Examples:
-- "Hwa Tai Lemon Treat 100g" -> {"ArticleDescription_clean": "Hwa Tai Lemon Treat", "7E_Nrmsize": "100G", "7E_MPack": "X1", "7E_Variant": "NONE", "7E_product_form": "NONE", "7E_flavour": "LEMON"}
-- "Hwa Tai Luxury Cracker Vegetable 148g" -> {"ArticleDescription_clean": "Hwa Tai Luxury Cracker", "7E_Nrmsize": "148G", "7E_MPack": "X1", "7E_Variant": "NONE", "7E_product_form": "CRACKER", "7E_flavour": "VEGETABLE"}
-- "ecoBrowns x KL Brice Seaweed 40g" -> {"ArticleDescription_clean": "ecoBrowns x KL Brice Seaweed", "7E_Nrmsize": "40G", "7E_MPack": "X1", "7E_Variant": "KL BRICE", "7E_product_form": "NONE", "7E_flavour": "SEAWEED"}
-- "Kokiri Wow Seaweed Original 12g" -> {"ArticleDescription_clean": "Kokiri Wow Seaweed", "7E_Nrmsize": "12G", "7E_MPack": "X1", "7E_Variant": "NONE", "7E_product_form": "NONE", "7E_flavour": "SEAWEED/ORIGINAL"}
-- "7-Eleven Potato Sticks Salted 50g" -> {"ArticleDescription_clean": "7-Eleven Potato Sticks Salted", "7E_Nrmsize": "50G", "7E_MPack": "X1", "7E_Variant": "NONE", "7E_product_form": "STICK", "7E_flavour": "SALTED"}
-"""
-
-def _call_711_llm(article_description: str) -> dict:
-    """Call OpenAI with only the ArticleDescription; return 4 extra fields."""
-    from backend.llm_client import flow2_client
-    import json
-
-    _fallback = {
-        "ArticleDescription_clean": article_description,
-        "7E_Nrmsize":     None,
-        "7E_MPack":       "X1",
-        "7E_Variant":     "NONE",
-        "7E_product_form":"NONE",
-        "7E_flavour":     "NONE",
-    }
-    user_msg = f'ARTICLE DESCRIPTION: "{article_description}"\n\nReturn JSON only.'
-    try:
-        raw = flow2_client.chat_completion(
-            system_prompt=_711_SYSTEM_PROMPT,
-            user_message=user_msg,
-            temperature=0,
-        ).strip()
-    except Exception as e:
-        print(f"  LLM call failed for '{article_description}': {e}")
-        return _fallback
-
-    start, end = raw.find("{"), raw.rfind("}")
-    if start != -1 and end != -1:
-        raw = raw[start:end + 1]
-    try:
-        data = json.loads(raw)
-        for k, v in _fallback.items():
-            data.setdefault(k, v)
-        return data
-    except Exception:
-        return _fallback
-
-
-def _get_711_cache(article_description: str) -> dict | None:
-    """Return cached LLM result for this ArticleDescription, or None."""
-    coll = get_collection(SEVEN_ELEVEN_CACHE_COL)
-    doc = coll.find_one({"article_description": article_description}, {"_id": 0, "result": 1})
-    return doc["result"] if doc else None
+from backend.seven_eleven import (
+    SEVEN_ELEVEN_COL, SEVEN_ELEVEN_CACHE_COL, SEVEN_ELEVEN_LLM_WORKERS, SEVEN_ELEVEN_LLM_BATCH_SIZE,
+    _revalidate_711_cache, _711_fallback, _enrich_711_batch,
+    new_batch_stats, SEVEN_ELEVEN_CHUNK_ROWS, iter_article_chunks, import_key_field,
+    canonical_key, normalize_import_key, row_hash, load_import_state, new_change_set, diff_import, tombstone_ops, record_change_set, supersede_change_sets,
+)
+from backend.attribute_extraction import reuse_shared_attributes
 
 
-def _save_711_cache(article_description: str, result: dict):
-    """Upsert LLM result into 7-eleven_llm_cache."""
-    coll = get_collection(SEVEN_ELEVEN_CACHE_COL)
-    coll.update_one(
-        {"article_description": article_description},
-        {"$set": {
-            "article_description": article_description,
-            "result": result,
-            "cached_at": datetime.utcnow().isoformat(),
-        }},
-        upsert=True,
-    )
+async def _enrich_711_misses(misses: list, batch_size: int, executor, request, enriched: dict, stats: dict) -> tuple:
+    """
+    Enrich descriptions concurrently (`batch_size` per LLM call), adding results to `enriched`
+    and counting the import's LLM calls in `stats`. Returns (errors, disconnected).
+    """
+    loop = asyncio.get_event_loop()
+    chunks = [misses[i:i + batch_size] for i in range(0, len(misses), batch_size)]
+    pending = [loop.run_in_executor(executor, bind_run(_enrich_711_batch), chunk, stats) for chunk in chunks]
+    errors = done = 0
+    for chunk_num, next_chunk in enumerate(asyncio.as_completed(pending), 1):
+        for desc, llm_result, failed in await next_chunk:
+            enriched[desc] = llm_result
+            errors += failed
+            done += 1
+        if chunk_num % max(50 // batch_size, 1) == 0 or chunk_num == len(pending):
+            print(f"   - Enriched {done}/{len(misses)} descriptions")
+            # 🔗 CHECK DISCONNECTION: Stop if client cancelled
+            if request and await request.is_disconnected():
+                print(f"❌ Aborting 7-Eleven Import: Client disconnected after {done} enrichments")
+                return errors, True
+    return errors, False
 
 
 @app.post("/upload/7eleven")
-async def upload_seven_eleven(file: UploadFile = File(...), request: Request = None):
+async def upload_seven_eleven(file: UploadFile = File(...), request: Request = None,
+                              batch_size: int = SEVEN_ELEVEN_LLM_BATCH_SIZE, mode: str = "replace",
+                              chunk_rows: int = SEVEN_ELEVEN_CHUNK_ROWS):
     """
     Import a 7-Eleven Excel file into the 7-eleven_data collection.
 
-    For each row:
-      1. Check 7-eleven_llm_cache by ArticleDescription.
-      2. If cache HIT  → use cached LLM result (no OpenAI call).
-      3. If cache MISS → send ONLY ArticleDescription to OpenAI,
-                         store result in cache, then save full row + enrichment.
+    mode="replace" clears the collection first. mode="incremental" diffs the file against the
+    stored articles by ArticleCode / GTIN, writes only inserts, updates and tombstones, and records
+    a change set (7-eleven_changes) so /pipeline/run-mapping?incremental=true re-maps only those.
+
+    The sheet is streamed `chunk_rows` rows at a time; each chunk goes through:
+      1. Drop rows repeating an article key (ArticleCode / GTIN) already seen in the file and
+         dedupe ArticleDescriptions (across chunks too).
+      2. Resolve cache hits for the new descriptions at once (memory, then one $in per chunk on 7-eleven_llm_cache).
+      3. Enrich the misses concurrently (SEVEN_ELEVEN_LLM_WORKERS in flight, bulk priority),
+         `batch_size` descriptions per LLM call (items that fail validation are retried singly),
+         queueing each result for a bulk upsert into the cache.
+      4. Build the rows (original Excel cols + 6 LLM fields, NaN -> None vectorized) and bulk-write them.
     """
-    print(f"\n📥 7-Eleven upload: {file.filename}")
-    contents = await file.read()
+    if mode not in ("replace", "incremental"):
+        raise HTTPException(status_code=400, detail="mode must be 'replace' or 'incremental'")
+    print(f"\n📥 7-Eleven upload ({mode}): {file.filename}")
+    loop = asyncio.get_event_loop()
 
     try:
-        xl = pd.ExcelFile(io.BytesIO(contents))
-        df = xl.parse(xl.sheet_names[0])
+        chunks = iter_article_chunks(file.file, max(chunk_rows, 1))
+        first = await loop.run_in_executor(None, next, chunks, None)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Cannot read Excel: {e}")
+    if first is None:
+        raise HTTPException(status_code=422, detail="The first sheet has no header row")
 
     # Normalise column names (strip whitespace)
-    df.columns = [str(c).strip() for c in df.columns]
-
-    if "ArticleDescription" not in df.columns:
+    columns = [str(c).strip() for c in first.columns]
+    if "ArticleDescription" not in columns:
         raise HTTPException(
             status_code=422,
-            detail=f"Column 'ArticleDescription' not found. Columns present: {list(df.columns)}"
+            detail=f"Column 'ArticleDescription' not found. Columns present: {columns}"
         )
 
-    total        = len(df)
-    cache_hits   = 0
-    cache_misses = 0
-    saved        = 0
-    errors       = 0
-
     data_coll  = get_collection(SEVEN_ELEVEN_COL)
-    
-    # ✅ EXCLUSIVE IMPORT: Clear ALL old data from 7-eleven_data
-    # This ensures mapping reports only contain items from the latest upload.
-    # LLM Cache is NOT cleared, so it stays cost-efficient.
-    print(f"🧹 Clearing existing data in {SEVEN_ELEVEN_COL}...")
-    data_coll.delete_many({})
-
-    has_code_col = "ArticleCode" in df.columns or "Article_Code" in df.columns
-    code_col = "ArticleCode" if "ArticleCode" in df.columns else (
-               "Article_Code" if "Article_Code" in df.columns else None)
-
-    docs_to_upsert = []
-    loop = asyncio.get_event_loop()
-    # Use a shared executor or create one for this request
-    executor = ThreadPoolExecutor(max_workers=10)
-
-    for i, row in df.iterrows():
-        # 🔗 CHECK DISCONNECTION: Stop if client cancelled
-        # Yield to event loop to allow heartbeats/checks to run
-        await asyncio.sleep(0)
-        if request:
-            if await request.is_disconnected():
-                print(f"❌ Aborting 7-Eleven Import: Client disconnected at row {i}")
-                executor.shutdown(wait=False)
-                return {"status": "Stopped | Client disconnected", "rows_saved": saved}
-
-        article_desc = str(row.get("ArticleDescription", "")).strip()
-        if not article_desc or article_desc.lower() in ("nan", "none", ""):
-            continue
-
-        # ── 1. Cache check ──────────────────────────────────────────────
-        cached = _get_711_cache(article_desc)
-        if cached:
-            llm_result = cached
-            cache_hits += 1
-        else:
-            # ── 2. Call OpenAI (ArticleDescription only) ─────────────
-            try:
-                # Wrap sync LLM call in executor to avoid blocking the event loop
-                llm_result = await loop.run_in_executor(executor, _call_711_llm, article_desc)
-                _save_711_cache(article_desc, llm_result)
-                cache_misses += 1
-            except Exception as e:
-                print(f"  ⚠️  LLM error for '{article_desc}': {e}")
-                llm_result = {
-                    "ArticleDescription_clean": article_desc,
-                    "7E_Nrmsize":      None,
-                    "7E_MPack":        "X1",
-                    "7E_Variant":      "NONE",
-                    "7E_product_form": "NONE",
-                    "7E_flavour":      "NONE",
-                }
-                errors += 1
-
-        # ── 3. Build document: original Excel cols + 4 LLM extra fields ───
-        raw_row = {}
-        for k, v in row.items():
-            try:
-                raw_row[k] = None if pd.isna(v) else v
-            except (TypeError, ValueError):
-                raw_row[k] = v
-        doc = {
-            **raw_row,
-            # ── 6 LLM-enriched fields ───────────────────────────────────
-            "ArticleDescription_clean": llm_result.get("ArticleDescription_clean", article_desc),
-            "7E_Nrmsize":               llm_result.get("7E_Nrmsize"),
-            "7E_MPack":                 llm_result.get("7E_MPack", "X1"),
-            "7E_Variant":               llm_result.get("7E_Variant", "NONE"),
-            "7E_product_form":          llm_result.get("7E_product_form", "NONE"),
-            "7E_flavour":               llm_result.get("7E_flavour", "NONE"),
-            # ── housekeeping ────────────────────────────────────────────
-            "imported_at":              datetime.utcnow().isoformat(),
-            "source_file":              file.filename,
-        }
-        docs_to_upsert.append(doc)
-        saved += 1
-
-    # ── 4. Bulk upsert / insert ──────────────────────────────────────────
-    executor.shutdown(wait=False)
-    if docs_to_upsert:
-        if code_col:
-            from pymongo import UpdateOne as PymUpdateOne
-            ops = [
-                PymUpdateOne(
-                    {code_col: d.get(code_col)},
-                    {"$set": d},
-                    upsert=True,
-                )
-                for d in docs_to_upsert
-            ]
-            data_coll.bulk_write(ops, ordered=False)
-        else:
-            # Full collection was already cleared at start, so just insert
-            data_coll.insert_many(docs_to_upsert)
+    code_col = "ArticleCode" if "ArticleCode" in columns else (
+               "Article_Code" if "Article_Code" in columns else None)
+    key_field = import_key_field(columns)
+    if mode == "incremental" and not key_field:
+        raise HTTPException(status_code=422,
+                            detail="Incremental import needs an ArticleCode, Article_Code or GTIN column")
+
+    if mode == "replace":
+        # ✅ EXCLUSIVE IMPORT: Clear ALL old data from 7-eleven_data
+        # This ensures mapping reports only contain items from the latest upload.
+        # LLM Cache is NOT cleared, so it stays cost-efficient.
+        print(f"🧹 Clearing existing data in {SEVEN_ELEVEN_COL}...")
+        data_coll.delete_many({})
+        supersede_change_sets("replace_import")
+
+    existing = load_import_state(data_coll, key_field) if mode == "incremental" else None
+    changes = new_change_set() if mode == "incremental" else None
+    change_set_id = None
+    batch_size = max(int(batch_size or 1), 1)
+    batch_stats = new_batch_stats()
+    imported_at = datetime.utcnow().isoformat()
+    seen_keys, seen_descs = set(), set()
+    total = saved = cache_hits = cache_misses = errors = duplicate_rows = chunk_count = shared_hits = 0
+    executor = ThreadPoolExecutor(max_workers=SEVEN_ELEVEN_LLM_WORKERS)
+    run_token = usage_recorder.start_run("7eleven")
+    run_id = usage_recorder.run_id
+    try:
+        chunk = first
+        while chunk is not None:
+            chunk_count += 1
+            chunk.columns = columns
+            total += len(chunk)
+            descriptions = chunk["ArticleDescription"].map(lambda v: str(v).strip())
+            valid = ~descriptions.str.lower().isin(["nan", "none", ""])
+
+            # ── 1. Early dedupe by article key and description ───────────
+            if key_field:
+                keys = chunk[key_field].map(canonical_key)
+                has_key = keys.notna()
+                duplicate = valid & has_key & (keys.duplicated() | keys.isin(seen_keys))
+                duplicate_rows += int(duplicate.sum())
+                valid &= ~duplicate
+                seen_keys.update(keys[valid & has_key])
+            chunk_descs = list(dict.fromkeys(descriptions[valid]))
+            new_descs = [d for d in chunk_descs if d not in seen_descs]
+            seen_descs.update(new_descs)
+
+            # ── 2. Cache check for the chunk's descriptions at once ──────
+            def lookup():
+                found = seven_eleven_cache.get_many(new_descs, count_hits=True)
+                found.update(seven_eleven_cache.get_many([d for d in chunk_descs if d not in found]))
+                return found
+            enriched = await loop.run_in_executor(None, bind_run(lookup))
+            # Products already extracted by the Nielsen flow (shared canonical attributes)
+            shared = await loop.run_in_executor(
+                None, bind_run(reuse_shared_attributes), "7eleven", [d for d in new_descs if d not in enriched])
+            enriched.update(shared)
+            shared_hits += len(shared)
+            misses = [d for d in new_descs if d not in enriched]
+            chunk_hits = int(valid.sum()) - int(descriptions[valid].isin(misses).sum())
+            cache_hits += chunk_hits
+            cache_misses += len(misses)
+            usage_recorder.record_cache_hit("7eleven", chunk_hits)
+            print(f"7-Eleven chunk {chunk_count}: {len(chunk)} rows, {len(chunk_descs)} unique descriptions, "
+                  f"{len(misses)} to enrich")
+
+            # ── 3. Enrich misses concurrently (bounded by the executor + LLM scheduler) ──
+            chunk_errors, disconnected = await _enrich_711_misses(misses, batch_size, executor, request, enriched, batch_stats)
+            errors += chunk_errors
+            if disconnected:
+                executor.shutdown(wait=False, cancel_futures=True)
+                if mode == "incremental":
+                    # Chunks already written still reach incremental mapping; no tombstones for a partial file
+                    change_set_id = record_change_set(key_field, changes, file.filename)
+                return {"status": "Stopped | Client disconnected", "rows_saved": saved, "change_set_id": change_set_id}
+
+            # ── 4. Build documents: original Excel cols + 6 LLM extra fields ──
+            rows_df = chunk[valid]
+            rows = rows_df.astype(object).where(pd.notna(rows_df), None).to_dict("records")
+            docs_to_upsert = []
+            for raw_row, article_desc in zip(rows, descriptions[valid]):
+                llm_result = enriched.get(article_desc) or _711_fallback(article_desc)
+                docs_to_upsert.append({
+                    **raw_row,
+                    # ── 6 LLM-enriched fields ───────────────────────────────
+                    "ArticleDescription_clean": llm_result.get("ArticleDescription_clean", article_desc),
+                    "7E_Nrmsize":               llm_result.get("7E_Nrmsize"),
+                    "7E_MPack":                 llm_result.get("7E_MPack", "X1"),
+                    "7E_Variant":               llm_result.get("7E_Variant", "NONE"),
+                    "7E_product_form":          llm_result.get("7E_product_form", "NONE"),
+                    "7E_flavour":               llm_result.get("7E_flavour", "NONE"),
+                    # ── housekeeping ────────────────────────────────────────
+                    "imported_at":              imported_at,
+                    "source_file":              file.filename,
+                })
+
+            # ── 5. Bulk upsert / insert ──────────────────────────────────
+            ops = []
+            if mode == "incremental":
+                ops = diff_import(existing, key_field, docs_to_upsert, changes)
+                saved += len(ops)
+            elif docs_to_upsert:
+                for d in docs_to_upsert:
+                    if key_field:
+                        normalize_import_key(d, key_field)
+                    d["row_hash"] = row_hash(d)
+                if code_col:
+                    ops = [UpdateOne({code_col: d.get(code_col)}, {"$set": d}, upsert=True) for d in docs_to_upsert]
+                else:
+                    # Full collection was already cleared at start, so just insert
+                    data_coll.insert_many(docs_to_upsert, ordered=False)
+                saved += len(docs_to_upsert)
+            for i in range(0, len(ops), 1000):
+                data_coll.bulk_write(ops[i:i + 1000], ordered=False)
+
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+
+        if mode == "incremental":
+            ops = tombstone_ops(existing, key_field, seen_keys, changes, imported_at)
+            for i in range(0, len(ops), 1000):
+                data_coll.bulk_write(ops[i:i + 1000], ordered=False)
+            change_set_id = record_change_set(key_field, changes, file.filename)
+            print(f"🔁 Incremental diff on {key_field}: +{len(changes['inserted'])} ~{len(changes['updated'])} "
+                  f"-{len(changes['deleted'])} ={changes['unchanged']}")
+    finally:
+        executor.shutdown(wait=False)
+        seven_eleven_cache.flush()
+        usage_recorder.end_run(run_token)
 
     print(f"✅ 7-Eleven import done: {saved}/{total} rows | "
-          f"cache hits={cache_hits} | new LLM calls={cache_misses} | errors={errors}")
+          f"cache hits={cache_hits} | misses={cache_misses} | LLM calls={batch_stats['llm_calls']} | errors={errors}")
 
     return {
         "status": "success",
         "filename": file.filename,
         "total_rows": total,
         "saved": saved,
+        "duplicate_rows": duplicate_rows,
+        "chunks": chunk_count,
+        "unique_descriptions": len(seen_descs),
         "cache_hits": cache_hits,
-        "llm_calls_made": cache_misses,
+        "shared_attribute_hits": shared_hits,
+        "cache_misses": cache_misses,
+        "llm_calls_made": batch_stats["llm_calls"],
         "errors": errors,
+        "batch_size": batch_size,
+        "batching": {k: v for k, v in batch_stats.items() if k != "llm_calls"},
+        "mode": mode,
+        "changes": {
+            "change_set_id": change_set_id,
+            "key_field": key_field,
+            "inserted": len(changes["inserted"]),
+            "updated": len(changes["updated"]),
+            "deleted": len(changes["deleted"]),
+            "unchanged": changes["unchanged"],
+            "without_key": changes["without_key"],
+        } if changes else None,
         "collection": SEVEN_ELEVEN_COL,
         "cache_collection": SEVEN_ELEVEN_CACHE_COL,
+        "llm_usage_run_id": run_id,
     }
 
 
+@app.post("/cache/snapshot")
+async def export_cache_snapshot():
+    """Write LLM_CACHE_STORAGE and 7-eleven_llm_cache to the local SQLite snapshot."""
+    from backend.cache_snapshot import export_snapshot, SNAPSHOT_PATH
+    loop = asyncio.get_event_loop()
+    counts = await loop.run_in_executor(None, export_snapshot)
+    return {"status": "success", "path": str(SNAPSHOT_PATH), "entries": counts}
+
+
+@app.get("/cache/stats")
+async def get_cache_stats(cache: str = "all", runs: int = 10, top: int = 20):
+    """
+    LLM cache analytics for Flow 2 (LLM_CACHE_STORAGE) and 7-Eleven: entries per brand, hit ratio
+    per run, age distribution, entries from older prompt/model/guard versions, most re-requested items.
+    """
+    from backend.cache_analytics import cache_report
+    caches = ("flow2", "7eleven") if cache == "all" else (cache,)
+    if any(c not in ("flow2", "7eleven") for c in caches):
+        raise HTTPException(status_code=400, detail="cache must be flow2, 7eleven or all")
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, lambda: cache_report(caches, runs=runs, top=top))
+
+
 @app.get("/cache/7eleven/stats")
 async def get_711_cache_stats():
     """Return stats about the 7-Eleven LLM cache collection."""
@@ -1130,7 +1256,68 @@ async def get_711_cache_stats():
     total = coll.count_documents({})
     sample = list(coll.find({}, {"_id": 0, "article_description": 1, "result.name": 1,
                                   "result.brand": 1, "cached_at": 1}).limit(5))
-    return {"total_cached": total, "sample": sample}
+    return {"total_cached": total, "sample": sample, "memory": seven_eleven_cache.stats()}
+
+
+@app.post("/cache/revalidate")
+async def revalidate_cache(cache: str = "flow2", limit: int = 100):
+    """
+    Refresh cache entries whose prompt / model / guard fingerprint no longer matches
+    (cache = flow2 or 7eleven). Stale entries served under LLM_CACHE_VERSION_POLICY=stale_ok go first.
+    """
+    from backend.processor import revalidate_flow2_cache
+    loop = asyncio.get_event_loop()
+    if cache == "7eleven":
+        result = await loop.run_in_executor(None, _revalidate_711_cache, limit)
+    else:
+        result = await loop.run_in_executor(None, revalidate_flow2_cache, limit)
+    return {"status": "success", "cache": cache, **result}
+
+
+class CacheInvalidationRequest(BaseModel):
+    cache: str = "flow2"                 # flow2 | 7eleven | all
+    brand: Optional[str] = None
+    regex: Optional[str] = None
+    clean_keys: Optional[list[str]] = None
+    since: Optional[str] = None          # ISO date/time, inclusive
+    until: Optional[str] = None          # ISO date/time, exclusive
+    prompt_hash: Optional[str] = None
+    outdated: bool = False
+    dry_run: bool = False
+    reenrich: bool = False
+
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(req: CacheInvalidationRequest):
+    """
+    Delete LLM cache entries matching brand / regex / clean key / date range / prompt version,
+    optionally re-enriching them in a background job (poll /cache/invalidate/jobs/{job_id}).
+    """
+    from backend.cache_admin import invalidate
+    loop = asyncio.get_event_loop()
+    try:
+        report = await loop.run_in_executor(None, lambda: invalidate(**req.model_dump()))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", **report}
+
+
+@app.get("/cache/invalidate/jobs/{job_id}")
+async def get_reenrich_job(job_id: str):
+    from backend.cache_admin import reenrich_jobs
+    job = reenrich_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Re-enrichment job not found")
+    return job
+
+
+@app.post("/cache/7eleven/sync-data")
+async def sync_711_data(dry_run: bool = False):
+    """Copy the current 7-eleven_llm_cache results into 7-eleven_data (one server-side $lookup/$merge)."""
+    from backend.seven_eleven import sync_data_with_cache
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(None, lambda: sync_data_with_cache(dry_run=dry_run))
+    return {"status": "success", **result}
 
 
 @app.delete("/cache/7eleven/clear")
@@ -1138,6 +1325,7 @@ async def clear_711_cache():
     """Clear the 7-Eleven LLM cache (forces re-enrichment on next import)."""
     coll = get_collection(SEVEN_ELEVEN_CACHE_COL)
     result = coll.delete_many({})
+    seven_eleven_cache.discard()
     return {"status": "success", "deleted": result.deleted_count}
 
 
@@ -4,8 +4,15 @@ import re
 import json
 import io
 from datetime import datetime
-from llm_client import flow2_client
-from backend.database import get_collection
+try:
+    from backend.processor import flow2_cache
+    from backend.llm_client import flow2_client
+    from backend.llm_schemas import MASTERING_QA_GROUPS_SCHEMA, DIAGNOSTIC_SCHEMA
+except ImportError:
+    # Fallback: if running from backend folder (share the same client singletons either way)
+    from processor import flow2_cache
+    from llm_client import flow2_client
+    from llm_schemas import MASTERING_QA_GROUPS_SCHEMA, DIAGNOSTIC_SCHEMA
 
 # Configuration
 MASTERING_REPORT_DIR = r'D:\Final_Input_and_Output\output_directry\MASTERING_QA_REPORTS'
@@ -155,11 +162,9 @@ def process_mastering_logic(df, brand_name="Master_Stock"):
                        "\n".join([f"{i}. {item['item']}" for i, item in enumerate(items)])
             
             try:
-                response = flow2_client.chat_completion(system_prompt, user_msg)
-                if "```json" in response:
-                    response = response.split("```json")[1].split("```")[0].strip()
-                
-                ai_res = json.loads(response)
+                ai_res = flow2_client.chat_json(system_prompt, user_msg, schema=MASTERING_QA_GROUPS_SCHEMA, flow="qa_audit")
+                if ai_res is None:
+                    raise ValueError("No schema-valid response from LLM")
                 
                 groups = ai_res.get('potential_groups', [])
                 for gp in groups:
@@ -228,12 +233,8 @@ def get_mastering_diagnostic(item_names):
     if not item_names: return "No items provided."
     
     try:
-        cache_coll = get_collection("LLM_CACHE_STORAGE")
-        # Fetch attributes from cache
-        cache_docs = list(cache_coll.find({"item": {"$in": item_names}}))
-        
-        # Map item -> result
-        results_map = {doc['item']: doc['result'] for doc in cache_docs}
+        # Fetch attributes through the shared Flow 2 cache (same guarded results the pipeline used)
+        results_map = flow2_cache.get_many(item_names)
         
         # Build comparison summary for AI
         comparison_text = "Comparison of AI Extracted Attributes:\n"
@@ -271,23 +272,15 @@ def get_mastering_diagnostic(item_names):
         
         user_msg = f"Items to Diagnose:\n{comparison_text}"
         
-        response = flow2_client.chat_completion(system_prompt, user_msg)
-        
-        # Clean JSON response
-        if "```json" in response:
-            response = response.split("```json")[1].split("```")[0].strip()
-        elif "```" in response:
-            response = response.split("```")[1].split("```")[0].strip()
-            
-        try:
-            return json.loads(response)
-        except:
-            # Fallback if AI fails to return JSON
+        report = flow2_client.chat_json(system_prompt, user_msg, schema=DIAGNOSTIC_SCHEMA, flow="qa_audit")
+        if report is None:
+            # Fallback if AI fails to return valid JSON after schema retries
             return {
-                "diagnosis": response,
+                "diagnosis": "The AI did not return a valid diagnostic for these items.",
                 "rule_reference": "processor.py:L1122",
                 "actionable_solution": "Please check the attribute mapping rules."
             }
+        return report
     except Exception as e:
         return f"Diagnostic Error: {str(e)}"
 def translate_diagnostic_text(text):
@@ -309,7 +302,7 @@ def translate_diagnostic_text(text):
         Output format: Simple text paragraphs in Tamil.
         """
         
-        translation = flow2_client.chat_completion(system_prompt, text)
+        translation = flow2_client.chat_completion(system_prompt, text, flow="translate")
         return translation
     except Exception as e:
         return f"Translation Error: {str(e)}"
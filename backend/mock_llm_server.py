@@ -0,0 +1,283 @@
+"""
+Local stand-in for the Azure LLM endpoints, for offline runs and reproducible benchmarks.
+
+Serves both APIs used by llm_client.py:
+  - POST /v1/messages                                        (Azure Claude, Anthropic-style)
+  - POST /openai/deployments/{deployment}/chat/completions   (Azure OpenAI)
+
+Responses are replayed from recorded data:
+  - LLM cache dumps (LLM_CACHE_STORAGE.json, llm_cache_dump.json): matched on ITEM DESCRIPTION
+  - 7-Eleven cache dumps ({"article_description", "result"}): matched on ARTICLE DESCRIPTION
+  - Cassettes (JSONL written by llm_client when LLM_RECORD_CASSETTE is set): matched on the exact prompt
+
+Usage:
+    python -m backend.mock_llm_server --port 8100 --latency-ms 400 --rate-429 0.05
+
+Then point the backend at it:
+    AZURE_OPENAI_ENDPOINT=http://localhost:8100
+    AZURE_CLAUDE_ENDPOINT=http://localhost:8100
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+ROOT_DIR = Path(__file__).parent.parent
+DEFAULT_SOURCES = [ROOT_DIR / "LLM_CACHE_STORAGE.json", ROOT_DIR / "llm_cache_dump.json"]
+
+ITEM_PATTERN = re.compile(r'ITEM DESCRIPTION:\s*"(.*?)"', re.DOTALL)
+ARTICLE_PATTERN = re.compile(r'ARTICLE DESCRIPTION:\s*"(.*?)"', re.DOTALL)
+
+
+def prompt_key(system_prompt, user_message):
+    """Cassette key: hash of the exact system + user prompt (shared with llm_client recording)."""
+    return hashlib.sha1(f"{system_prompt}\n\n{user_message}".encode("utf-8")).hexdigest()
+
+
+class ReplayStore:
+    """Recorded responses indexed by item, article description and exact prompt."""
+    def __init__(self):
+        self.items = {}      # Flow 2 item -> result dict
+        self.articles = {}   # 7-Eleven ArticleDescription -> result dict
+        self.prompts = {}    # prompt_key -> raw response text
+
+    def load(self, path):
+        path = Path(path)
+        if not path.exists():
+            print(f"⚠️ Mock LLM: source not found: {path}")
+            return 0
+        loaded = 0
+        with open(path, "r", encoding="utf-8") as f:
+            if path.suffix == ".jsonl":
+                records = (json.loads(line) for line in f if line.strip())
+            else:
+                records = json.load(f)
+            for rec in records:
+                if "key" in rec and "response" in rec:
+                    self.prompts[rec["key"]] = rec["response"]
+                elif "article_description" in rec and "result" in rec:
+                    self.articles[rec["article_description"]] = rec["result"]
+                elif "item" in rec and "result" in rec:
+                    self.items[rec["item"]] = rec["result"]
+                else:
+                    continue
+                loaded += 1
+        print(f"✅ Mock LLM: loaded {loaded} recorded responses from {path.name}")
+        return loaded
+
+    def lookup(self, system_prompt, user_message):
+        """Return (response_text, source) or (None, None) on a miss."""
+        key = prompt_key(system_prompt, user_message)
+        if key in self.prompts:
+            return self.prompts[key], "cassette"
+
+        match = ITEM_PATTERN.search(user_message)
+        if match and match.group(1) in self.items:
+            return json.dumps(self.items[match.group(1)]), "item"
+
+        match = ARTICLE_PATTERN.search(user_message)
+        if match and match.group(1) in self.articles:
+            return json.dumps(self.articles[match.group(1)]), "article"
+
+        return None, None
+
+
+def synthesize_from_schema(schema):
+    """Deterministic placeholder that satisfies a response schema (used on replay misses)."""
+    types = schema.get("type", "object")
+    t = types[0] if isinstance(types, list) else types
+    if t == "object":
+        return {k: synthesize_from_schema(v) for k, v in schema.get("properties", {}).items()}
+    if t == "array":
+        return []
+    if t in ("number", "integer"):
+        return schema.get("minimum", 0)
+    if t == "boolean":
+        return False
+    if t == "null":
+        return None
+    return "UNKNOWN"
+
+
+class MockSettings:
+    def __init__(self, latency_ms=0, jitter_ms=0, rate_429=0.0, retry_after=1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+
+
+store = ReplayStore()
+settings = MockSettings(
+    latency_ms=float(os.getenv("MOCK_LLM_LATENCY_MS", "0")),
+    jitter_ms=float(os.getenv("MOCK_LLM_JITTER_MS", "0")),
+    rate_429=float(os.getenv("MOCK_LLM_RATE_429", "0")),
+    retry_after=int(os.getenv("MOCK_LLM_RETRY_AFTER", "1")),
+)
+_stats_lock = threading.Lock()
+stats = {"requests": 0, "rate_limited": 0, "misses": 0, "hits": {}}
+
+app = FastAPI(title="Mock LLM Server")
+
+
+def _count(key, source=None):
+    with _stats_lock:
+        if source:
+            stats["hits"][source] = stats["hits"].get(source, 0) + 1
+        else:
+            stats[key] += 1
+
+
+async def _simulate_network():
+    """Apply configured latency; returns True if this request should be rate limited."""
+    _count("requests")
+    delay = settings.latency_ms + random.uniform(-settings.jitter_ms, settings.jitter_ms)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    if settings.rate_429 and random.random() < settings.rate_429:
+        _count("rate_limited")
+        return True
+    return False
+
+
+def _rate_limit_response():
+    message = (f"Requests to the ChatCompletions_Create Operation have exceeded the rate limit. "
+               f"Please retry after {settings.retry_after} seconds.")
+    return JSONResponse(
+        status_code=429,
+        headers={"retry-after": str(settings.retry_after)},
+        content={"error": {"code": "429", "message": message}},
+    )
+
+
+def _reply_text(system_prompt, user_message, schema=None):
+    text, source = store.lookup(system_prompt, user_message)
+    if text is not None:
+        _count(None, source)
+        return text
+    _count("misses")
+    return json.dumps(synthesize_from_schema(schema) if schema else {})
+
+
+def _approx_tokens(text):
+    return max(1, len(text) // 4)
+
+
+@app.post("/v1/messages")
+async def anthropic_messages(request: Request):
+    """Anthropic-style Messages API (Azure Claude)."""
+    body = await request.json()
+    if await _simulate_network():
+        return _rate_limit_response()
+
+    system_prompt = body.get("system", "")
+    user_message = "".join(
+        m["content"] if isinstance(m["content"], str) else "".join(p.get("text", "") for p in m["content"])
+        for m in body.get("messages", []) if m.get("role") == "user"
+    )
+    text = _reply_text(system_prompt, user_message)
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model", "mock-claude"),
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "usage": {
+            "input_tokens": _approx_tokens(system_prompt + user_message),
+            "output_tokens": _approx_tokens(text),
+        },
+    }
+
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def azure_chat_completions(deployment: str, request: Request):
+    """Azure OpenAI Chat Completions API."""
+    body = await request.json()
+    if await _simulate_network():
+        return _rate_limit_response()
+
+    messages = body.get("messages", [])
+    system_prompt = "".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    user_message = "".join(m.get("content", "") for m in messages if m.get("role") == "user")
+
+    schema = None
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        schema = response_format.get("json_schema", {}).get("schema")
+
+    text = _reply_text(system_prompt, user_message, schema)
+    prompt_tokens = _approx_tokens(system_prompt + user_message)
+    completion_tokens = _approx_tokens(text)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": deployment,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": text},
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+@app.get("/mock/stats")
+async def mock_stats():
+    """Replay hit/miss and simulated 429 counters."""
+    with _stats_lock:
+        return {
+            **stats,
+            "hits": dict(stats["hits"]),
+            "loaded": {"items": len(store.items), "articles": len(store.articles), "prompts": len(store.prompts)},
+            "settings": vars(settings),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock for the Azure Claude / Azure OpenAI endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--source", action="append", default=[],
+                        help="Cache dump (.json) or cassette (.jsonl) to replay. Repeatable.")
+    parser.add_argument("--latency-ms", type=float, default=settings.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=settings.jitter_ms)
+    parser.add_argument("--rate-429", type=float, default=settings.rate_429,
+                        help="Fraction of requests answered with 429 (0.0 - 1.0)")
+    parser.add_argument("--retry-after", type=int, default=settings.retry_after)
+    args = parser.parse_args()
+
+    settings.latency_ms = args.latency_ms
+    settings.jitter_ms = args.jitter_ms
+    settings.rate_429 = args.rate_429
+    settings.retry_after = args.retry_after
+
+    sources = args.source or [p for p in os.getenv("MOCK_LLM_SOURCES", "").split(",") if p] or DEFAULT_SOURCES
+    cassette = os.getenv("LLM_RECORD_CASSETTE")
+    if cassette and not args.source:
+        sources = list(sources) + [cassette]
+    for src in sources:
+        store.load(src)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
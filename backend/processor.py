@@ -8,24 +8,66 @@ import math
 import copy
 import time
 import asyncio
+import hashlib
+import threading
+import tracemalloc
+from datetime import datetime
 from openai import OpenAI
 import httpx
-from backend.database import get_collection, reset_main_collections, RAW_DATA_COL, SINGLE_STOCK_COL, MASTER_STOCK_COL
-from backend.llm_client import llm_client, flow2_client  # Import both clients
+from backend.database import get_collection, reset_main_collections, RAW_DATA_COL, SINGLE_STOCK_COL, MASTER_STOCK_COL, FLOW2_STATE_COL
+from backend.llm_client import llm_client, flow2_client, TIER_FAST, TIER_STRONG  # Import both clients
+from backend.llm_schemas import FLOW2_ATTRIBUTES_SCHEMA
+from backend.flow2_prompt import compile_system_prompt, prompt_fingerprint, prompt_stats
+from backend.llm_usage import bind_run, usage_recorder
+from backend.llm_cache import TwoTierLLMCache, register_cache
+from backend.attribute_extraction import publish_attributes
 from concurrent.futures import ThreadPoolExecutor
-from pymongo import UpdateOne
+from pymongo import UpdateOne, ReplaceOne
+from pymongo.errors import OperationFailure
 from difflib import SequenceMatcher
 
 # Note: We use llm_client for all LLM operations (Azure Claude + Azure OpenAI fallback)
 # No direct OpenAI client needed here
 
 # Configuration
-LLM_CONFIDENCE_THRESHOLD = 0.92  # Raised from 0.80 for production-grade safety
+LLM_CONFIDENCE_THRESHOLD = float(os.getenv("LLM_CONFIDENCE_THRESHOLD", "0.92"))  # Raised from 0.80 for production-grade safety
 OPENAI_MODEL = "gpt-4o-mini"
 
 
-# LLM cache to avoid duplicate API calls
-llm_cache = {}
+# LLM cache to avoid duplicate API calls: bounded in-memory LRU backed by LLM_CACHE_STORAGE.
+# Results loaded from MongoDB get the latest rule guards re-applied so rule updates take effect.
+LLM_CACHE_COL = "LLM_CACHE_STORAGE"
+# Entries are stamped with flow2_cache_version(); see LLM_CACHE_VERSION_POLICY for how mismatches are served.
+# They also carry clean_key / token_key so reworded descriptions can reuse a stored result.
+flow2_cache = register_cache(TwoTierLLMCache(
+    LLM_CACHE_COL, "item", name="flow2",
+    on_load=lambda item, result: apply_llm_rule_guards(item, result),
+    version_fn=lambda item, stored=None: flow2_cache_version(item, stored),
+    index_fn=lambda item: flow2_index_keys(item)
+))
+
+# Semantic cache reuse for items with no exact entry:
+#   off       - exact context string only
+#   clean_key - reuse a result whose simple_clean_item key is identical (default)
+#   token_set - also reuse on the spelling-normalized token set (plurals, size spacing/units)
+SEMANTIC_CACHE_POLICY = os.getenv("FLOW2_SEMANTIC_CACHE", "clean_key").lower()
+SEMANTIC_CACHE_FIELDS = {"off": [], "clean_key": ["clean_key"], "token_set": ["clean_key", "token_key"]}
+SEMANTIC_MIN_CONFIDENCE = float(os.getenv("FLOW2_SEMANTIC_MIN_CONFIDENCE", str(LLM_CONFIDENCE_THRESHOLD)))
+semantic_stats = {"clean_key": 0, "token_key": 0}
+
+# Flow 2 loading: two_pass streams only the clustering fields first and fetches full single-stock
+# docs by _id in batches while building master records; single_pass loads every full doc up front
+FLOW2_TWO_PASS_LOAD = os.getenv("FLOW2_TWO_PASS_LOAD", "on").lower() != "off"
+FLOW2_FETCH_BATCH = int(os.getenv("FLOW2_FETCH_BATCH", "2000"))
+# Report Python heap peaks (tracemalloc) of the load phase and the whole run in the Flow 2 response
+FLOW2_MEMORY_REPORT = os.getenv("FLOW2_MEMORY_REPORT", "off").lower() == "on"
+# Column names the clustering pass needs (projected as written, upper, lower and title case);
+# MAT / month columns are only read from the full docs of pass 2
+FLOW2_CLUSTER_FIELDS = ["ITEM", "BRAND", "UPC", "MARKETS", "MARKET", "MPACK", "PACK", "FACTS", "FACT"]
+
+# Cheap-first cascade counters for the current Flow 2 run
+cascade_stats = {"fast_accepted": 0, "escalated": 0, "strong_failed": 0}
+_cascade_lock = threading.Lock()
 
 def normalize_mpack(mpack_str: str) -> str:
     """Normalize X1, 1, 1X, 1S into X1. Ignores high piece counts like 32P."""
@@ -110,18 +152,81 @@ def calculate_similarity(a, b):
     return SequenceMatcher(None, norm_a, norm_b).ratio()
 
 def get_cached_llm_result(item):
-    """Fetch result from MongoDB cache."""
-    cache_coll = get_collection("LLM_CACHE_STORAGE")
-    return cache_coll.find_one({"item": item}, {"_id": 0})
-
-def save_to_llm_cache(item, result):
-    """Save result to MongoDB cache."""
-    cache_coll = get_collection("LLM_CACHE_STORAGE")
-    cache_coll.update_one(
-        {"item": item},
-        {"$set": {"item": item, "result": result}},
-        upsert=True
-    )
+    """Fetch a Flow 2 result (rule guards applied) from the two-tier cache."""
+    return flow2_cache.get(item)
+
+def get_cached_llm_results(items):
+    """Fetch many Flow 2 results at once (memory first, then chunked $in). Returns {item: result}."""
+    return flow2_cache.get_many(items)
+
+def save_to_llm_cache(item, result, tier=None):
+    """Cache result in memory and queue it for LLM_CACHE_STORAGE, recording which model tier produced it and when."""
+    version = flow2_cache_version(item, tier=tier)
+    flow2_cache.put(item, result, tier=tier or "default", cached_at=datetime.utcnow().isoformat(), version=version)
+    # Canonical copy for the 7-Eleven flow (attribute_extraction)
+    publish_attributes("nielsen", item, result, version)
+
+_NOISE_WORDS = {"ITEM", "PACK", "FLAVOUR", "FLV", "BRAND", "PCS"}
+
+
+def semantic_token_key(item):
+    """
+    Spelling-normalized token set: synonyms, size written as one token (100 GRAM -> 100GRAM),
+    plurals folded (COOKIES -> COOKIE), noise words dropped, order and repeats ignored.
+    """
+    if not item:
+        return ""
+    s = normalize_synonyms(str(item).replace("-", ""))
+    s = re.sub(r"(\d+(?:\.\d+)?)\s+(GRAM|KG|ML|L|LTR)\b", r"\1\2", s)
+    tokens = set()
+    for tok in re.findall(r"[A-Z0-9.]+", s):
+        tok = tok.strip(".")
+        if not tok or tok in _NOISE_WORDS:
+            continue
+        if len(tok) > 3 and tok.isalpha() and tok.endswith("S") and not tok.endswith("SS"):
+            tok = tok[:-1]
+        tokens.add(tok)
+    return " ".join(sorted(tokens))
+
+
+def flow2_index_keys(item):
+    """Secondary lookup fields stamped on every LLM_CACHE_STORAGE entry."""
+    return {"clean_key": simple_clean_item(item), "token_key": semantic_token_key(item)}
+
+
+def _semantic_candidate_ok(doc):
+    result = doc.get("result") or {}
+    return bool(result.get("brand")) and float(result.get("confidence") or 0) >= SEMANTIC_MIN_CONFIDENCE
+
+
+def reuse_similar_results(items):
+    """
+    Serve cache misses from a stored result of a near-identical description (FLOW2_SEMANTIC_CACHE).
+    The reused result goes through the rule guards for the new wording and is written back under
+    the new key with provenance (reused_from, reuse_match) and the source entry's version.
+    Returns {item: result}.
+    """
+    fields = SEMANTIC_CACHE_FIELDS.get(SEMANTIC_CACHE_POLICY, [])
+    if not fields or not items:
+        return {}
+    reused = {}
+    for item, (field, doc) in flow2_cache.find_similar(items, fields, accept=_semantic_candidate_ok).items():
+        data = finalize_llm_result(item, copy.deepcopy(doc["result"]))
+        flow2_cache.put(
+            item, data,
+            tier="semantic",
+            cached_at=datetime.utcnow().isoformat(),
+            version=doc.get("version"),
+            reused_from=doc.get("reused_from") or doc["item"],
+            reuse_match=field,
+        )
+        reused[item] = data
+        with _cascade_lock:
+            semantic_stats[field] += 1
+    if reused:
+        usage_recorder.record_cache_hit("flow2_semantic", len(reused))
+    return reused
+
 
 def extract_size_val(size_str):
     """Extract numeric size value from string (e.g. '130g' -> 130.0)."""
@@ -353,6 +458,9 @@ async def process_nielsen_dataframe(df, sheet_name, request=None):
     print(f"[{sheet_name}] Parallel processing complete: {len(single_stock_records)} total records")
 
     if single_stock_records:
+        # Stamped once here so incremental Flow 2 runs project the hash instead of reading full docs
+        for record in single_stock_records:
+            record["content_hash"] = single_stock_fingerprint(record)
         single_stock_coll = get_collection(SINGLE_STOCK_COL)
         single_stock_coll.delete_many({"sheet_name": "wersel_match"})
         total_records = len(single_stock_records)
@@ -443,344 +551,9 @@ async def reprocess_flow_1_from_db():
     print("Reprocessing Flow 1 Complete.")
 
 
-def normalize_item_llm(item):
-    """
-    Use LLM to extract brand, flavour, size and remove marketing keywords.
-    With persistent caching.
-    """
-    # 1. Check in-memory cache
-    if item in llm_cache:
-        return llm_cache[item]
-    
-    # 2. Check persistent MongoDB cache
-    cached = get_cached_llm_result(item)
-    if cached:
-        data = cached["result"]
-        # Force re-apply guards even to cached data to ensure consistency after rule updates
-        data = apply_llm_rule_guards(item, data)
-        llm_cache[item] = data
-        return data
-    
-    system_prompt = """
-You are an FMCG product mastering expert specializing in the Malaysian market.
-
-Your task is to extract standardized attributes from raw product descriptions often found in 7-Eleven or POS terminals.
-
-### Standardized Mapping Table:
-Use these standardized terms for any raw keywords found:
-
-- PROTEINS:
-  - {AYM, CHK, CKN, AYAM} -> CHICKEN
-  - {DGG, BF, DAGING} -> BEEF
-  - {TLR, EG, TELUR} -> EGG
-  - {STNG, SQD, SOTONG} -> SQUID
-  - {UDG, UDANG, PRN} -> PRAWN
-  - {BILIS, ANC} -> ANCHOVY
-
-- FLAVORS & VARIANTS:
-  - {COK, CHOC, CHOCO, COKLAT, CHOKLAT, CHOKIT, COKLIT, CHCO} -> CHOCOLATE 
-  (Only when used alone. Do NOT collapse compound flavours like:
-   CHOC CHIP, DARK CHOC, WHITE CHOC, SALTED CHOC, MILK CHOC.)
-  - {BAN, BNNA, BANANA} -> BANANA
-  - {VAN, VNL, VENLLA, VANILLA} -> VANILLA
-  - {PNUT, PNT, PEANUT} -> PEANUT
-  - {NPLTNE, NEAPOLITAN} -> NEAPOLITAN
-  - {PDS, HOT, SPY, PEDAS} -> SPICY
-  - {KRI, CRY, KARI} -> CURRY
-  - {SSU, MLK, SUSU} -> MILK
-  - {KOP, CF, KOPI} -> COFFEE
-  - {HLA, GGR, HALIA} -> GINGER
-  - {GUL, SGR, GULA} -> SUGAR
-  - {STRW, STRAW, STRAWBERRY} -> STRAWBERRY
-  - {ORG, ORNG, ORANGE} -> ORANGE
-  - {APP, APPL, APPLE} -> APPLE
-  - {MNG, MANGO} -> MANGO
-  - {PINE, PNAP, PINEAPPLE} -> PINEAPPLE
-   - {ORI, ORIG, ORIGINAL} -> ORIGINAL
-   - {ASSORTED, ASST, ASSORTMENT, ASSORTIS} -> ASSORTED
-   - {CRK, CRACKERS, CRAKERS, CRACKER} -> CRACKER
-   - {BLK, BLACK} -> BLACK
-  - {WHT, WHITE} -> WHITE
-  - {GRN, GREEN} -> GREEN
-  - {RD, RED} -> RED
-  - {RYAL, ROYAL} -> ROYAL
-  - {DBL, DOUBLE, DB} -> DOUBLE
-  - {TRP, TRIPLE} -> TRIPLE
-  - {CRM, CREME, CREAM} -> CREAM
-
-- PRODUCT FORMS (IMPORTANT: Keep these distinct):
-  - {BISK, BSC, BISCUIT, CKI, COOKIE} -> BISCUIT / COOKIE
-  - {WAF, WFR, WAFER} -> WAFER
-  - {STK, STICK, PRETZ, TOPPO, PEPERO, POCKY} -> STICK
-  - {ROL, ROLL} -> ROLL
-  - {PCH, POUCH} -> POUCH
-  - {SNK, SNACK, CAPLICO, CHOCOROOM} -> SNACK / CHOCOROOM
-  - {DONUT, DNNT} -> DONUT
-  - {HIPPO, TRONKY} -> Keep specific form (HIPPO / TRONKY)
-  - {FINGER, ROUND, TRIANGLE} -> Keep shape as Form
-  - {MARIE, MRE} -> MARIE
-  - {CRACKER, CRK, CRACKERS, CRACK} -> CRACKER
-  - {YANYAN, YAN YAN} -> YAN YAN
-  - {HELLOPANDA, HELLO PANDA} -> HELLO PANDA
-  - {LUCKY STICK} -> LUCKY STICK
-  - {ASSORTED, ASST, TIN, BOX, PARTY, SELECTION} -> ASSORTED
-  - {DIP DIP, DIPDIP, DIPPING, CUP} -> DIP DIP / CUP (Treat as distinct product form)
-  - {BUBBLE PUFF, BUBBLEPUFF} -> BUBBLE PUFF (Treat as distinct product form)
-
-- UOM (Volume/Weight):
-  - {320M, 320ML} -> 320ML
-  - {1.5L, 1.5LTR, 1500M} -> 1500ML
-  - {1KG, 1000G} -> 1000G
-  - {59GR, 59G} -> 59G
-  - {PC, PCS, UNIT} -> UNIT
-
-- BRANDS:
-  - {F&N} -> FRASER AND NEAVE
-  - {MGG} -> MAGGI
-  - {NES} -> NESCAFE
-  - {D.LADY, DL} -> DUTCH LADY
-  - {YEO, YS} -> YEOS
-  - {ORI} -> Treat as Brand "ORI" only if it appears at the START of the description. Otherwise, ignore it or check for "ORIGINAL".
-  - {HUP SENG, HUPSENG, HS} -> HUP SENG
-  - {JULIES, JULIE, JULI, JULYS} -> JULIES
-  - {BIOGREEN, BIO GREEN} -> BIO GREEN
-  - {LEE, LEE BRANDS} -> LEE BRANDS
-  - {MUNCHYS, MUNCHY} -> MUNCHYS
-  - {NABATI, RICHEESE, NEXTAR} -> NABATI (RICHEESE and NEXTAR are Nabati sub-brands/product lines, not standalone brands. Always set brand=NABATI.)
-
-- PACKAGING:
-  - {CAN, CN} -> CAN
-  - {BTL, BT} -> BOTTLE
-  - {VP, V.PACK} -> MULTIPACK
-  - {RTE} -> READY TO EAT
-
-### 🍯 SUGAR & DIETARY FLAGS:
-- {SF, NO SUGAR, WITHOUT SUGAR, S.FREE, ZERO SUGAR} -> SUGAR FREE
-- {NORMAL} -> NORMAL (flavour)
-- {ORIGINAL} -> ORIGINAL (flavour, do NOT convert to NORMAL)
-- {REGULAR} -> REGULAR (variant only. Never treat as flavour.)
-
-### 🏷️ VARIANTS & SUB-FLAVOURS (CRITICAL):
-- Distinguish between REGULAR versions and special ones like {MINI, GIANT, SNOWY, EXTRA, GOLD, PREMIUM, GOKUBOSO, FESTIVE}.
-- If a product has "SNOWY", mark variant as "SNOWY".
-- If it's a standard one, mark variant as "REGULAR".
-
-### 🍯 FLAVOUR & VARIANT RULES (CRITICAL):
-1. **NO SIMPLIFICATION**: Never reduce a compound flavour to a base one.
-2. **PRESERVE ALL COMPONENTS**: If a product has multiple flavor components (e.g., SEA SALT, PISTACHIO, CARAMEL), BOTH must be in the "flavour" string.
-3. **ORDER MATTERS**: Keep the sequence of flavors as much as possible.
-4. **DISTINCT PROFILES**: Treat these as completely DIFFERENT products:
-   - "SEA SALT PISTACHIO CHOCOLATE CHIP" != "DOUBLE CHOCOLATE CHIP"
-   - "ROASTED HAZELNUT CHOCOLATE CHIP" != "CHOCOLATE CHIP"
-   - "SALTED CARAMEL" != "CARAMEL"
-   - "MACADAMIA WHITE CHOCOLATE" != "CRANBERRY WHITE CHOCOLATE"
-
-5. **SPECIFIC EXCLUSIONS**: 
-   - Never ignore ingredients like "HAZELNUT", "PISTACHIO", "ALMOND", "SEA SALT" just because "CHOCOLATE" is also present.
-   - If multiple flavours are present, extract the full specific flavour string (e.g., "STRAWBERRY & BLACKCURRANT").
-   - Do NOT combine flavours unless the compound is an established flavour name.
-
-### Few-Shot Examples for Accuracy:
-1. Input: "MUNCHYS OATKRUNCH S/BERRY&B/CURR 390G"
-   Output: {
-  "brand": "MUNCHYS",
-  "product_line": "OAT KRUNCH",
-  "flavour": "STRAWBERRY & BLACKCURRANT",
-  "variant": "REGULAR",
-  "size": "390G",
-  "product_form": "BISCUIT",
-  "is_sugar_free": false,
-  "base_item": "MUNCHYS OAT KRUNCH BISCUIT STRAWBERRY & BLACKCURRANT 390G",
-  "confidence": 1.0
-}
-
-2. Input: "SKINNY BAKERS COOKIE SLTED CRML CHOC CHIP CKS 80G"
-   Output: {
-  "brand": "THE SKINNY BAKER",
-  "product_line": "COOKIES",
-  "flavour": "SALTED CARAMEL CHOCOLATE CHIP",
-  "variant": "REGULAR",
-  "size": "80G",
-  "product_form": "COOKIE",
-  "is_sugar_free": false,
-  "base_item": "THE SKINNY BAKER COOKIE SALTED CARAMEL CHOCOLATE CHIP 80G",
-  "confidence": 1.0
-}
-
-3. Input: "THE SKINNY BAKER SKINNY BAKERS S/SALT PISTACHIO CHOC CHIP CKS 150G"
-   Output: {
-  "brand": "THE SKINNY BAKER",
-  "product_line": "SKINNY BAKERS",
-  "flavour": "SEA SALT PISTACHIO CHOCOLATE CHIP",
-  "variant": "REGULAR",
-  "size": "150G",
-  "product_form": "COOKIE",
-  "is_sugar_free": false,
-  "base_item": "THE SKINNY BAKER SKINNY BAKERS COOKIE SEA SALT PISTACHIO CHOCOLATE CHIP 150G",
-  "confidence": 1.0
-}
-
-4. Input: "LOTTE PEPERO SNOWY ALMOND 32G"
-   Output: {
-  "brand": "LOTTE",
-  "product_line": "PEPERO",
-  "flavour": "ALMOND",
-  "variant": "SNOWY",
-  "size": "32G",
-  "product_form": "STICK",
-  "is_sugar_free": false,
-  "base_item": "LOTTE PEPERO STICK SNOWY ALMOND 32G",
-  "confidence": 1.0
-}
-
-5. Input: "GLICO POCKY CHOCOLATE GOKUBOSO 71G"
-   Output: {
-  "brand": "GLICO",
-  "product_line": "POCKY",
-  "flavour": "CHOCOLATE",
-  "variant": "GOKUBOSO",
-  "size": "71G",
-  "product_form": "STICK",
-  "is_sugar_free": false,
-  "base_item": "GLICO POCKY STICK CHOCOLATE GOKUBOSO 71G",
-  "confidence": 1.0
-}
-
-6. Input: "NABATI NEXTAR BROWNIES CHOCOLATE 272G"
-   Output: {
-  "brand": "NABATI",
-  "product_line": "NEXTAR BROWNIES",
-  "flavour": "CHOCOLATE",
-  "variant": "REGULAR",
-  "size": "272G",
-  "product_form": "BISCUIT",
-  "is_sugar_free": false,
-  "base_item": "NABATI NEXTAR BROWNIES BISCUIT CHOCOLATE 272G",
-  "confidence": 1.0
-}
-
-6b. Input: "NABATI FESTIVE NEXTAR BROWNIES 272G"
-    Output: {
-  "brand": "NABATI",
-  "product_line": "NEXTAR BROWNIES",
-  "flavour": "CHOCOLATE",
-  "variant": "REGULAR",
-  "size": "272G",
-  "product_form": "BISCUIT",
-  "is_sugar_free": false,
-  "base_item": "NABATI NEXTAR BROWNIES BISCUIT CHOCOLATE 272G",
-  "confidence": 1.0
-}
-
-6c. Input: "NABATI RICHEESE WAFER 145GM"
-    Output: {
-  "brand": "NABATI",
-  "product_line": "RICHEESE",
-  "flavour": "CHEESE",
-  "variant": "REGULAR",
-  "size": "145G",
-  "product_form": "WAFER",
-  "is_sugar_free": false,
-  "base_item": "NABATI RICHEESE WAFER CHEESE 145G",
-  "confidence": 1.0
-}
-
-6d. Input: "NABATI NEXTAR STRAWBERRY 106G"
-    Output: {
-  "brand": "NABATI",
-  "product_line": "NEXTAR",
-  "flavour": "STRAWBERRY",
-  "variant": "REGULAR",
-  "size": "106G",
-  "product_form": "BISCUIT",
-  "is_sugar_free": false,
-  "base_item": "NABATI NEXTAR BISCUIT STRAWBERRY 106G",
-  "confidence": 1.0
-}
-
-7. Input: "HUP SENG CRM CRACKER 428GMX12"
-   Output: {
-  "brand": "HUP SENG",
-  "product_line": "CREAM CRACKERS",
-  "flavour": "NORMAL",
-  "variant": "REGULAR",
-  "size": "428GMX12",
-  "product_form": "CRACKER",
-  "is_sugar_free": false,
-  "base_item": "HUP SENG CREAM CRACKERS 428GMX12",
-  "confidence": 1.0
-}
-
-8. Input: "JULIE CHEESE STICKS 4.5KG"
-   Output: {
-  "brand": "JULIES",
-  "product_line": "CHEESE STICKS",
-  "flavour": "CHEESE",
-  "variant": "REGULAR",
-  "size": "4500G",
-  "product_form": "STICK",
-  "is_sugar_free": false,
-  "base_item": "JULIES STICK CHEESE 4500G",
-  "confidence": 1.0
-}
-
-9. Input: "BOURBON BUTTER COOKIES 9PCS 100G"
-   Output: {
-  "brand": "BOURBON",
-  "product_line": "COOKIES",
-  "flavour": "BUTTER",
-  "variant": "REGULAR",
-  "size": "100G",
-  "product_form": "BISCUIT",
-  "is_sugar_free": false,
-  "base_item": "BOURBON BISCUIT BUTTER 100G",
-  "confidence": 1.0
-}
-
-10. Input: "BOURBON GOKOKU NO BISCUT 32P 133G"
-    Output: {
-  "brand": "BOURBON",
-  "product_line": "GOKOKU NO BISCUIT",
-  "flavour": "NORMAL",
-  "variant": "REGULAR",
-  "size": "133G",
-  "product_form": "BISCUIT",
-  "is_sugar_free": false,
-  "base_item": "BOURBON GOKOKU NO BISCUIT 133G",
-  "confidence": 1.0
-}
-
-11. Input: "BOURBON CEBEURE (14 X 8 G) 112 G"
-    Output: {
-  "brand": "BOURBON",
-  "product_line": "CEBEURE",
-  "flavour": "NORMAL",
-  "variant": "REGULAR",
-  "size": "112G",
-  "product_form": "BISCUIT",
-  "is_sugar_free": false,
-  "base_item": "BOURBON CEBEURE 112G",
-  "confidence": 1.0
-}
-
-### GOAL:
-Extract "brand", "flavour", "variant", "size", "product_line", "product_form", "is_sugar_free" and "base_item" as JSON.
-
-IMPORTANT: 
-1. The "flavour" field MUST contain ALL flavor-related keywords (e.g., SEA SALT, PISTACHIO, HAZELNUT, CARAMEL). Never omit them.
-2. **STRICT LITERAL SIZE EXTRACTION**: The "size" field must be extracted in a standardized numeric form if possible (e.g., convert '4.5KG' to '4500G', '320ML' to '320ML'). For simple cases like '130G', keep it as '130G'.
-3. **SPELING TOLERANCE**: Always normalize brand names to their most common full form (e.g., 'JULIE' -> 'JULIES').
-4. **MPACK Awareness**: If the description mentions a pack count (e.g., 12S, 12X, *12, X12), include it in the size string exactly as written.
-5. **PUNCTUATION REMOVAL**: NEVER include apostrophes (') or backticks (`) in brand or product_line names. (e.g. "O'SOY" -> "OSOY").
-6. **PIECE COUNT REMOVAL**: Piece counts (e.g., 9PCS, 10 PCS) are NOT part of the product line, flavor, or variant.
-7. **PLURAL NORMALIZATION**: Always use singular form for "product_form" and "product_line" if possible (e.g., "CRACKERS" -> "CRACKER", "COOKIES" -> "COOKIE", "STICKS" -> "STICK").
-
-Base item must follow this structure:
-BRAND + PRODUCT_LINE (if any) + PRODUCT_FORM + FLAVOUR + VARIANT (if not REGULAR) + SIZE
-
-"""
-    
-    user_prompt = f"""
+def build_flow2_user_prompt(item):
+    """Per-item user message for Flow 2 attribute extraction (shared by the sync and batch paths)."""
+    return f"""
 ITEM DESCRIPTION: "{item}"
 
 Return JSON only:
@@ -797,68 +570,95 @@ Return JSON only:
   "confidence": 0.0 to 1.0
 }}
 """
-    
+
+
+def normalize_item_llm(item, semantic=True):
+    """
+    Use LLM to extract brand, flavour, size and remove marketing keywords.
+    With persistent caching.
+    """
+    # 1. Check two-tier cache (in-memory LRU, then LLM_CACHE_STORAGE with guards re-applied)
+    cached = get_cached_llm_result(item)
+    if cached is not None:
+        usage_recorder.record_cache_hit("flow2")
+        return cached
+    # 2. Near-identical description already extracted (FLOW2_SEMANTIC_CACHE policy)
+    if semantic:
+        reused = reuse_similar_results([item]).get(item)
+        if reused is not None:
+            return reused
+    return extract_item_attributes(item)
+
+def _flow2_fallback(item):
+    """Generic result used when the LLM gave no usable answer (never cached)."""
+    return finalize_llm_result(item, {
+        "brand": "",
+        "product_line": "",
+        "flavour": "NORMAL",
+        "variant": "REGULAR",
+        "size": "",
+        "product_form": "",
+        "base_item": item,
+        "is_sugar_free": False,
+        "removed_marketing_terms": [],
+        "confidence": 0.0
+    })
+
+def request_item_attributes(item):
+    """LLM extraction for one item (no cache lookup), cached on success; None if the LLM failed."""
+    # Shared prefix + only the brand sections relevant to this item (see flow2_prompt.py)
+    system_prompt, _ = compile_system_prompt(item)
+    
+    user_prompt = build_flow2_user_prompt(item)
+    
+    tier = None
     try:
-        # ✅ Use OpenAI-only client for Flow 2 (faster, no rate limits)
-        raw_content = flow2_client.chat_completion(
-            system_prompt=system_prompt,
-            user_message=user_prompt,
-            temperature=0
-        )
-        
-        raw_content = raw_content.strip()
-        
-        # Handle empty response
-        if not raw_content or raw_content == '{}':
-            print(f"Empty LLM response for '{item}' - using fallback")
-            raise ValueError("Empty response from LLM")
-        
-        # ✅ FIX: Extract only the JSON object, ignore extra text
-        # Find the first { and last } to extract just the JSON
-        start_idx = raw_content.find("{")
-        end_idx = raw_content.rfind("}")
-        
-        if start_idx != -1 and end_idx != -1:
-            json_str = raw_content[start_idx:end_idx+1]
+        # ✅ Use OpenAI-only client for Flow 2 with schema-constrained JSON output
+        # Malformed replies are retried inside chat_json and counted per flow
+        if flow2_client.cascade_enabled():
+            data, tier = extract_attributes_cascade(item, system_prompt, user_prompt)
         else:
-            json_str = raw_content
+            data = flow2_client.chat_json(
+                system_prompt=system_prompt,
+                user_message=user_prompt,
+                schema=FLOW2_ATTRIBUTES_SCHEMA,
+                flow="flow2",
+                temperature=0
+            )
         
-        data = json.loads(json_str)
+        # Handle empty / invalid response
+        if not data:
+            print(f"No valid LLM response for '{item}' - using fallback")
+            raise ValueError("No schema-valid response from LLM")
         
         # Validate required fields
         if not data.get("brand") and not data.get("flavour"):
             print(f"Invalid LLM data for '{item}' - missing brand/flavour")
             raise ValueError("Missing required fields")
             
-    except json.JSONDecodeError as e:
-        print(f"JSON Parse Error for '{item}': {e}")
-        print(f"RAW RESPONSE: {raw_content[:200] if raw_content else 'EMPTY'}")
-        # Fallback to default
-        data = {
-            "brand": "",
-            "flavour": "",
-            "variant": "REGULAR",
-            "size": "",
-            "base_item": item,
-            "removed_marketing_terms": [],
-            "confidence": 0.0
-        }
     except Exception as e:
         print(f"LLM Error for '{item}': {e}")
-        # Fallback to default
-        data = {
-            "brand": "",
-            "product_line": "",
-            "flavour": "NORMAL",
-            "variant": "REGULAR",
-            "size": "",
-            "product_form": "",
-            "base_item": item,
-            "is_sugar_free": False,
-            "removed_marketing_terms": [],
-            "confidence": 0.0
-        }
+        return None
+    
+    data = finalize_llm_result(item, data)
     
+    # Save to persistent cache and in-memory cache
+    save_to_llm_cache(item, data, tier=tier)
+    return data
+
+def extract_item_attributes(item):
+    """
+    LLM extraction for one item (no cache lookup); the result is cached unless the LLM failed.
+    Failed extractions return the generic fallback and are NOT cached (not even in the in-process
+    tier), so the next lookup retries them.
+    """
+    return request_item_attributes(item) or _flow2_fallback(item)
+
+_SIZE_TOKEN = re.compile(r"\d+(?:\.\d+)?\s*(?:G|GM|GR|KG|ML|L|LTR)\b")
+
+
+def finalize_llm_result(item, data):
+    """Rule-layer guards applied to every fresh LLM result before it is cached."""
     # 🚨 RULE-LAYER GUARDS (USE ONLY AS FALLBACK FOR GENERIC/MISSING DATA)
     
     # 1. Brand-First Protection (For "ORI")
@@ -903,12 +703,127 @@ Return JSON only:
                     break
 
     # Apply final guards before returning/caching
-    data = apply_llm_rule_guards(item, data)
-    
-    # Save to persistent cache and in-memory cache
-    save_to_llm_cache(item, data)
-    llm_cache[item] = data
-    return data
+    return apply_llm_rule_guards(item, data)
+
+
+# Versions of the rule layers, bumped by hand whenever their behaviour changes:
+#   FLOW2_GUARD_VERSION      - finalize_llm_result / normalize_synonyms (baked into stored results)
+#   FLOW2_LOAD_GUARD_VERSION - apply_llm_rule_guards (re-applied on every load; checked by snapshot readers)
+FLOW2_GUARD_VERSION = "2"
+FLOW2_LOAD_GUARD_VERSION = "1"
+
+_fingerprints = {}
+
+
+def flow2_cache_version(item, stored=None, tier=None):
+    """
+    Fingerprint stamped on every LLM_CACHE_STORAGE entry:
+      - prompt_hash:   system prompt sections used for this item + user prompt template
+      - model:         the model tier that produced the result (tier:deployment). Only that tier's
+                       models count, so adding a replica or another tier keeps entries current.
+      - guard_version: FLOW2_GUARD_VERSION, the post-LLM guards baked into the stored result.
+                       apply_llm_rule_guards is re-applied on every load, so it is not part of it.
+    `tier` is the producing tier of a new entry; when checking a `stored` fingerprint its own
+    tier is used, so fast-tier entries are compared with the fast models.
+    """
+    if not _fingerprints:
+        # Filled in one update: worker threads may call this concurrently on the first cache writes
+        pool = flow2_client.pool
+        _fingerprints.update({
+            "user_template": hashlib.sha1(build_flow2_user_prompt("{item}").encode("utf-8")).hexdigest()[:8],
+            "models": {t: pool.fingerprint(t) if pool else "none" for t in (TIER_FAST, TIER_STRONG)},
+        })
+    if tier is None and stored:
+        tier = str(stored.get("model", "")).split(":")[0]
+    return {
+        "prompt_hash": f"{prompt_fingerprint(item)}-{_fingerprints['user_template']}",
+        "model": _fingerprints["models"].get(tier, _fingerprints["models"][TIER_STRONG]),
+        "guard_version": FLOW2_GUARD_VERSION,
+    }
+
+
+def revalidate_flow2_cache(limit=100, max_workers=4):
+    """
+    Refresh up to `limit` outdated LLM_CACHE_STORAGE entries: first the ones recently served
+    stale, then any found by scanning the collection. Runs at bulk priority.
+    """
+    items = flow2_cache.pop_stale(limit)
+    if len(items) < limit:
+        items += [it for it in flow2_cache.scan_stale(limit - len(items)) if it not in items]
+    if not items:
+        return {"revalidated": 0, "failed": 0}
+
+    print(f"Cache revalidation: refreshing {len(items)} stale Flow 2 entries...")
+    # The stale entries stay in place until a fresh result replaces them; failures keep serving them
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(request_item_attributes, items))
+    flow2_cache.flush()
+    failed = [it for it, r in zip(items, results) if r is None]
+    return {"revalidated": len(items) - len(failed), "failed": len(failed), "items": items[:20],
+            "failed_items": failed[:20]}
+
+
+def validate_llm_result(item, data):
+    """
+    Rule checks used by the cascade to decide whether a fast-tier result can be accepted.
+    Returns a list of problems; empty means the result is good enough.
+    """
+    if not data:
+        return ["no valid response"]
+    problems = []
+    if data.get("confidence", 0) < LLM_CONFIDENCE_THRESHOLD:
+        problems.append(f"confidence {data.get('confidence', 0)} < {LLM_CONFIDENCE_THRESHOLD}")
+    brand = str(data.get("brand") or "").strip().upper()
+    base_item = str(data.get("base_item") or "").strip().upper()
+    if not brand:
+        problems.append("missing brand")
+    if not base_item:
+        problems.append("missing base_item")
+    elif brand and brand not in base_item:
+        problems.append("brand not in base_item")
+    if not data.get("size") and _SIZE_TOKEN.search(str(item).upper()):
+        problems.append("size present in description but not extracted")
+    return problems
+
+
+def extract_attributes_cascade(item, system_prompt, user_prompt):
+    """
+    Cheap-first cascade: the fast tier tries first and only results failing
+    validate_llm_result are escalated to the strong tier.
+    Returns (data, tier_that_produced_it).
+    """
+    data = flow2_client.chat_json(
+        system_prompt=system_prompt,
+        user_message=user_prompt,
+        schema=FLOW2_ATTRIBUTES_SCHEMA,
+        flow="flow2",
+        temperature=0,
+        tier=TIER_FAST
+    )
+    problems = validate_llm_result(item, data)
+    if not problems:
+        with _cascade_lock:
+            cascade_stats["fast_accepted"] += 1
+        return data, TIER_FAST
+
+    print(f"Cascade: escalating '{item}' to {TIER_STRONG} tier ({'; '.join(problems)})")
+    strong = flow2_client.chat_json(
+        system_prompt=system_prompt,
+        user_message=user_prompt,
+        schema=FLOW2_ATTRIBUTES_SCHEMA,
+        flow="flow2",
+        temperature=0,
+        tier=TIER_STRONG
+    )
+    with _cascade_lock:
+        cascade_stats["escalated"] += 1
+        if not strong:
+            cascade_stats["strong_failed"] += 1
+    if strong:
+        return strong, TIER_STRONG
+    # Strong tier failed outright: a low-confidence fast answer still beats the generic fallback
+    return data, TIER_FAST
+
 
 def apply_llm_rule_guards(item, data):
     """
@@ -1212,30 +1127,12 @@ def simple_clean_item(name):
     return "".join(words)
 
 
-async def process_llm_mastering_flow_2(sheet_name, request=None):
+def select_representative_items(docs):
     """
-    Flow 2: LLM Mastering.
-    Reads from single_stock_data, creates master_stock_data with LLM-extracted attributes.
+    Flow 2 discovery: unique items, their brand-prefixed LLM context, clean-key groups and
+    one representative item per group (the only items that are sent to the LLM).
+    Shared by the synchronous Flow 2 run and the offline batch mode (llm_batch.py).
     """
-    FIXED_SHEET_NAME = "wersel_match"
-    src_col = get_collection(SINGLE_STOCK_COL)
-    tgt_col = get_collection(MASTER_STOCK_COL)
-    
-    # ✅ STEP 0: Clear previous Master Stock for fresh mastering run
-    tgt_col.delete_many({})
-    print(f"Cleared {MASTER_STOCK_COL} for fresh mastering.")
-    
-    # Process items that match our fixed sheet name
-    docs = list(src_col.find({"sheet_name": FIXED_SHEET_NAME}))
-    print(f"Loaded {len(docs)} docs from MongoDB ({SINGLE_STOCK_COL})")
-
-    
-    groups = {}
-    single_docs = []
-    
-    # 1. Discovery Phase: Extract unique items and fetch attributes in parallel
-    print(f"Discovery Phase: Extracting unique attributes for {len(docs)} items...")
-
     unique_items = list(set([d.get("ITEM") for d in docs if d.get("ITEM")]))
     
     # ✅ FIX: Map original item to context-aware item (Prepend Brand if missing)
@@ -1267,8 +1164,458 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
         representative_items.append(rep)
         ckey_to_rep[ckey] = rep
 
+    return unique_items, item_to_context, clean_groups, ckey_to_rep, representative_items
+
+
+def flow2_pre_group_key(d, norm):
+    """
+    Flow 2 pre-group key of one single-stock doc (everything the clusters are keyed on except what
+    the post-merge audit splits on). Shared by full and incremental mastering runs.
+    """
+    item = d.get("ITEM")
+    brand = d.get("BRAND")
+    # Get LLM result or use a very basic fallback
+    norm = norm or {"brand": brand or "Unknown", "flavour": "Unknown", "size": "Unknown", "confidence": 0}
+    
+    def get_val(doc, key_list):
+        for k, v in doc.items():
+            if k.upper() in [x.upper() for x in key_list]: return str(v).strip()
+        return "UNKNOWN"
+        
+    market_val = get_val(d, ["MARKETS", "MARKET"])
+    mpack_val = normalize_mpack(get_val(d, ["MPACK", "PACK"]))
+    facts_val = get_val(d, ["FACTS", "FACT"])
+    
+    # 2. CONSTRUCT PRE-GROUP KEY
+    # FIX 1: Use ONLY LLM-Standardized Brand (Never trust Excel Brand for grouping)
+    llm_brand = str(norm.get("brand", "UNKNOWN")).upper()
+    llm_form = str(norm.get("product_form", "UNKNOWN")).upper()
+    llm_flavour = str(norm.get("flavour", "UNKNOWN")).upper()
+    llm_variant = str(norm.get("variant", "REGULAR")).upper() # Safeguard: Default to REGULAR
+    
+    if norm.get("confidence", 0) >= LLM_CONFIDENCE_THRESHOLD:
+        # HIGH CONFIDENCE: Use LLM Attributes
+        
+        # FIX 3: ASSORTED Protection (Keep different Assorted names separate)
+        assorted_guard = ""
+        if llm_form == "ASSORTED":
+            # Use a cleaned version of the item name to prevent "TOPMIX" vs "FUNMIX" merging
+            assorted_guard = f"|{simple_clean_item(item)}"
+        
+        is_sf = "SF" if norm.get("is_sugar_free") else "REG"
+        # STEP 2 HARD RULE: Family Token Gatekeeper
+        llm_line = str(norm.get("product_line", "")).strip().upper()
+        
+        # 🚨 HARD FAMILY GUARD (MANDATORY)
+        # If product_line is missing, downgrade to LOW_CONF to prevent wrong merges
+        if not llm_line or llm_line in ["NONE", "UNKNOWN"]:
+            # print(f"⚠️  FAMILY MISSING → LOW_CONF :: {item}")
+            clean_sig = simple_clean_item(item)
+            # KEY CHANGE: Removed facts_val from key
+            pre_group_key = (
+                f"LOW_CONF|{llm_brand}|{clean_sig}|"
+                f"{market_val}|{mpack_val}|{norm.get('size', 'UNKNOWN')}"
+            )
+        else:
+            # ✅ ADDED LLM_VARIANT and MPACK to HI_CONF key
+            # KEY CHANGE: Removed facts_val from key to consolidate Value and Units metrics
+            pre_group_key = (
+                f"HI_CONF|{llm_brand}|{llm_line}|{llm_form}|{llm_flavour}|{llm_variant}|{is_sf}|"
+                f"{market_val}|{mpack_val}|{norm.get('size', 'UNKNOWN')}{assorted_guard}"
+            )
+    else:
+        # FIX 2: Safer LOW_CONF Fallback (Do not blindly merge)
+        # We use the cleaned item name as a unique signature to keep questionable items separate
+        clean_sig = simple_clean_item(item)
+        # KEY CHANGE: Removed facts_val from key
+        pre_group_key = (
+            f"LOW_CONF|{llm_brand}|{clean_sig}|"
+            f"{market_val}|{mpack_val}|{norm.get('size', 'UNKNOWN')}"
+        )
+    return pre_group_key
+
+
+def _pre_group_brand(pre_group_key):
+    """LLM brand a pre-group key was built from (clusters never span LLM brands)."""
+    parts = pre_group_key.split("|")
+    return parts[1] if len(parts) > 1 else None
+
+
+def _low_conf_context(pre_group_key):
+    """Market|Pack|Size context within which the fuzzy stage may merge LOW_CONF keys (None for HI_CONF)."""
+    parts = pre_group_key.split("|")
+    if pre_group_key.startswith("LOW_CONF|") and len(parts) >= 6:
+        return "|".join([parts[3], parts[4], parts[5]])
+    return None
+
+
+def _content_hash(value):
+    return hashlib.md5(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def single_stock_fingerprint(doc):
+    """
+    Content hash of a single-stock doc. Flow 1 re-inserts single_stock_data with new _ids on every
+    run, so incremental mastering tracks docs by content rather than by _id. Flow 1 stores it on
+    each doc as "content_hash"; docs written before that are hashed from their content.
+    """
+    if doc.get("content_hash"):
+        return doc["content_hash"]
+    return _content_hash({k: v for k, v in doc.items() if k not in ("_id", "_norm", "is_merged_status", "content_hash")})
+
+
+def mastering_state_entries(docs, norm_map, doc_keys):
+    """
+    Per distinct doc content: how many docs carry it, its ITEM, its pre-group key (with the LLM
+    brand and LOW_CONF fuzzy-merge context it implies) and a hash of the LLM result it was grouped
+    with. Returns {fingerprint: entry}. Projected docs carry the fingerprint of their full
+    document in "_fp".
+    """
+    entries = {}
+    for d in docs:
+        key = doc_keys.get(id(d))
+        if key is None:
+            continue
+        item = d.get("ITEM")
+        fp = d.get("_fp") or single_stock_fingerprint(d)
+        entry = entries.setdefault(fp, {"count": 0, "pre_group_key": key,
+                                        "norm_hash": _content_hash(norm_map.get(item)),
+                                        "item": item, "brand": _pre_group_brand(key),
+                                        "context": _low_conf_context(key)})
+        entry["count"] += 1
+    return entries
+
+
+def _state_changed(old, entry):
+    return old is None or any(old.get(f) != entry[f] for f in ("count", "pre_group_key", "norm_hash"))
+
+
+def affected_pre_group_keys(state, entries):
+    """
+    Pre-group keys touched since the last mastering run: keys of new, removed or re-extracted docs
+    (old and new key), widened to every LOW_CONF key sharing a fuzzy-merge context with them.
+    """
+    affected = set()
+    for fp, entry in entries.items():
+        old = state.get(fp)
+        if not _state_changed(old, entry):
+            continue
+        affected.add(entry["pre_group_key"])
+        if old:
+            affected.add(old["pre_group_key"])
+    for fp, old in state.items():
+        if fp not in entries:
+            affected.add(old["pre_group_key"])
+
+    contexts = {_low_conf_context(k) for k in affected} - {None}
+    if contexts:
+        affected |= {e["pre_group_key"] for e in entries.values() if _low_conf_context(e["pre_group_key"]) in contexts}
+    return affected
+
+
+def save_mastering_state(state, entries):
+    """Write the state diff: changed entries upserted, entries of vanished docs removed."""
+    coll = get_collection(FLOW2_STATE_COL)
+    ops = [UpdateOne({"_id": fp}, {"$set": entry}, upsert=True) for fp, entry in entries.items()
+           if state.get(fp) is None or any(state[fp].get(f) != v for f, v in entry.items())]
+    for i in range(0, len(ops), 5000):
+        coll.bulk_write(ops[i:i + 5000], ordered=False)
+    gone = [fp for fp in state if fp not in entries]
+    for i in range(0, len(gone), 5000):
+        coll.delete_many({"_id": {"$in": gone[i:i + 5000]}})
+    return len(ops), len(gone)
+
+
+def flow2_merge_id(brand, cluster_keys, group_docs):
+    """
+    Content-addressed master id: the cluster's pre-group key plus its sorted member UPCs (the item
+    name stands in for a missing UPC), so an unchanged cluster keeps its id across runs.
+    """
+    members = sorted({str(d.get("UPC") or d.get("ITEM") or "") for d in group_docs})
+    digest = hashlib.sha1("\n".join([cluster_keys[0], *members]).encode("utf-8")).hexdigest()[:24]
+    return f"{brand}_{digest}"
+
+
+def suffix_repeated_merge_ids(records):
+    """
+    Give records sharing a merge_id (identical clusters split by the audit) _1, _2... suffixes in
+    content order, so reruns give each record the same id whatever the input order.
+    """
+    by_merge_id = {}
+    for record in records:
+        by_merge_id.setdefault(record["merge_id"], []).append(record)
+    for merge_id, group in by_merge_id.items():
+        if len(group) < 2:
+            continue
+        group.sort(key=lambda r: _content_hash({k: v for k, v in r.items() if k not in ("_id", "merge_id", "content_hash")}))
+        for n, record in enumerate(group[1:], start=1):
+            record["merge_id"] = f"{merge_id}_{n}"
+
+
+def master_record_hash(record):
+    return _content_hash({k: v for k, v in record.items() if k != "content_hash"})
+
+
+def diff_master_records(tgt_col, records, existing_filters):
+    """
+    Compare freshly built master records with the stored ones matched by `existing_filters` (one
+    query each). Returns (write_ops, stale_ids, unchanged): ReplaceOne for new or changed records,
+    _ids of stored records that were not rebuilt, and how many records are already up to date.
+    """
+    existing = {}
+    for query in existing_filters:
+        for doc in tgt_col.find(query, {"merge_id": 1, "sheet_name": 1, "content_hash": 1}):
+            existing[(doc.get("merge_id"), doc.get("sheet_name"))] = doc
+    ops, unchanged, built = [], 0, set()
+    for record in records:
+        key = (record["merge_id"], record["sheet_name"])
+        built.add(key)
+        record["content_hash"] = master_record_hash(record)
+        stored = existing.get(key)
+        if stored and stored.get("content_hash") == record["content_hash"]:
+            unchanged += 1
+            continue
+        ops.append(ReplaceOne({"merge_id": record["merge_id"], "sheet_name": record["sheet_name"]}, record, upsert=True))
+    stale_ids = [doc["_id"] for key, doc in existing.items() if key not in built]
+    return ops, stale_ids, unchanged
+
+
+def cluster_projection():
+    """Projection of the clustering fields in every casing the sheets use (projections match names exactly)."""
+    return {name: 1 for f in FLOW2_CLUSTER_FIELDS for name in (f, f.upper(), f.lower(), f.title())}
+
+
+def load_cluster_docs(src_col, query, with_fingerprints):
+    """
+    Pass 1 of a two-pass Flow 2 run: the clustering fields of every matching doc. With
+    with_fingerprints (incremental runs) the stored content_hash is projected too and carried in
+    "_fp". Docs written before Flow 1 stored it are read in full once (by _id, in batches) and
+    get it backfilled.
+    """
+    projection = cluster_projection()
+    if not with_fingerprints:
+        return list(src_col.find(query, projection))
+    docs = list(src_col.find(query, {**projection, "content_hash": 1}))
+    missing = [d["_id"] for d in docs if not d.get("content_hash")]
+    backfilled = {}
+    for i in range(0, len(missing), FLOW2_FETCH_BATCH):
+        ops = []
+        for full in src_col.find({"_id": {"$in": missing[i:i + FLOW2_FETCH_BATCH]}}):
+            backfilled[full["_id"]] = single_stock_fingerprint(full)
+            ops.append(UpdateOne({"_id": full["_id"]}, {"$set": {"content_hash": backfilled[full["_id"]]}}))
+        if ops:
+            src_col.bulk_write(ops, ordered=False)
+    if missing:
+        print(f"Flow 2: Backfilled content_hash on {len(backfilled)} single-stock docs")
+    for d in docs:
+        d["_fp"] = d.pop("content_hash", None) or backfilled.get(d["_id"])
+    return docs
+
+
+def iter_full_clusters(src_col, clusters, batch_docs=FLOW2_FETCH_BATCH):
+    """
+    Pass 2: yield (full_docs, keys) for each (projected_docs, keys) cluster, fetching the full
+    documents by _id in batches of about `batch_docs`. Projected docs get "_fp" on the way.
+    Docs removed since pass 1 are skipped.
+    """
+    pending, ids = [], []
+
+    def flush():
+        full = {d["_id"]: d for i in range(0, len(ids), 5000)
+                for d in src_col.find({"_id": {"$in": ids[i:i + 5000]}})}
+        for cluster_docs, keys in pending:
+            found = []
+            for d in cluster_docs:
+                doc = full.get(d["_id"])
+                if doc is not None:
+                    d.setdefault("_fp", single_stock_fingerprint(doc))
+                    found.append(doc)
+            if found:
+                yield found, keys
+
+    for cluster_docs, keys in clusters:
+        pending.append((cluster_docs, keys))
+        ids.extend(d["_id"] for d in cluster_docs)
+        if len(ids) >= batch_docs:
+            yield from flush()
+            pending, ids = [], []
+    if pending:
+        yield from flush()
+
+
+def brand_filter(brands):
+    """Case-insensitive exact-match filter on BRAND for a brand-scoped Flow 2 run."""
+    return {"$in": [re.compile(f"^{re.escape(b)}$", re.IGNORECASE) for b in brands]}
+
+
+def mastering_state_seeded():
+    """
+    True once a full Flow 2 run has written the mastering state. Master records written before
+    it carry no pre_group_keys, so incremental and brand-scoped runs could not find (and replace)
+    them.
+    """
+    return get_collection(FLOW2_STATE_COL).find_one({}, {"_id": 1}) is not None
+
+
+def load_mastering_state(brands=None):
+    """
+    Mastering state of a Flow 2 run: every entry, or for a brand-scoped run the entries whose LLM
+    brand is in scope plus every entry sharing a LOW_CONF fuzzy-merge context with them (the fuzzy
+    stage merges LOW_CONF keys across brands).
+    """
+    coll = get_collection(FLOW2_STATE_COL)
+    if not brands:
+        return {s["_id"]: s for s in coll.find()}
+    state = {s["_id"]: s for s in coll.find({"brand": {"$in": [b.upper() for b in brands]}})}
+    contexts = list({s.get("context") for s in state.values()} - {None})
+    for i in range(0, len(contexts), 5000):
+        state.update((s["_id"], s) for s in coll.find({"context": {"$in": contexts[i:i + 5000]}}))
+    return state
+
+
+def brand_scope_query(brands, state):
+    """
+    single_stock_data query of a brand-scoped run: the docs clustered into the slice last time
+    (by ITEM, from the mastering state) and the docs filed under one of the brands in the BRAND
+    column (new docs). Docs whose LLM brand turns out to be out of scope are dropped after
+    extraction (scope_pre_group_keys).
+    """
+    items = sorted({s["item"] for s in state.values() if s.get("item")})
+    return {"$or": [{"BRAND": brand_filter(brands)}, {"ITEM": {"$in": items}}]} if items else {"BRAND": brand_filter(brands)}
+
+
+def scope_pre_group_keys(brands, state, keys):
+    """
+    Pre-group keys of a brand-scoped run: keys whose LLM brand is in scope, LOW_CONF keys sharing a
+    fuzzy-merge context with them and every key of the slice's mastering state.
+    """
+    scope = {b.upper() for b in brands}
+    in_scope = {k for k in keys if _pre_group_brand(k) in scope}
+    contexts = ({_low_conf_context(k) for k in in_scope} | {s.get("context") for s in state.values()}) - {None}
+    in_scope |= {k for k in keys if _low_conf_context(k) in contexts}
+    return in_scope | {s["pre_group_key"] for s in state.values()}
+
+
+def replace_master_slice(tgt_col, ops, stale_ids):
+    """
+    Apply a brand slice's writes and deletes in one transaction, so readers see either the old or
+    the new slice. Returns the number of deleted records, or None when the server has no
+    transactions (standalone mongod); the caller then writes the slice without one.
+    """
+    def apply(session):
+        if ops:
+            tgt_col.bulk_write(ops, ordered=False, session=session)
+        if not stale_ids:
+            return 0
+        return tgt_col.delete_many({"_id": {"$in": stale_ids}}, session=session).deleted_count
+
+    try:
+        with tgt_col.database.client.start_session() as session:
+            return session.with_transaction(apply)
+    except OperationFailure as e:
+        if e.code != 20:  # IllegalOperation: transactions need a replica set
+            raise
+        print(f"⚠️ Flow 2: MongoDB transactions unavailable ({e}); replacing the slice without one")
+        return None
+
+
+async def process_llm_mastering_flow_2(sheet_name, request=None, incremental=False, brands=None):
+    """
+    Flow 2: LLM Mastering.
+    Reads from single_stock_data, creates master_stock_data with LLM-extracted attributes.
+
+    incremental=True re-clusters only the pre-groups touched since the last run (new, changed or
+    removed single-stock docs and docs whose cached LLM result changed, e.g. after a cache
+    invalidation or a rule change) and replaces only the master records built from them.
+    Falls back to a full run when no mastering state exists yet (that run seeds it).
+
+    merge_ids are derived from the cluster (flow2_merge_id) and records are diffed against
+    master_stock_data by content hash: only new or changed records are written, records that
+    were not rebuilt are deleted.
+
+    brands=["OREO", ...] scopes the run to the single-stock docs whose LLM brand is one of those
+    brands (case-insensitive), plus the LOW_CONF docs the fuzzy stage may merge with them, and
+    replaces only the master records built from those pre-group keys, in one transaction when the
+    server supports it. Refused until a full run has seeded the mastering state (master records
+    written before it have no pre_group_keys). Docs are found through the mastering state and the
+    BRAND column, so a doc of another BRAND value whose LLM brand has not been recorded yet joins
+    the slice on the next full run.
+
+    Docs are loaded in two passes (FLOW2_TWO_PASS_LOAD): the clustering fields only, then the
+    full documents by _id in batches while master records are built.
+    """
+    run_token = usage_recorder.start_run("flow2")
+    run_id = usage_recorder.run_id
+    tracing = FLOW2_MEMORY_REPORT and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    try:
+        return await _process_llm_mastering_flow_2(sheet_name, request, incremental, brands, run_id, tracing)
+    finally:
+        if tracing:
+            tracemalloc.stop()
+        usage_recorder.end_run(run_token)
+
+
+async def _process_llm_mastering_flow_2(sheet_name, request, incremental, brands, run_id, tracing):
+    """Body of process_llm_mastering_flow_2, run inside its LLM usage run (and heap trace when `tracing`)."""
+    FIXED_SHEET_NAME = "wersel_match"
+    src_col = get_collection(SINGLE_STOCK_COL)
+    tgt_col = get_collection(MASTER_STOCK_COL)
+
+    brands = [b.strip() for b in brands or [] if b and b.strip()]
+    if brands and not mastering_state_seeded():
+        print("⚠️ Flow 2: No mastering state yet; a brand-scoped run needs one full run first.")
+        return {"status": "Stopped | No mastering state yet: run a full Flow 2 mastering before a brand-scoped one",
+                "brands": brands}
+    state = load_mastering_state(brands)
+    if incremental and not state:
+        print("Flow 2: No mastering state yet, running a full mastering instead of an incremental one.")
+        incremental = False
+    
+    # ✅ STEP 0: Master Stock is no longer cleared; the rebuilt records are diffed against it before saving
+    prompt_stats.reset()
+    with _cascade_lock:
+        for k in cascade_stats:
+            cascade_stats[k] = 0
+        for k in semantic_stats:
+            semantic_stats[k] = 0
+    
+    # Process items that match our fixed sheet name
+    doc_query = {"sheet_name": FIXED_SHEET_NAME}
+    if brands:
+        doc_query.update(brand_scope_query(brands, state))
+    if FLOW2_TWO_PASS_LOAD:
+        docs = load_cluster_docs(src_col, doc_query, with_fingerprints=incremental)
+    else:
+        docs = list(src_col.find(doc_query))
+    print(f"Loaded {len(docs)} docs from MongoDB ({SINGLE_STOCK_COL})" + (f" for brands {brands}" if brands else "")
+          + (" (clustering fields)" if FLOW2_TWO_PASS_LOAD else ""))
+    load_memory = tracemalloc.get_traced_memory() if tracing else None  # (held after loading, peak)
+
+    
+    groups = {}
+    single_docs = []
+    
+    # 1. Discovery Phase: Extract unique items and fetch attributes in parallel
+    print(f"Discovery Phase: Extracting unique attributes for {len(docs)} items...")
+
+    unique_items, item_to_context, clean_groups, ckey_to_rep, representative_items = select_representative_items(docs)
+
     norm_map = {} # {original_item: result}
     rep_results = {} # {representative_item: result}
+
+    if incremental or brands:
+        # Cached items are served in one pass; only misses go through the LLM batches below
+        cached = get_cached_llm_results([item_to_context.get(it, it) for it in representative_items])
+        for it in representative_items:
+            res = cached.get(item_to_context.get(it, it))
+            if res:
+                rep_results[it] = res
+        if rep_results:
+            usage_recorder.record_cache_hit("flow2", len(rep_results))
+        representative_items = [it for it in representative_items if it not in rep_results]
+        print(f"Flow 2: {len(rep_results)} representative items served from cache, {len(representative_items)} to extract")
     
     # Process in batches to avoid rate limits
     batch_size = 500
@@ -1276,25 +1623,6 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
     
     print(f"Processing {len(representative_items)} representative items (from {len(unique_items)} total unique) in {total_batches} batches...")
     
-    # ✅ Strategy 2: Pre-load cache from MongoDB
-    try:
-        cache_coll = get_collection("LLM_CACHE_STORAGE")
-        # Pre-load only for representative context items
-        context_reps = [item_to_context.get(it, it) for it in representative_items]
-        existing_cache_docs = list(cache_coll.find({"item": {"$in": context_reps}}))
-        existing_cache = {}
-        for doc in existing_cache_docs:
-            item_name = doc["item"]
-            res = doc["result"]
-            # RE-APPLY GUARDS to cached data to ensure new force rules take effect
-            res = apply_llm_rule_guards(item_name, res)
-            existing_cache[item_name] = res
-            
-        llm_cache.update(existing_cache)
-        print(f"Pre-loaded {len(existing_cache)} items from persistent cache with latest rule guards applied.")
-    except Exception as e:
-        print(f"Error pre-loading cache: {e}")
-
     for batch_num in range(total_batches):
         if batch_num % 10 == 0 and request and await request.is_disconnected():
             print(f"Stopping Flow 2: Client disconnected before batch {batch_num + 1}")
@@ -1307,12 +1635,25 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
         # ✅ Use context-aware names (with Brand) for LLM
         # Map: original_item -> context_item
         batch_map = {it: item_to_context.get(it, it) for it in batch_reps}
+
+        # ✅ Strategy 2: Prefetch this batch from the persistent cache with one $in query
+        # (guards are re-applied on load); only the bounded in-memory tier holds them
+        try:
+            prefetched = get_cached_llm_results(batch_map.values())
+            print(f"Batch {batch_num + 1}/{total_batches}: {len(prefetched)} items served from cache")
+            # Misses: reuse results of reworded descriptions from earlier files (one $in per key type)
+            reused = reuse_similar_results([ctx for ctx in batch_map.values() if ctx not in prefetched])
+            if reused:
+                print(f"Batch {batch_num + 1}/{total_batches}: {len(reused)} items reused from near-identical cache entries")
+        except Exception as e:
+            print(f"Error pre-loading cache: {e}")
         
         print(f"Batch {batch_num + 1}/{total_batches}: Calling LLM for {len(batch_reps)} items...")
         
         with ThreadPoolExecutor(max_workers=10) as executor:
-            # Future -> original_item
-            future_to_orig = {executor.submit(normalize_item_llm, ctx_it): orig_it 
+            # Future -> original_item (workers record LLM usage under this run)
+            normalize = bind_run(normalize_item_llm)
+            future_to_orig = {executor.submit(normalize, ctx_it, False): orig_it 
                               for orig_it, ctx_it in batch_map.items()}
             
             from concurrent.futures import as_completed
@@ -1328,6 +1669,9 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
                 except Exception as e:
                     print(f"Error in thread for {original_item}: {e}")
                     rep_results[original_item] = {}
+
+            # Persist this batch's new cache entries with one bulk_write
+            flow2_cache.flush()
             
             if batch_num < total_batches - 1:
                 print(f"Batch {batch_num + 1} completed. {len(rep_results)} items in results map.")
@@ -1347,72 +1691,26 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
 
     
     # Pre-group by everything EXCEPT size to handle size tolerance per Brand+Flavour+Market combo
+    doc_keys = {id(d): flow2_pre_group_key(d, norm_map.get(d.get("ITEM"))) for d in docs if d.get("ITEM")}
+    slice_keys = None
+    if brands:
+        # Keep the docs whose cached LLM brand (not the BRAND column) puts them in the slice
+        slice_keys = scope_pre_group_keys(brands, state, set(doc_keys.values()))
+        docs = [d for d in docs if doc_keys.get(id(d)) in slice_keys]
+        print(f"Flow 2: {len(docs)} docs in the slice of brands {brands} ({len(slice_keys)} pre-group keys)")
+    # Full runs take the doc fingerprints from pass 2 (every doc is fetched there)
+    entries = mastering_state_entries(docs, norm_map, doc_keys) if incremental else None
+    affected = affected_pre_group_keys(state, entries) if incremental else None
     pre_groups = {}
     for d in docs:
-        item = d.get("ITEM")
-        brand = d.get("BRAND")
-        if not item: continue
-        
-        # Get LLM result or use a very basic fallback
-        norm = norm_map.get(item, {"brand": brand or "Unknown", "flavour": "Unknown", "size": "Unknown", "confidence": 0})
-        
-        def get_val(doc, key_list):
-            for k, v in doc.items():
-                if k.upper() in [x.upper() for x in key_list]: return str(v).strip()
-            return "UNKNOWN"
-            
-        market_val = get_val(d, ["MARKETS", "MARKET"])
-        mpack_val = normalize_mpack(get_val(d, ["MPACK", "PACK"]))
-        facts_val = get_val(d, ["FACTS", "FACT"])
-        
-        # 2. CONSTRUCT PRE-GROUP KEY
-        # FIX 1: Use ONLY LLM-Standardized Brand (Never trust Excel Brand for grouping)
-        llm_brand = str(norm.get("brand", "UNKNOWN")).upper()
-        llm_form = str(norm.get("product_form", "UNKNOWN")).upper()
-        llm_flavour = str(norm.get("flavour", "UNKNOWN")).upper()
-        llm_variant = str(norm.get("variant", "REGULAR")).upper() # Safeguard: Default to REGULAR
-        
-        if norm.get("confidence", 0) >= LLM_CONFIDENCE_THRESHOLD:
-            # HIGH CONFIDENCE: Use LLM Attributes
-            
-            # FIX 3: ASSORTED Protection (Keep different Assorted names separate)
-            assorted_guard = ""
-            if llm_form == "ASSORTED":
-                # Use a cleaned version of the item name to prevent "TOPMIX" vs "FUNMIX" merging
-                assorted_guard = f"|{simple_clean_item(item)}"
-            
-            is_sf = "SF" if norm.get("is_sugar_free") else "REG"
-            # STEP 2 HARD RULE: Family Token Gatekeeper
-            llm_line = str(norm.get("product_line", "")).strip().upper()
-            
-            # 🚨 HARD FAMILY GUARD (MANDATORY)
-            # If product_line is missing, downgrade to LOW_CONF to prevent wrong merges
-            if not llm_line or llm_line in ["NONE", "UNKNOWN"]:
-                # print(f"⚠️  FAMILY MISSING → LOW_CONF :: {item}")
-                clean_sig = simple_clean_item(item)
-                # KEY CHANGE: Removed facts_val from key
-                pre_group_key = (
-                    f"LOW_CONF|{llm_brand}|{clean_sig}|"
-                    f"{market_val}|{mpack_val}|{norm.get('size', 'UNKNOWN')}"
-                )
-            else:
-                # ✅ ADDED LLM_VARIANT and MPACK to HI_CONF key
-                # KEY CHANGE: Removed facts_val from key to consolidate Value and Units metrics
-                pre_group_key = (
-                    f"HI_CONF|{llm_brand}|{llm_line}|{llm_form}|{llm_flavour}|{llm_variant}|{is_sf}|"
-                    f"{market_val}|{mpack_val}|{norm.get('size', 'UNKNOWN')}{assorted_guard}"
-                )
-        else:
-            # FIX 2: Safer LOW_CONF Fallback (Do not blindly merge)
-            # We use the cleaned item name as a unique signature to keep questionable items separate
-            clean_sig = simple_clean_item(item)
-            # KEY CHANGE: Removed facts_val from key
-            pre_group_key = (
-                f"LOW_CONF|{llm_brand}|{clean_sig}|"
-                f"{market_val}|{mpack_val}|{norm.get('size', 'UNKNOWN')}"
-            )
-        
+        pre_group_key = doc_keys.get(id(d))
+        if pre_group_key is None: continue
+        if affected is not None and pre_group_key not in affected: continue
         pre_groups.setdefault(pre_group_key, []).append(d)
+    if incremental:
+        print(f"Flow 2 (incremental): {len(affected)} pre-group keys touched, re-clustering {sum(len(v) for v in pre_groups.values())} docs")
+    # Pre-group keys that ended up in each cluster (the fuzzy stage below merges LOW_CONF keys)
+    group_keys = {k: [k] for k in pre_groups}
 
     # ✅ UNIVERSAL FUZZY MERGE STAGE: Merge similar LOW_CONF single items within same (Market+Pack+Facts) context
     # This specifically targets items the AI failed to group, like Kinder or residual Typos.
@@ -1486,6 +1784,7 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
                     # print(f"   [FUZZY MATCH] Merging LOW_CONF Item '{item2}' INTO '{item1}' (Sim: {sim:.2f})")
                     pre_groups[k1].extend(pre_groups[k2])
                     pre_groups.pop(k2)
+                    group_keys[k1].extend(group_keys.pop(k2))
                     merged_this_ctx.add(k2)
                     merged_count += 1
     
@@ -1499,17 +1798,21 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
 
     # ✅ REMOVED: Size Tolerance (5g Rules) - Now using exact size in pre_group_key
     final_groups_list = list(pre_groups.values())
+    final_group_keys = [group_keys[k] for k in pre_groups]
 
     # print(f"Clusters formed after size tolerance: {len(final_groups_list)}")
 
 
     
     # ✅ BATCH PROCESSING: Prepare batch operations
-    batch_operations = []
+    master_records = []
     merged_single_stock_ids = []
     
-    # Process Groups
-    for cluster_docs in final_groups_list:
+    # Process Groups (with full documents; two-pass runs fetch them here in batches)
+    clusters = zip(final_groups_list, final_group_keys)
+    if FLOW2_TWO_PASS_LOAD:
+        clusters = iter_full_clusters(src_col, clusters)
+    for cluster_docs, cluster_keys in clusters:
         # 🚨 POST-MERGE AUDIT (HARD RULE 2.0)
         # Block if multiple distinct product lines have somehow leaked into the same group
         valid_subgroups = [cluster_docs] # Default is one group
@@ -1594,7 +1897,7 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
 
             # Single item - no merge
             if len(group_docs) == 1:
-                doc = copy.deepcopy(group_docs[0])
+                doc = dict(group_docs[0])
                 doc.pop("_id", None)
                 doc.pop("_norm", None)
                 
@@ -1614,7 +1917,7 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
                 doc["llm_confidence_min"] = norm.get("confidence", 0)
 
                 # Generate merge_id AFTER BRAND is set
-                doc["merge_id"] = doc.get("merge_id") or f"{doc['BRAND']}_{uuid.uuid4().hex}"
+                doc["merge_id"] = doc.get("merge_id") or flow2_merge_id(doc["BRAND"], cluster_keys, group_docs)
 
                 extend_merge_metadata(
                     base=doc,
@@ -1624,22 +1927,18 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
                 )
                 
                 doc["sheet_name"] = "wersel_match"
+                doc["pre_group_keys"] = cluster_keys
                 
                 # Clean up internal fields
                 redundant_f2 = [
                     "duplicate_documents", "duplicate_ids", "duplicate_items", 
-                    "duplicate_upcs", "is_duplicate_count"
+                    "duplicate_upcs", "is_duplicate_count", "is_merged_status"
                 ]
                 for k in list(doc.keys()):
                     if k.startswith("_") or k.lower().startswith("unnamed") or k in redundant_f2:
                         doc.pop(k)
                 
-                # Add to batch operations
-                batch_operations.append(UpdateOne(
-                    {"merge_id": doc["merge_id"], "sheet_name": doc["sheet_name"]},
-                    {"$set": doc},
-                    upsert=True
-                ))
+                master_records.append(doc)
                 continue
 
             # Merge multiple items
@@ -1658,7 +1957,7 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
             # ✅ AUDIT LOG: Show the business logic in action
             print(f"   [Logic] Merging {len(group_docs)} items under Main_UPC: {leader_doc.get('UPC')} ({leader_doc.get('ITEM')[:30]}...) | MAT Stock: {get_mat_val(leader_doc)}")
 
-            base = copy.deepcopy(leader_doc)
+            base = dict(leader_doc)
             base.pop("_id", None)
             base.pop("_norm", None)
             
@@ -1700,7 +1999,7 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
                 base["BRAND"] = norm.get("brand") or "UNKNOWN"
             
             # Generate merge_id AFTER BRAND is set
-            base["merge_id"] = base.get("merge_id") or f"{base['BRAND']}_{uuid.uuid4().hex}"
+            base["merge_id"] = base.get("merge_id") or flow2_merge_id(base["BRAND"], cluster_keys, group_docs)
             
             # Store LLM extracted fields (flavour, variant, size are not duplicates)
             base["flavour"] = norm.get("flavour") or base.get("VARIANT", "") or ""
@@ -1720,22 +2019,18 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
 
             # Add sheet_name for tracking
             base["sheet_name"] = "wersel_match"
+            base["pre_group_keys"] = cluster_keys
             
             # Clean up internal fields (Keep BRAND as it is critical for dashboard)
             redundant_keys = [
                 "VARIANT", "NRMSIZE", "duplicate_documents", "duplicate_ids", 
-                "duplicate_items", "duplicate_upcs", "is_duplicate_count"
+                "duplicate_items", "duplicate_upcs", "is_duplicate_count", "is_merged_status"
             ]
             for k in list(base.keys()):
                 if k.startswith("_") or k.lower().startswith("unnamed") or k in redundant_keys:
                     base.pop(k)
 
-            # Add to batch operations
-            batch_operations.append(UpdateOne(
-                {"merge_id": base["merge_id"], "sheet_name": base["sheet_name"]},
-                {"$set": base},
-                upsert=True
-            ))
+            master_records.append(base)
             
             # ✅ Collect IDs for status update
             if len(group_docs) > 1:
@@ -1743,22 +2038,50 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
                     if "_id" in d:
                         merged_single_stock_ids.append(d["_id"])
     
-    # ✅ BATCH WRITE: Write in batches of 5000 (5x faster than 1000)
-    if batch_operations:
-        batch_size = 5000  # Increased from 1000 for faster saves
-        total_ops = len(batch_operations)
+    # Identical clusters split by the audit would share an id
+    suffix_repeated_merge_ids(master_records)
+
+    # ✅ DIFF: Compare with the stored records (all of them, or those of touched or in-scope pre-groups)
+    scope_keys = affected if incremental else slice_keys
+    if scope_keys is not None:
+        scope_keys = sorted(scope_keys)
+        existing_filters = [{"sheet_name": FIXED_SHEET_NAME, "pre_group_keys": {"$in": scope_keys[i:i + 5000]}}
+                            for i in range(0, len(scope_keys), 5000)]
+    else:
+        existing_filters = [{}]
+    batch_operations, stale_ids, unchanged_records = diff_master_records(tgt_col, master_records, existing_filters)
+    print(f"Flow 2: {len(master_records)} master records built: {len(batch_operations)} new or changed, "
+          f"{unchanged_records} unchanged, {len(stale_ids)} outdated")
+
+    deleted_records = replace_master_slice(tgt_col, batch_operations, stale_ids) if brands else None
+    if deleted_records is None:
+        deleted_records = 0
+        for i in range(0, len(stale_ids), 5000):
+            deleted_records += tgt_col.delete_many({"_id": {"$in": stale_ids[i:i + 5000]}}).deleted_count
+
+        # ✅ BATCH WRITE: Write in batches of 5000 (5x faster than 1000)
+        if batch_operations:
+            batch_size = 5000  # Increased from 1000 for faster saves
+            total_ops = len(batch_operations)
         
-        for i in range(0, total_ops, batch_size):
-            # ✅ REMOVED disconnect check here - was causing premature stops
-            # Let the save complete even if frontend disconnects
+            for i in range(0, total_ops, batch_size):
+                # ✅ REMOVED disconnect check here - was causing premature stops
+                # Let the save complete even if frontend disconnects
             
-            batch = batch_operations[i:i + batch_size]
-            # ✅ ULTRA FAST: ordered=False allows parallel execution
-            tgt_col.bulk_write(batch, ordered=False)
-            print(f"Flow 2: Saved batch: {min(i + batch_size, total_ops)}/{total_ops} master records")
+                batch = batch_operations[i:i + batch_size]
+                # ✅ ULTRA FAST: ordered=False allows parallel execution
+                tgt_col.bulk_write(batch, ordered=False)
+                print(f"Flow 2: Saved batch: {min(i + batch_size, total_ops)}/{total_ops} master records")
             
-            await asyncio.sleep(0)  # Yield for event loop
+                await asyncio.sleep(0)  # Yield for event loop
             
+
+    # Merge flags are recomputed for every re-clustered doc
+    reclustered_ids = [d["_id"] for cluster in final_groups_list for d in cluster if "_id" in d]
+    for i in range(0, len(reclustered_ids), 5000):
+        src_col.update_many({"_id": {"$in": reclustered_ids[i:i + 5000]}, "is_merged_status": True},
+                            {"$set": {"is_merged_status": False}})
+
     # ✅ UPDATE SINGLE STOCK: Mark items as merged
     if merged_single_stock_ids:
         print(f"Flow 2: Flagging {len(merged_single_stock_ids)} items as merged in {SINGLE_STOCK_COL}...")
@@ -1767,9 +2090,38 @@ async def process_llm_mastering_flow_2(sheet_name, request=None):
             {"$set": {"is_merged_status": True}}
         )
 
-    
+    if entries is None:
+        entries = mastering_state_entries(docs, norm_map, doc_keys)
+    state_written, state_removed = save_mastering_state(state, entries)
+    print(f"Flow 2: Mastering state updated ({state_written} entries written, {state_removed} removed)")
+    
+    memory = None
+    if tracing:
+        memory = {"loading": "two_pass" if FLOW2_TWO_PASS_LOAD else "single_pass",
+                  "load_held_mb": round(load_memory[0] / (1024 * 1024), 2),
+                  "load_peak_mb": round(load_memory[1] / (1024 * 1024), 2),
+                  "run_peak_mb": round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)}
+        print(f"Flow 2: Memory ({memory['loading']}): {memory['load_held_mb']} MB held after load, "
+              f"peaks {memory['load_peak_mb']} MB (load) / {memory['run_peak_mb']} MB (run)")
+
+    prompt_summary = prompt_stats.summary()
+    if prompt_summary["calls"]:
+        print(f"Flow 2: Avg prompt tokens {prompt_summary['avg_prompt_tokens_before']} -> "
+              f"{prompt_summary['avg_prompt_tokens_after']} ({prompt_summary['reduction_pct']}% smaller)")
+
     return {
         "total_processed": len(docs),
         "clusters_created": len(final_groups_list),
+        "mode": "incremental" if incremental else "full",
+        "brands": brands or None,
+        "memory": memory,
+        "touched_pre_group_keys": len(affected) if incremental else None,
+        "master_records_written": len(batch_operations),
+        "master_records_unchanged": unchanged_records,
+        "master_records_deleted": deleted_records,
+        "llm_usage_run_id": run_id,
+        "prompt_tokens": prompt_summary,
+        "cascade": dict(cascade_stats) if flow2_client.cascade_enabled() else None,
+        "semantic_reuse": {"policy": SEMANTIC_CACHE_POLICY, **semantic_stats},
         "status": "Success | All items processed and merged according to client rules."
     }
@@ -4,7 +4,13 @@ import re
 import json
 from glob import glob
 from datetime import datetime
-from llm_client import flow2_client
+try:
+    from backend.llm_client import flow2_client
+    from backend.llm_schemas import QA_AUDIT_MATCH_SCHEMA, DIAGNOSTIC_SCHEMA
+except ImportError:
+    # Fallback: if running from backend folder (share the same client singletons either way)
+    from llm_client import flow2_client
+    from llm_schemas import QA_AUDIT_MATCH_SCHEMA, DIAGNOSTIC_SCHEMA
 
 # Configuration
 GAP_DATA_DIR = r'D:\Final_Input_and_Output\output_directry\7-ELEVEN_GAP_DATA'
@@ -92,11 +98,9 @@ def process_audit_logic(df, brand_name="Uploaded_File"):
                        "\n".join([f"- ID: {c['id']}, Name: {c['name']} ({c['size']}g)" for c in potential_candidates])
             
             try:
-                response = flow2_client.chat_completion(system_prompt, user_msg)
-                if "```json" in response:
-                    response = response.split("```json")[1].split("```")[0].strip()
-                
-                llm_res = json.loads(response)
+                llm_res = flow2_client.chat_json(system_prompt, user_msg, schema=QA_AUDIT_MATCH_SCHEMA, flow="qa_audit")
+                if llm_res is None:
+                    raise ValueError("No schema-valid response from LLM")
                 
                 if llm_res.get('matched'):
                     match_name = next((c['name'] for c in potential_candidates if str(c['id']) == str(llm_res.get('match_id'))), 'Unknown')
@@ -180,14 +184,10 @@ def get_audit_diagnostic(gap_desc, gap_size, hero_candidates):
         
         user_msg = f"GAP Item: {gap_desc} ({gap_size}g)\nCandidates:\n{json.dumps(hero_candidates)}"
         
-        response = flow2_client.chat_completion(system_prompt, user_msg)
-        
-        if "```json" in response:
-            response = response.split("```json")[1].split("```")[0].strip()
-        elif "```" in response:
-            response = response.split("```")[1].split("```")[0].strip()
-            
-        return json.loads(response)
+        report = flow2_client.chat_json(system_prompt, user_msg, schema=DIAGNOSTIC_SCHEMA, flow="qa_audit")
+        if report is None:
+            raise ValueError("No schema-valid response from LLM")
+        return report
     except Exception as e:
         return {
             "diagnosis": f"Error generating diagnostic: {str(e)}",
@@ -207,7 +207,7 @@ def translate_audit_text(text):
         Keep terms like "GAP", "Hero", "UPC", "Brand", "Flavour" in English or phonetical Tamil.
         Tone: Professional and precise.
         """
-        translation = flow2_client.chat_completion(system_prompt, text)
+        translation = flow2_client.chat_completion(system_prompt, text, flow="translate")
         return translation
     except Exception as e:
         return f"Translation Error: {str(e)}"
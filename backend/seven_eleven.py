@@ -0,0 +1,492 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+from pymongo import UpdateOne
+
+try:
+    from backend.database import get_collection
+    from backend.llm_cache import seven_eleven_cache, SEVEN_ELEVEN_CACHE_COL, current_origin_version
+except ImportError:
+    # Fallback: if imported from inside the backend folder
+    from database import get_collection
+    from llm_cache import seven_eleven_cache, SEVEN_ELEVEN_CACHE_COL, current_origin_version
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  7-Eleven ArticleDescription enrichment (prompt, LLM call, cache helpers)
+#  Used by the /upload/7eleven import in main.py, cache_admin and fix_711_cache.py.
+# ─────────────────────────────────────────────────────────────────────────────
+
+SEVEN_ELEVEN_COL      = "7-eleven_data"
+# Change sets written by incremental imports; consumed by mapping_analysis.run_mapping(changes=...)
+SEVEN_ELEVEN_CHANGES_COL = "7-eleven_changes"
+# LLM-enriched fields copied from 7-eleven_llm_cache results into 7-eleven_data rows
+ENRICHMENT_FIELDS = ("ArticleDescription_clean", "7E_Nrmsize", "7E_MPack", "7E_Variant", "7E_product_form", "7E_flavour")
+# Fields that are not part of an article's content (ignored when diffing imports)
+_HOUSEKEEPING_FIELDS = {"_id", "imported_at", "source_file", "row_hash", "deleted", "deleted_at", "synced_at"}
+# Concurrent LLM enrichments during an import (the shared LLM scheduler still caps total in-flight calls)
+SEVEN_ELEVEN_LLM_WORKERS = int(os.getenv("SEVEN_ELEVEN_LLM_WORKERS", "10"))
+# Descriptions per LLM request on import (1 = one call per description)
+SEVEN_ELEVEN_LLM_BATCH_SIZE = int(os.getenv("SEVEN_ELEVEN_LLM_BATCH_SIZE", "1"))
+# Excel rows parsed, enriched and written per step of an import
+SEVEN_ELEVEN_CHUNK_ROWS = int(os.getenv("SEVEN_ELEVEN_CHUNK_ROWS", "5000"))
+
+_stats_lock = threading.Lock()
+
+# 7-Eleven prompt: extract exactly the 6 fields needed
+_711_SYSTEM_PROMPT = """
+You are a strict FMCG Data Scientist. Your task is to extract attributes from Malaysian 7-Eleven descriptions with 100% consistency.
+
+Rules for Logic Stability:
+1. ArticleDescription_clean: MUST remove all weights (e.g., 130g) and pack sizes (e.g., 10s, X10). Clean readable product name in Sentence-case.
+2. 7E_Nrmsize: MUST be only the number + Unit (G/ML). For packs like 10Gx10, extract "10G".
+3. 7E_MPack: If "X<n>", "<n>s", or "<n>x" exists, extract as "X<n>". Default "X1".
+4. 7E_Variant: Extract sub-brands or product series (e.g., DAIRY MILK, MARIE, DUCHESS, CHUNKY, 4D). If it's a distinct sub-line, it is a Variant.
+5. 7E_product_form: Extract the physical form (e.g., BISCUITS, CHIPS, GUMMY, CAKE, WAFER, STICK, CRACKER). If not clear or not applicable, "NONE".
+6. 7E_flavour: Identify the primary taste or flavour profile (e.g., CHOCOLATE, ALMOND, MIXED NUT, FRUIT&NUT, BLACKFOREST, LEMON, STRAWBERRY, BBQ, SALTED, SEAWEED, SPICY, HOT & SPICY, CHEESE, KIMCHI, HONEY BUTTER, SALTED EGG, TIRAMISU). 
+    - IMPORTANT: If it's a plain/standard version, ALWAYS use "ORIGINAL". Do not use "PLAIN" or "REGULAR".
+
+Constraint: 
+- Consistency is priority. 
+- Return ONLY a valid JSON object. No conversational text.
+
+Return format:
+{
+  "ArticleDescription_clean": "...",
+  "7E_Nrmsize": "...",
+  "7E_MPack": "X1",
+  "7E_Variant": "NONE",
+  "7E_product_form": "NONE",
+  "7E_flavour": "NONE"
+}
+
+Examples:
+- "Hwa Tai Lemon Treat 100g" -> {"ArticleDescription_clean": "Hwa Tai Lemon Treat", "7E_Nrmsize": "100G", "7E_MPack": "X1", "7E_Variant": "NONE", "7E_product_form": "NONE", "7E_flavour": "LEMON"}
+- "Hwa Tai Luxury Cracker Vegetable 148g" -> {"ArticleDescription_clean": "Hwa Tai Luxury Cracker", "7E_Nrmsize": "148G", "7E_MPack": "X1", "7E_Variant": "NONE", "7E_product_form": "CRACKER", "7E_flavour": "VEGETABLE"}
+- "ecoBrowns x KL Brice Seaweed 40g" -> {"ArticleDescription_clean": "ecoBrowns x KL Brice Seaweed", "7E_Nrmsize": "40G", "7E_MPack": "X1", "7E_Variant": "KL BRICE", "7E_product_form": "NONE", "7E_flavour": "SEAWEED"}
+- "Kokiri Wow Seaweed Original 12g" -> {"ArticleDescription_clean": "Kokiri Wow Seaweed", "7E_Nrmsize": "12G", "7E_MPack": "X1", "7E_Variant": "NONE", "7E_product_form": "NONE", "7E_flavour": "SEAWEED/ORIGINAL"}
+- "7-Eleven Potato Sticks Salted 50g" -> {"ArticleDescription_clean": "7-Eleven Potato Sticks Salted", "7E_Nrmsize": "50G", "7E_MPack": "X1", "7E_Variant": "NONE", "7E_product_form": "STICK", "7E_flavour": "SALTED"}
+"""
+
+def _711_fallback(article_description: str) -> dict:
+    return {
+        "ArticleDescription_clean": article_description,
+        "7E_Nrmsize":     None,
+        "7E_MPack":       "X1",
+        "7E_Variant":     "NONE",
+        "7E_product_form":"NONE",
+        "7E_flavour":     "NONE",
+    }
+
+
+def _attempt_counter(stats: dict = None):
+    """chat_json on_attempt hook counting every request sent (schema retries included) into stats["llm_calls"]."""
+    if stats is None:
+        return None
+
+    def count():
+        with _stats_lock:
+            stats["llm_calls"] += 1
+    return count
+
+
+def _request_711_llm(article_description: str, stats: dict = None) -> dict | None:
+    """Call OpenAI with only the ArticleDescription; None if no schema-valid reply came back."""
+    from backend.llm_client import flow2_client
+    from backend.llm_schemas import SEVEN_ELEVEN_SCHEMA
+
+    user_msg = f'ARTICLE DESCRIPTION: "{article_description}"\n\nReturn JSON only.'
+    try:
+        data = flow2_client.chat_json(
+            system_prompt=_711_SYSTEM_PROMPT,
+            user_message=user_msg,
+            schema=SEVEN_ELEVEN_SCHEMA,
+            flow="7eleven",
+            temperature=0,
+            on_attempt=_attempt_counter(stats),
+        )
+    except Exception as e:
+        print(f"  LLM call failed for '{article_description}': {e}")
+        return None
+    if not data:
+        return None
+    for k, v in _711_fallback(article_description).items():
+        data.setdefault(k, v)
+    return data
+
+
+_711_BATCH_INSTRUCTIONS = """
+Batch mode: the user message lists several ArticleDescriptions, one per line as <id>. "<description>".
+Apply the rules above to each description independently and return
+{"items": [{"id": <id>, "ArticleDescription_clean": "...", "7E_Nrmsize": "...", "7E_MPack": "X1", "7E_Variant": "NONE", "7E_product_form": "NONE", "7E_flavour": "NONE"}, ...]}
+with exactly one object per id.
+"""
+
+
+def _request_711_llm_batch(descriptions: list, stats: dict = None) -> dict:
+    """
+    One LLM call for many ArticleDescriptions. Each returned item is validated on its own against
+    the six-field schema; returns {description: result} for the valid ones only.
+    """
+    from backend.llm_client import flow2_client
+    from backend.llm_schemas import SEVEN_ELEVEN_SCHEMA, SEVEN_ELEVEN_BATCH_SCHEMA, validate_against_schema
+
+    user_msg = "\n".join(f'{i}. "{desc}"' for i, desc in enumerate(descriptions))
+    data = flow2_client.chat_json(
+        system_prompt=_711_SYSTEM_PROMPT + _711_BATCH_INSTRUCTIONS,
+        user_message=user_msg + "\n\nReturn JSON only.",
+        schema=SEVEN_ELEVEN_BATCH_SCHEMA,
+        flow="7eleven",
+        temperature=0,
+        max_tokens=200 + 120 * len(descriptions),
+        on_attempt=_attempt_counter(stats),
+    )
+    results = {}
+    for item in (data or {}).get("items", []):
+        idx = item.get("id")
+        if not isinstance(idx, int) or not 0 <= idx < len(descriptions):
+            continue
+        fields = {k: item[k] for k in SEVEN_ELEVEN_SCHEMA["properties"] if k in item}
+        if validate_against_schema(fields, SEVEN_ELEVEN_SCHEMA):
+            continue
+        results[descriptions[idx]] = fields
+    return results
+
+
+def _call_711_llm(article_description: str) -> tuple:
+    """
+    Call OpenAI with only the ArticleDescription. Returns (the 6 extra fields, failed): on failure
+    the defaults from _711_fallback with failed=True, which callers must not cache.
+    """
+    data = _request_711_llm(article_description)
+    if data is None:
+        return _711_fallback(article_description), True
+    return data, False
+
+
+def new_batch_stats() -> dict:
+    """
+    Counters of one import, filled by its _enrich_711_batch workers (llm_calls = requests actually
+    sent, schema retries included).
+    """
+    return {"llm_calls": 0, "batches": 0, "batch_items": 0, "retried_individually": 0}
+
+
+def _enrich_711(article_description: str, stats: dict = None) -> tuple:
+    """
+    Import worker: LLM-enrich one description and queue it for the cache bulk write.
+    Failed calls are not cached, so the next import retries them.
+    Returns (description, result, failed).
+    """
+    data = _request_711_llm(article_description, stats)
+    if data is None:
+        return article_description, _711_fallback(article_description), 1
+    _save_711_cache(article_description, data)
+    return article_description, data, 0
+
+
+def _enrich_711_batch(descriptions: list, stats: dict = None) -> list:
+    """
+    Import worker for a chunk of descriptions: one batched LLM call, results fanned out into
+    7-eleven_llm_cache; items missing or invalid in the reply are retried one by one.
+    `stats` (new_batch_stats) collects the counters of the calling import.
+    Returns [(description, result, failed), ...].
+    """
+    if len(descriptions) == 1:
+        return [_enrich_711(descriptions[0], stats)]
+    try:
+        results = _request_711_llm_batch(descriptions, stats)
+    except Exception as e:
+        print(f"  Batched LLM call failed for {len(descriptions)} descriptions: {e}")
+        results = {}
+
+    out = []
+    for desc in descriptions:
+        data = results.get(desc)
+        if data is None:
+            out.append(_enrich_711(desc, stats))
+            continue
+        for k, v in _711_fallback(desc).items():
+            data.setdefault(k, v)
+        _save_711_cache(desc, data, tier="batch")
+        out.append((desc, data, 0))
+    if stats is not None:
+        with _stats_lock:
+            stats["batches"] += 1
+            stats["batch_items"] += len(results)
+            stats["retried_individually"] += len(descriptions) - len(results)
+    return out
+
+
+def _get_711_cache(article_description: str) -> dict | None:
+    """Return cached LLM result for this ArticleDescription (memory, then 7-eleven_llm_cache), or None."""
+    return seven_eleven_cache.get(article_description)
+
+
+def _save_711_cache(article_description: str, result: dict, tier: str = "single"):
+    """Cache LLM result in memory and queue the upsert into 7-eleven_llm_cache."""
+    seven_eleven_cache.put(article_description, result, cached_at=datetime.utcnow().isoformat(), tier=tier,
+                           version=_711_cache_version(article_description))
+
+
+def _711_cache_version(article_description: str, stored: dict = None) -> dict:
+    """
+    Fingerprint (prompt + model of the strong tier that serves 7-Eleven calls) stamped on every
+    7-eleven_llm_cache entry. Entries copied from the shared attributes follow their origin's.
+    """
+    copied = current_origin_version(stored)
+    if copied:
+        return copied
+    if not _711_VERSION:
+        from backend.llm_client import flow2_client
+        # Filled in one update: import worker threads may call this concurrently on the first cache writes
+        _711_VERSION.update({
+            "prompt_hash": hashlib.sha1(_711_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12],
+            "model": flow2_client.pool.fingerprint() if flow2_client.pool else "none",
+        })
+    return dict(_711_VERSION)
+
+
+_711_VERSION = {}
+seven_eleven_cache.set_versioning(_711_cache_version)
+
+
+def _revalidate_711_cache(limit: int = 100) -> dict:
+    """Re-enrich up to `limit` 7-Eleven cache entries whose prompt/model fingerprint is outdated."""
+    descriptions = seven_eleven_cache.pop_stale(limit)
+    if len(descriptions) < limit:
+        descriptions += [d for d in seven_eleven_cache.scan_stale(limit - len(descriptions)) if d not in descriptions]
+    # The stale entries stay in place until a fresh result replaces them; failures keep serving them
+    failed = []
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for desc, result in zip(descriptions, executor.map(_request_711_llm, descriptions)):
+            if result is None:
+                failed.append(desc)
+            else:
+                _save_711_cache(desc, result)
+    seven_eleven_cache.flush()
+    return {"revalidated": len(descriptions) - len(failed), "failed": len(failed), "items": descriptions[:20],
+            "failed_items": failed[:20]}
+
+
+def sync_data_with_cache(descriptions: list = None, dry_run: bool = False) -> dict:
+    """
+    Copy the six enrichment fields from 7-eleven_llm_cache into 7-eleven_data in one server-side
+    aggregation ($lookup on the trimmed ArticleDescription, $merge back by _id). Only rows whose
+    fields differ from their cache entry are written. Run after any cache fix.
+
+    Updated rows get a fresh row_hash and are recorded as a change set (source "cache_sync"), so
+    /pipeline/run-mapping?incremental=true re-maps them.
+
+    descriptions: limit the sync to these ArticleDescriptions (compared trimmed); None syncs every row.
+    dry_run:      only count the rows that would change.
+    """
+    started = time.time()
+    seven_eleven_cache.flush()  # pending cache writes must be visible to $lookup
+    pipeline = [
+        {"$match": {"deleted": {"$ne": True}}},
+        {"$project": {"ArticleDescription": 1, **{f: 1 for f in ENRICHMENT_FIELDS},
+                      "_cache_key": {"$trim": {"input": {"$toString": "$ArticleDescription"}}}}},
+    ]
+    if descriptions is not None:
+        pipeline.append({"$match": {"_cache_key": {"$in": list({str(d).strip() for d in descriptions})}}})
+    pipeline += [
+        {"$lookup": {"from": SEVEN_ELEVEN_CACHE_COL, "localField": "_cache_key",
+                     "foreignField": "article_description", "as": "_cache"}},
+        {"$unwind": "$_cache"},
+        {"$match": {"_cache.result": {"$type": "object"},
+                    "$expr": {"$or": [{"$ne": [f"${f}", f"$_cache.result.{f}"]} for f in ENRICHMENT_FIELDS]}}},
+    ]
+    data_coll = get_collection(SEVEN_ELEVEN_COL)
+    if dry_run:
+        counted = list(data_coll.aggregate(pipeline + [{"$count": "rows"}]))
+        return {"dry_run": True, "rows_to_update": counted[0]["rows"] if counted else 0,
+                "seconds": round(time.time() - started, 3)}
+
+    # Ids of the rows about to change: the $merge below is limited to them, then they are re-hashed
+    touched = [d["_id"] for d in data_coll.aggregate(pipeline + [{"$project": {"_id": 1}}], allowDiskUse=True)]
+    merge = [
+        {"$project": {**{f: f"$_cache.result.{f}" for f in ENRICHMENT_FIELDS},
+                      "synced_at": {"$ifNull": ["$_cache.fixed_at", "$_cache.cached_at"]}}},
+        {"$merge": {"into": SEVEN_ELEVEN_COL, "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+    ]
+    for i in range(0, len(touched), 10000):
+        data_coll.aggregate([{"$match": {"_id": {"$in": touched[i:i + 10000]}}}] + pipeline + merge,
+                            allowDiskUse=True)
+    change_set_ids = _record_synced_rows(data_coll, touched)
+    seconds = round(time.time() - started, 3)
+    print(f"🔄 Synced {len(touched)} rows of {SEVEN_ELEVEN_COL} <- {SEVEN_ELEVEN_CACHE_COL} in {seconds}s")
+    return {"dry_run": False, "rows_updated": len(touched), "change_set_ids": change_set_ids, "seconds": seconds}
+
+
+def _record_synced_rows(data_coll, ids: list) -> list:
+    """Fresh row_hash for rows updated by a cache sync, plus a change set per article key field. Returns their ids."""
+    changes_by_field = {}
+    ops = []
+    for i in range(0, len(ids), 5000):
+        for doc in data_coll.find({"_id": {"$in": ids[i:i + 5000]}}):
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"row_hash": row_hash(doc)}}))
+            key_field = import_key_field(doc)
+            if key_field and doc.get(key_field) is not None:
+                changes_by_field.setdefault(key_field, new_change_set())["updated"].append(doc[key_field])
+    for i in range(0, len(ops), 1000):
+        data_coll.bulk_write(ops[i:i + 1000], ordered=False)
+    return [record_change_set(key_field, changes, "cache_sync") for key_field, changes in changes_by_field.items()]
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Streaming import parsing
+# ─────────────────────────────────────────────────────────────────────────────
+
+def iter_article_chunks(fileobj, chunk_rows: int = SEVEN_ELEVEN_CHUNK_ROWS):
+    """
+    Yield the first sheet of an uploaded workbook as DataFrames of up to `chunk_rows` rows.
+    openpyxl's read-only mode parses rows lazily, so memory stays flat as the file grows.
+    Formats it cannot open (legacy .xls) are read with pandas and sliced.
+    """
+    try:
+        from openpyxl import load_workbook
+        workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    except Exception:
+        fileobj.seek(0)
+        df = pd.read_excel(fileobj)
+        for i in range(0, len(df), chunk_rows):
+            yield df.iloc[i:i + chunk_rows]
+        return
+
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c).strip() if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+        width = len(columns)
+        batch = []
+        for row in rows:
+            batch.append(row[:width] + (None,) * (width - len(row)))
+            if len(batch) >= chunk_rows:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame.from_records(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Incremental import: diff against 7-eleven_data by ArticleCode / GTIN
+# ─────────────────────────────────────────────────────────────────────────────
+
+def import_key_field(columns) -> str | None:
+    """Column that identifies an article across imports (ArticleCode, Article_Code, then GTIN)."""
+    return next((c for c in ("ArticleCode", "Article_Code", "GTIN") if c in columns), None)
+
+
+def canonical_key(value) -> str | None:
+    """
+    Article key as compared across imports: stripped string, integral floats without ".0"
+    (a key column with blank cells is read as float64, so 12345 arrives as 12345.0). None if missing.
+    """
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip() or None
+
+
+def normalize_import_key(doc: dict, key_field: str):
+    """
+    Store an integral float key (see canonical_key) as int, so replace and incremental imports
+    store and hash the same value. Call before row_hash; returns the key.
+    """
+    key = doc.get(key_field)
+    if isinstance(key, float) and key.is_integer():
+        key = doc[key_field] = int(key)
+    return key
+
+
+def row_hash(doc: dict) -> str:
+    """Content hash of an imported row (Excel columns + LLM fields, housekeeping excluded)."""
+    content = {k: v for k, v in doc.items() if k not in _HOUSEKEEPING_FIELDS}
+    return hashlib.md5(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def load_import_state(data_coll, key_field: str) -> dict:
+    """Stored articles keyed by canonical_key: {key_field, row_hash, deleted} (the baseline for diff_import)."""
+    existing = {}
+    for doc in data_coll.find({key_field: {"$ne": None}}, {"_id": 0, key_field: 1, "row_hash": 1, "deleted": 1}):
+        key = canonical_key(doc[key_field])
+        if key is not None:
+            existing[key] = doc
+    return existing
+
+
+def new_change_set() -> dict:
+    return {"inserted": [], "updated": [], "deleted": [], "unchanged": 0, "without_key": 0}
+
+
+def diff_import(existing: dict, key_field: str, docs: list, changes: dict) -> list:
+    """
+    Compare a chunk of freshly built import docs with the stored articles (load_import_state).
+    Returns UpdateOne writes for inserted / updated articles and records their keys in `changes`;
+    articles whose content hash is unchanged are not written.
+    """
+    ops = []
+    for doc in docs:
+        str_key = canonical_key(doc.get(key_field))
+        if str_key is None:
+            changes["without_key"] += 1
+            continue
+        key = normalize_import_key(doc, key_field)
+        doc["row_hash"] = row_hash(doc)
+        current = existing.get(str_key)
+        if current and not current.get("deleted") and current.get("row_hash") == doc["row_hash"]:
+            changes["unchanged"] += 1
+            continue
+        changes["updated" if current and not current.get("deleted") else "inserted"].append(key)
+        ops.append(UpdateOne({key_field: key}, {"$set": doc, "$unset": {"deleted": "", "deleted_at": ""}},
+                             upsert=True))
+    return ops
+
+
+def tombstone_ops(existing: dict, key_field: str, seen: set, changes: dict, deleted_at: str) -> list:
+    """Tombstones (deleted=True; mapping skips them) for stored articles missing from the file (canonical_key values in `seen`)."""
+    ops = []
+    for str_key, current in existing.items():
+        if str_key in seen or current.get("deleted"):
+            continue
+        changes["deleted"].append(current[key_field])
+        ops.append(UpdateOne({key_field: current[key_field]}, {"$set": {"deleted": True, "deleted_at": deleted_at}}))
+    return ops
+
+
+def record_change_set(key_field: str, changes: dict, source_file: str) -> str | None:
+    """Store an incremental import's change set for the mapping stage. Returns its id (None if empty)."""
+    if not (changes["inserted"] or changes["updated"] or changes["deleted"]):
+        return None
+    change_set_id = f"7e-{datetime.utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:6]}"
+    get_collection(SEVEN_ELEVEN_CHANGES_COL).insert_one({
+        "change_set_id": change_set_id,
+        "created_at": datetime.utcnow().isoformat(),
+        "source_file": source_file,
+        "key_field": key_field,
+        "inserted": changes["inserted"],
+        "updated": changes["updated"],
+        "deleted": changes["deleted"],
+        "mapped_at": None,
+    })
+    return change_set_id
+
+
+def supersede_change_sets(reason: str) -> int:
+    """Mark pending change sets as handled (a full import or full mapping run covers them)."""
+    return get_collection(SEVEN_ELEVEN_CHANGES_COL).update_many(
+        {"mapped_at": None}, {"$set": {"mapped_at": datetime.utcnow().isoformat(), "superseded_by": reason}}
+    ).modified_count
@@ -0,0 +1,104 @@
+import sys
+import os
+import random
+
+# Add the project root (parent of backend) to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from backend.processor import (
+    flow2_merge_id, suffix_repeated_merge_ids, diff_master_records, master_record_hash, affected_pre_group_keys,
+)
+
+OREO_KEY = "HI_CONF|OREO|THINS|COOKIE|VANILLA|REGULAR|REG|MY|X1|137G"
+POCKY_KEY = "HI_CONF|POCKY|STICKS|STICK|STRAWBERRY|REGULAR|REG|MY|X1|40G"
+
+
+class FakeMasterCollection:
+    """Stored master records; find() returns those whose pre_group_keys match the $in filter."""
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        keys = (query.get("pre_group_keys") or {}).get("$in")
+        return [d for d in self.docs if keys is None or set(d["pre_group_keys"]) & set(keys)]
+
+
+def _record(merge_id, keys, item, mat):
+    return {"merge_id": merge_id, "sheet_name": "wersel_match", "pre_group_keys": keys, "ITEM": item, "MAT": mat}
+
+
+def _stored(_id, record):
+    return {"_id": _id, **record, "content_hash": master_record_hash(record)}
+
+
+def test_merge_id_is_stable_across_input_order():
+    docs = [{"UPC": "111", "ITEM": "OREO THINS VANILLA"}, {"UPC": "222", "ITEM": "OREO THINS VANILLA 6X"},
+            {"UPC": None, "ITEM": "OREO THINS VANILLA PROMO"}]
+    merge_id = flow2_merge_id("OREO", [OREO_KEY], docs)
+
+    assert merge_id.startswith("OREO_")
+    assert flow2_merge_id("OREO", [OREO_KEY], list(reversed(docs))) == merge_id
+    assert flow2_merge_id("OREO", [OREO_KEY], docs[:2]) != merge_id
+
+
+def test_repeated_merge_ids_get_suffixes_in_content_order():
+    records = [_record("OREO_abc", [OREO_KEY], "OREO THINS VANILLA", mat) for mat in (5, 7, 9)]
+    expected = None
+    for seed in range(5):
+        shuffled = [dict(r) for r in records]
+        random.Random(seed).shuffle(shuffled)
+        suffix_repeated_merge_ids(shuffled)
+        ids = {r["MAT"]: r["merge_id"] for r in shuffled}
+        assert sorted(ids.values()) == ["OREO_abc", "OREO_abc_1", "OREO_abc_2"]
+        expected = expected or ids
+        assert ids == expected
+
+
+def test_diff_writes_only_changed_clusters_and_deletes_unbuilt_ones():
+    unchanged = _record("OREO_1", [OREO_KEY], "OREO THINS VANILLA", 5)
+    changed = _record("POCKY_1", [POCKY_KEY], "POCKY STICKS STRAWBERRY", 3)
+    tgt_col = FakeMasterCollection([_stored(1, unchanged), _stored(2, changed),
+                                    _stored(3, _record("OREO_old", [OREO_KEY], "OREO THINS VANILLA", 1))])
+    records = [dict(unchanged), dict(changed, MAT=4), _record("OREO_2", [OREO_KEY], "OREO THINS CHOCO", 2)]
+
+    ops, stale_ids, unchanged_count = diff_master_records(
+        tgt_col, records, [{"sheet_name": "wersel_match", "pre_group_keys": {"$in": [OREO_KEY, POCKY_KEY]}}])
+
+    assert unchanged_count == 1
+    assert sorted(op._filter["merge_id"] for op in ops) == ["OREO_2", "POCKY_1"]
+    assert stale_ids == [3]
+
+
+def test_diff_ignores_records_outside_the_touched_pre_groups():
+    pocky = _record("POCKY_1", [POCKY_KEY], "POCKY STICKS STRAWBERRY", 3)
+    tgt_col = FakeMasterCollection([_stored(1, pocky)])
+
+    ops, stale_ids, unchanged_count = diff_master_records(
+        tgt_col, [_record("OREO_1", [OREO_KEY], "OREO THINS VANILLA", 5)],
+        [{"sheet_name": "wersel_match", "pre_group_keys": {"$in": [OREO_KEY]}}])
+
+    assert [op._filter["merge_id"] for op in ops] == ["OREO_1"]
+    assert stale_ids == []
+    assert unchanged_count == 0
+
+
+def test_affected_pre_group_keys():
+    low_a = "LOW_CONF|MAMEE|MAMEE MONSTER|MY|X1|25G"
+    low_b = "LOW_CONF|MAMEE|MAMEE MONSTAR|MY|X1|25G"
+    low_other = "LOW_CONF|JULIES|JULIES PEANUT|MY|X1|100G"
+
+    def entry(key, count=1, norm_hash="n"):
+        return {"count": count, "pre_group_key": key, "norm_hash": norm_hash}
+
+    state = {"oreo": entry(OREO_KEY), "pocky": entry(POCKY_KEY), "gone": entry("HI_CONF|KITKAT|X"),
+             "mamee": entry(low_a), "julies": entry(low_other)}
+    entries = {"oreo": entry(OREO_KEY),                      # unchanged
+               "pocky": entry(POCKY_KEY, norm_hash="new"),   # re-extracted
+               "mamee": entry(low_a), "julies": entry(low_other),
+               "monstar": entry(low_b)}                      # new LOW_CONF doc
+
+    affected = affected_pre_group_keys(state, entries)
+
+    # low_a shares the fuzzy-merge context (market, pack, size) of the new LOW_CONF key
+    assert affected == {POCKY_KEY, "HI_CONF|KITKAT|X", low_b, low_a}
@@ -0,0 +1,108 @@
+import sys
+import os
+
+import pandas as pd
+
+# Add the project root (parent of backend) to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from backend.seven_eleven import canonical_key, diff_import, tombstone_ops, new_change_set, row_hash, normalize_import_key
+
+
+def _article(code, desc, price):
+    return {"ArticleCode": code, "ArticleDescription": desc, "Price": price, "7E_MPack": "X1"}
+
+
+def _stored(*docs, deleted=()):
+    """load_import_state() output for the given docs (keys in `deleted` are tombstoned)."""
+    return {str(d["ArticleCode"]): {"ArticleCode": d["ArticleCode"], "row_hash": row_hash(d),
+                                    "deleted": d["ArticleCode"] in deleted}
+            for d in docs}
+
+
+def test_diff_import_writes_only_new_and_changed_articles():
+    existing = _stored(_article(1, "Oreo 133g", 3.5), _article(2, "Pocky 40g", 2.9))
+    docs = [_article(1, "Oreo 133g", 3.5),       # unchanged
+            _article(2, "Pocky 40g", 3.2),       # price changed
+            _article(3, "Julie's 100g", 4.0),    # new
+            _article(None, "No code 10g", 1.0)]  # no key
+    changes = new_change_set()
+
+    ops = diff_import(existing, "ArticleCode", docs, changes)
+
+    assert [op._filter for op in ops] == [{"ArticleCode": 2}, {"ArticleCode": 3}]
+    assert changes["updated"] == [2]
+    assert changes["inserted"] == [3]
+    assert changes["unchanged"] == 1
+    assert changes["without_key"] == 1
+    assert all(op._upsert and op._doc["$set"]["row_hash"] for op in ops)
+
+
+def test_diff_import_revives_a_tombstoned_article():
+    doc = _article(7, "Hwa Tai Lemon Treat 100g", 2.0)
+    existing = _stored(doc, deleted=(7,))
+    changes = new_change_set()
+
+    ops = diff_import(existing, "ArticleCode", [dict(doc)], changes)
+
+    assert changes["inserted"] == [7]
+    assert ops[0]._doc["$unset"] == {"deleted": "", "deleted_at": ""}
+
+
+def test_tombstone_ops_deletes_articles_missing_from_the_file():
+    existing = _stored(_article(1, "Oreo 133g", 3.5), _article(2, "Pocky 40g", 2.9),
+                       _article(3, "Julie's 100g", 4.0), deleted=(3,))
+    changes = new_change_set()
+
+    ops = tombstone_ops(existing, "ArticleCode", {"1"}, changes, "2026-01-01T00:00:00")
+
+    assert changes["deleted"] == [2]  # 3 was already tombstoned
+    assert len(ops) == 1
+    assert ops[0]._filter == {"ArticleCode": 2}
+    assert ops[0]._doc == {"$set": {"deleted": True, "deleted_at": "2026-01-01T00:00:00"}}
+
+
+def test_chunk_with_blank_article_code_keeps_stored_articles():
+    # A blank ArticleCode turns the chunk's column into float64 (12345 -> 12345.0)
+    stored = _article(12345, "Oreo 133g", 3.5)
+    existing = _stored(stored)
+    chunk = pd.DataFrame([_article(12345, "Oreo 133g", 3.5), _article(None, "No code 10g", 1.0)])
+    assert chunk["ArticleCode"].dtype == "float64"
+
+    keys = chunk["ArticleCode"].map(canonical_key)
+    seen = set(keys[keys.notna()])
+    changes = new_change_set()
+    docs = chunk.astype(object).where(pd.notna(chunk), None).to_dict("records")
+    ops = diff_import(existing, "ArticleCode", docs, changes)
+    ops += tombstone_ops(existing, "ArticleCode", seen, changes, "2026-01-01T00:00:00")
+
+    assert seen == {"12345"}
+    assert ops == []
+    assert changes["unchanged"] == 1
+    assert changes["deleted"] == []
+
+
+def test_replace_import_stores_keys_like_incremental_diff():
+    # Replace mode on a chunk with blank codes, then the same rows imported incrementally
+    stored = []
+    for doc in (_article(12345.0, "Oreo 133g", 3.5), _article(67890.0, "Pocky 40g", 2.9)):
+        normalize_import_key(doc, "ArticleCode")
+        doc["row_hash"] = row_hash(doc)
+        stored.append(doc)
+    existing = {canonical_key(d["ArticleCode"]): d for d in stored}
+    changes = new_change_set()
+
+    ops = diff_import(existing, "ArticleCode", [_article(12345.0, "Oreo 133g", 3.5),
+                                                _article(67890, "Pocky 40g", 2.9)], changes)
+
+    assert stored[0]["ArticleCode"] == 12345
+    assert ops == []
+    assert changes["unchanged"] == 2
+
+
+def test_canonical_key():
+    assert canonical_key(12345.0) == canonical_key(12345) == canonical_key(" 12345 ") == "12345"
+    assert canonical_key(float("nan")) is None
+    assert canonical_key(None) is None
+    assert canonical_key("0123456789012") == "0123456789012"
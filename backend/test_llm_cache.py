@@ -0,0 +1,56 @@
+import sys
+import os
+
+# Add the project root (parent of backend) to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from backend import llm_cache
+from backend.llm_cache import TwoTierLLMCache
+
+CURRENT = {"prompt_hash": "p2", "model": "strong:gpt"}
+OUTDATED = {"prompt_hash": "p1", "model": "strong:gpt"}
+
+
+class FakeCollection:
+    """The find_one / find($in) subset of a MongoDB collection the cache reads with."""
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find_one(self, query, projection=None):
+        return next((dict(d) for d in self.docs if d["item"] == query["item"]), None)
+
+    def find(self, query, projection=None):
+        keys = query.get("item", {}).get("$in")
+        return [dict(d) for d in self.docs if keys is None or d["item"] in keys]
+
+
+def _cache(monkeypatch, policy):
+    docs = [{"item": "OREO THINS", "result": {"brand": "OREO"}, "version": OUTDATED},
+            {"item": "POCKY STICKS", "result": {"brand": "POCKY"}, "version": CURRENT}]
+    monkeypatch.setattr(llm_cache, "get_collection", lambda name: FakeCollection(docs))
+    return TwoTierLLMCache("TEST_CACHE", "item", version_fn=lambda key, stored=None: CURRENT, policy=policy)
+
+
+def test_stale_ok_serves_outdated_entries_and_queues_them_for_revalidation(monkeypatch):
+    cache = _cache(monkeypatch, "stale_ok")
+
+    assert cache.get("OREO THINS") == {"brand": "OREO"}
+    assert cache.get_many(["POCKY STICKS"]) == {"POCKY STICKS": {"brand": "POCKY"}}
+    assert cache.counters["stale_served"] == 1
+    assert cache.pop_stale() == ["OREO THINS"]
+
+
+def test_strict_treats_outdated_entries_as_misses(monkeypatch):
+    cache = _cache(monkeypatch, "strict")
+
+    assert cache.get("OREO THINS") is None
+    assert cache.get_many(["OREO THINS", "POCKY STICKS"]) == {"POCKY STICKS": {"brand": "POCKY"}}
+    assert cache.counters["version_misses"] == 2
+    assert cache.pop_stale() == []
+
+
+def test_scan_stale_finds_outdated_entries(monkeypatch):
+    cache = _cache(monkeypatch, "stale_ok")
+
+    assert cache.scan_stale() == ["OREO THINS"]
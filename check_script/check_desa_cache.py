@@ -1,14 +1,6 @@
-from pymongo import MongoClient
-import os
-from dotenv import load_dotenv
+from backend.processor import flow2_cache
 
 def check():
-    load_dotenv()
-    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-    client = MongoClient(mongo_uri)
-    db = client['fmcg_mastering']
-    coll = db['LLM_CACHE_STORAGE']
-    
     items = [
         "DESA ALPHA COOKIES OAT600G",
         "DESA ALPHA COOKIES KOKO KRUNCH 600G",
@@ -16,19 +8,19 @@ def check():
         "DESA ALPHA COOKIES CHOCO MELON SEED 600G"
     ]
     
+    # One $in lookup through the shared two-tier cache (results as Flow 2 sees them, guards applied)
+    results = flow2_cache.get_many(items)
     for it in items:
-        res = coll.find_one({"item": it})
+        res = results.get(it)
         print(f"Item: {it}")
         if res:
-            print(f"  Brand: {res['result'].get('brand')}")
-            print(f"  Flavour: {res['result'].get('flavour')}")
-            print(f"  Variant: {res['result'].get('variant')}")
-            print(f"  Line: {res['result'].get('product_line')}")
+            print(f"  Brand: {res.get('brand')}")
+            print(f"  Flavour: {res.get('flavour')}")
+            print(f"  Variant: {res.get('variant')}")
+            print(f"  Line: {res.get('product_line')}")
         else:
             print("  Not Found in Cache")
         print("-" * 20)
-    
-    client.close()
 
 if __name__ == "__main__":
     check()
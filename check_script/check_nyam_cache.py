@@ -1,9 +1,4 @@
-from pymongo import MongoClient
-import json
-
-client = MongoClient("mongodb://localhost:27017/")
-db = client["fmcg_mastering"]
-cache_coll = db["LLM_CACHE_STORAGE"]
+from backend.processor import flow2_cache
 
 items_to_check = [
     "ARNOTT'S NYAM NYAM RICE CRISPY 22 GM",
@@ -15,11 +10,12 @@ items_to_check = [
 ]
 
 print("=== LLM CACHE CHECK FOR NYAM NYAM ===")
+# One $in lookup through the shared two-tier cache (results as Flow 2 sees them, guards applied)
+results = flow2_cache.get_many(items_to_check)
 with open("d:/FMCG_Dashboard/nyam_results.txt", "w") as f:
     for item in items_to_check:
-        doc = cache_coll.find_one({"item": item})
-        if doc:
-            res = doc.get("result", {})
+        res = results.get(item)
+        if res:
             f.write(f"[{item}] -> BASE: {res.get('base_item')} | FLV: {res.get('flavour')} | CONF: {res.get('confidence')}\n")
         else:
             f.write(f"[{item}] -> MISSING\n")
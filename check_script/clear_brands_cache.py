@@ -1,10 +1,10 @@
-from pymongo import MongoClient
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from backend.cache_admin import invalidate
 
 def clear_cache():
-    client = MongoClient("mongodb://localhost:27017/")
-    db = client["fmcg_mastering"]
-    coll = db["LLM_CACHE_STORAGE"]
-    
     keywords = [
         'NABATI', 'OREO', 'GLICO', 'LOTTE', 'KINDER', 'WALKERS', 
         'MARYLAND', 'NABISCO', 'MERBA', 'VOORTMAN', 'ARNOTTS', 
@@ -15,9 +15,9 @@ def clear_cache():
     total_deleted = 0
     
     for kw in keywords:
-        res = coll.delete_many({"item": {"$regex": kw, "$options": "i"}})
-        total_deleted += res.deleted_count
-        print(f"Keyword '{kw}': Deleted {res.deleted_count} entries")
+        deleted = invalidate("flow2", regex=kw)["caches"]["flow2"].get("deleted", 0)
+        total_deleted += deleted
+        print(f"Keyword '{kw}': Deleted {deleted} entries")
         
     print(f"\nCleanup finished. Total entries removed: {total_deleted}")
 
@@ -1,9 +1,6 @@
-from backend.database import get_collection
-import re
+from backend.cache_admin import invalidate
 
 def clear_targeted_cache():
-    cache_coll = get_collection("LLM_CACHE_STORAGE")
-    
     # Target patterns for items that were wrongly merged or need re-processing
     targets = [
         "DIP DIP", "BUBBLE PUFF", "HELLO PANDA", "NYAM NYAM",
@@ -16,24 +13,21 @@ def clear_targeted_cache():
     print("🔍 Searching for targeted cache entries...")
     
     # Using regex to find items containing these keywords
-    query = {"item": {"$regex": "|".join(targets), "$options": "i"}}
-    
-    # Count before deletion
-    count = cache_coll.count_documents(query)
+    pattern = "|".join(targets)
+    preview = invalidate("flow2", regex=pattern, dry_run=True)["caches"]["flow2"]
+    count = preview["matched"]
     print(f"📦 Found {count} matching entries in cache.")
     
     if count > 0:
-        # Fetch names for logging
-        docs = list(cache_coll.find(query, {"item": 1}))
         print("\nItems to be cleared:")
-        for d in docs[:10]:
-            print(f" - {d['item']}")
-        if len(docs) > 10:
-            print(f" ... and {len(docs) - 10} more.")
+        for item in preview["sample"][:10]:
+            print(f" - {item}")
+        if count > 10:
+            print(f" ... and {count - 10} more.")
             
         # Delete them
-        result = cache_coll.delete_many(query)
-        print(f"\n✅ Deleted {result.deleted_count} entries from LLM_CACHE_STORAGE.")
+        result = invalidate("flow2", regex=pattern)["caches"]["flow2"]
+        print(f"\n✅ Deleted {result['deleted']} entries from LLM_CACHE_STORAGE.")
     else:
         print("ℹ️ No matching entries found in cache.")
 
@@ -1,14 +1,6 @@
-from pymongo import MongoClient
-import os
-from dotenv import load_dotenv
-
-load_dotenv('backend/.env')
+from backend.cache_snapshot import lookup
 
 def verify_cache():
-    client = MongoClient(os.getenv("MONGO_URI"))
-    db = client["fmcg_mastering"]
-    cache = db["LLM_CACHE_STORAGE"]
-    
     test_items = [
         "MUNCHYS OATKRUNCH S/BERRY&B/CURR 390G(15X26GM)",
         "MUNCHYS OATKRUNCH NUTTY CHOCO 390G(15X26GM)",
@@ -17,10 +9,11 @@ def verify_cache():
     ]
     
     print("Verifying Cache for problematic items:\n")
+    # Live cache: the snapshot may predate the fix being verified
+    results = lookup("flow2", test_items, live=True)
     for item in test_items:
-        res = cache.find_one({"item": item})
-        if res:
-            data = res.get("result", {})
+        data = results.get(item)
+        if data:
             print(f"Item: {item}")
             print(f"  Brand: {data.get('brand')}")
             print(f"  Flavour: {data.get('flavour')}")
@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import os
 import sys
@@ -12,7 +13,7 @@ from backend.processor import process_llm_mastering_flow_2
 from gap_analysis_7eleven import run_gap_analysis
 from export_final_reports import export_reports
 
-async def main():
+async def main(batch_backend=None):
     print("🚀 Starting FULL RE-RUN of the FMCG Pipeline...")
     
     # 0. Phase 0: Reprocess Flow 1 (Raw -> Single Stock)
@@ -25,6 +26,17 @@ async def main():
         print(f"❌ Error during Phase 0: {e}")
         return
 
+    # 0b. Optional: fill the LLM cache with one offline batch job instead of synchronous calls
+    if batch_backend:
+        print(f"\n--- Phase 0b: Batch LLM Extraction ({batch_backend}) ---")
+        try:
+            from backend.llm_batch import run_flow2_batch
+            result = run_flow2_batch("wersel_match", backend=batch_backend)
+            print(f"✅ Phase 0b Complete: {result}")
+        except Exception as e:
+            # Not fatal: Flow 2 falls back to synchronous calls for anything not cached
+            print(f"⚠️ Batch extraction failed, continuing with synchronous Flow 2: {e}")
+
     # 1. Flow 2 Mastering (Calculates Main_UPC based on highest stock)
     print("\n--- Phase 1: LLM Mastering (Flow 2) ---")
     try:
@@ -56,4 +68,8 @@ async def main():
     print("\n🎉 ALL PHASES COMPLETED SUCCESSFULLY.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Full re-run of the FMCG pipeline")
+    parser.add_argument("--batch", nargs="?", const="azure", choices=["azure", "local"],
+                        help="Pre-fill the LLM cache with an offline batch job (default backend: azure)")
+    args = parser.parse_args()
+    asyncio.run(main(batch_backend=args.batch))
@@ -3,7 +3,6 @@ import pandas as pd
 from pymongo import MongoClient
 from dotenv import load_dotenv
 import sys
-import json
 from pathlib import Path
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
@@ -11,6 +10,14 @@ from concurrent.futures import ThreadPoolExecutor
 # Add backend to path to import LLMClient
 sys.path.append(os.path.join(os.getcwd(), 'backend'))
 from llm_client import flow2_client
+from llm_schemas import SEVEN_ELEVEN_SCHEMA
+
+# Batch replies are wrapped in an object so JSON mode / schema output can be used
+SEVEN_ELEVEN_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {"items": {"type": "array", "items": SEVEN_ELEVEN_SCHEMA}},
+    "required": ["items"],
+}
 
 def extract_attributes_batch(descriptions):
     system_prompt = f"""
@@ -38,23 +45,16 @@ def extract_attributes_batch(descriptions):
     - "Miaow Miaow Mas Udang 50g" -> {{"ArticleDescription_clean": "Miaow Miaow", "7E_Nrmsize": "50G", "7E_MPack": "X1", "7E_Variant": "NONE", "7E_product_form": "SNACK", "7E_flavour": "PRAWN"}}
     - "Oreo Mini Choclate Cookie 20.4g 10s" -> {{"ArticleDescription_clean": "Oreo", "7E_Nrmsize": "20.4G", "7E_MPack": "X10", "7E_Variant": "MINI", "7E_product_form": "COOKIES", "7E_flavour": "CHOCOLATE"}}
 
-    STRICT: Return a JSON array of {len(descriptions)} objects.
+    STRICT: Return a JSON object {{"items": [...]}} whose "items" array holds exactly {len(descriptions)} objects, in input order.
     """
     
     user_message = f"Extract from these descriptions:\n" + "\n".join([f"- {d}" for d in descriptions])
     
     try:
-        response = flow2_client.chat_completion(system_prompt, user_message)
-        if "```json" in response:
-            response = response.split("```json")[1].split("```")[0].strip()
-        elif "```" in response:
-            parts = response.split("```")
-            if len(parts) >= 3:
-                response = parts[1].strip()
-            else:
-                response = response.strip()
-            
-        return json.loads(response)
+        response = flow2_client.chat_json(system_prompt, user_message, schema=SEVEN_ELEVEN_BATCH_SCHEMA, flow="7eleven")
+        if response is None:
+            raise ValueError("No schema-valid response from LLM")
+        return response["items"]
     except Exception as e:
         print(f"Error in extraction: {e}")
         return []
@@ -15,6 +15,7 @@ DB_NAME = "fmcg_mastering"
 COL_7E = "7-eleven_data"
 COL_MASTER = "master_stock_data"
 COL_RESULTS = "mapping_results"
+COL_CHANGES = "7-eleven_changes"  # change sets written by incremental 7-Eleven imports
 
 def connect_db():
     """Connects to MongoDB and returns the database and collections."""
@@ -267,16 +268,209 @@ def get_nielsen_lookup(coll_master):
 
     return lookup_upc, lookup_attr
 
-def run_mapping():
-    db, coll_7e, coll_master, coll_results = connect_db()
+def map_article(item_7e, upc_lookup_n, attr_lookup_n, unique_b_n):
+    """Map one 7-Eleven article against the Nielsen lookups. Returns (result row, best Nielsen doc or None)."""
+    gtin = str(item_7e.get("GTIN"))
+    # Normalize GTIN for comparison (handle 13-digit vs 8-digit)
+    gtin_clean = re.sub(r"^0+", "", gtin)
+    
+    brand_7e = normalize_text(item_7e.get("L4_Description_Brand"))
+    variant_7e = normalize_text(item_7e.get("7E_Variant"))
+    flavour_7e = normalize_text(item_7e.get("7E_flavour") or "NA")
+    size_7e = parse_size(item_7e.get("7E_Nrmsize"))
+    mpack_7e = normalize_text(item_7e.get("7E_MPack") or "X1")
+
+    # Prepare strong detection keywords BEFORE UPC Match
+    full_desc_7e = normalize_text(item_7e.get("ArticleDescription") or "")
+    desc_clean = normalize_text(item_7e.get("ArticleDescription") or "")
+    desc_keywords = [w for w in desc_clean.split() if len(w) > 2 and w not in ["JULIES", "JULIE'S", "BISCUIT"]]
+    
+    # Determine relevant sub-brands for the target brand
+    target_br_norm = normalize_text(brand_7e)
+    target_sbs = []
+    # Check synonyms
+    if target_br_norm in BRAND_RULES:
+        target_sbs = BRAND_RULES[target_br_norm].get("SUB_BRANDS", [])
+    else:
+        for br_key, syns in BRAND_SYNONYMS.items():
+            if target_br_norm in syns or target_br_norm == br_key:
+                target_sbs = BRAND_RULES.get(br_key, {}).get("SUB_BRANDS", [])
+                break
+                
+    strong_7e = [kw for kw in desc_keywords if kw in target_sbs or kw in FLAVOUR_CONFLICTS]
+    detected_sub_brand_7e = next((sb for sb in target_sbs if sb in full_desc_7e), None)
+    detected_flavour_7e = next((fl for fl in FLAVOUR_CONFLICTS if fl in full_desc_7e), flavour_7e)
+
+    potential_nielsen = []
+    
+    # --- Search Level 1: UPC Match (Flexible) ---
+    if gtin:
+        # Try exact match
+        if gtin in upc_lookup_n:
+            match_cand = upc_lookup_n[gtin]
+            if validate_match(full_desc_7e, match_cand, detected_flavour_7e, detected_sub_brand_7e, brand_7e, is_upc_match=True):
+                potential_nielsen.append(match_cand)
+        # Try suffix match (STRICTER: Require at least 10 digits for suffix to avoid accidental short overlap)
+        elif len(gtin_clean) >= 10:
+            found_match = None
+            for u_n in upc_lookup_n.keys():
+                u_n_clean = re.sub(r"^0+", "", u_n)
+                if len(u_n_clean) >= 10 and (gtin_clean.endswith(u_n_clean) or u_n_clean.endswith(gtin_clean)):
+                    cand = upc_lookup_n[u_n]
+                    if validate_match(full_desc_7e, cand, detected_flavour_7e, detected_sub_brand_7e, brand_7e, is_upc_match=True):
+                        found_match = cand
+                        break
+            if found_match:
+                potential_nielsen.append(found_match)
+    
+    if not potential_nielsen:
+        search_brands = [brand_7e] + BRAND_SYNONYMS.get(brand_7e, [])
+        search_variants = [variant_7e] + VARIANT_SYNONYMS.get(variant_7e, [])
+        
+        for br in search_brands:
+            # 1. Standard Attribute Match
+            for vr in search_variants:
+                key = (br, vr, mpack_7e)
+                potential_matches = attr_lookup_n.get(key, [])
+                for m in potential_matches:
+                    m_size = parse_size(m.get("NRMSIZE") or m.get("size"))
+                    if abs(m_size - size_7e) <= 5.0:
+                        if validate_match(full_desc_7e, m, detected_flavour_7e, detected_sub_brand_7e, brand_7e):
+                            if m not in potential_nielsen:
+                                potential_nielsen.append(m)
+
+            # 2. Smart Fallback for "NONE/NA/NONE" variants
+            if not potential_nielsen and (variant_7e == "NA" or variant_7e == "NONE" or flavour_7e != "NA" or "NONE" in variant_7e):
+                brand_only_key = f"BRAND_ONLY_{(br, mpack_7e)}"
+                pattern_matches = attr_lookup_n.get(brand_only_key, [])
+                
+                for m in pattern_matches:
+                    m_size = parse_size(m.get("NRMSIZE") or m.get("size"))
+                    if abs(m_size - size_7e) <= 5.0:
+                        if validate_match(full_desc_7e, m, detected_flavour_7e, detected_sub_brand_7e, brand_7e):
+                            # For fallback, we ALSO want some keyword overlap
+                            m_full = normalize_text(f"{m.get('ITEM')} {m.get('variant')}")
+                            matched_kws = [kw for kw in desc_keywords if kw in m_full]
+                            has_strong_match = any(kw in strong_7e for kw in matched_kws)
+                            
+                            if has_strong_match or len(matched_kws) >= 2:
+                                if m not in potential_nielsen:
+                                    potential_nielsen.append(m)
+
+    # Try 3: Fuzzy Brand Fallback (MPack MUST still match)
+    if not potential_nielsen and brand_7e != "NA" and len(brand_7e) > 3:
+        best_brand = None
+        best_score = 0
+        for b_n in unique_b_n:
+            score = levenshtein_similarity(brand_7e, b_n)
+            if score > best_score:
+                best_score = score
+                best_brand = b_n
+        
+        if best_score >= 0.85:
+            # Still check variant or fallback with the fuzzy brand
+            brand_only_key = f"BRAND_ONLY_{(best_brand, mpack_7e)}"
+            matches = attr_lookup_n.get(brand_only_key, [])
+            for m in matches:
+                m_size = parse_size(m.get("NRMSIZE") or m.get("size"))
+                if abs(m_size - size_7e) <= 5.0:
+                    if validate_match(full_desc_7e, m, detected_flavour_7e, detected_sub_brand_7e, brand_7e):
+                        if m not in potential_nielsen:
+                            potential_nielsen.append(m)
+
+    # 2. Results Preparation
+    match_level = "GAP"
+    match_type = "No Match Found"
+    best_nielsen = None
+    
+    if potential_nielsen:
+        potential_nielsen.sort(key=lambda x: parse_mat(x), reverse=True)
+        best_nielsen = potential_nielsen[0]
+        
+        if any(str(m.get("UPC")).strip().lstrip('0') == gtin_clean for m in potential_nielsen):
+            match_level = "LEVEL_1"
+            match_type = "Exact/Flexible UPC Match"
+        else:
+            match_level = "LEVEL_2"
+            match_type = "Attribute/Flavour Match"
+
+    mapping_upcs = "; ".join(list(set(str(m.get("UPC")) for m in potential_nielsen if m.get("UPC"))))
+    mapping_items = "; ".join(list(set(str(m.get("ITEM")) for m in potential_nielsen if m.get("ITEM"))))
     
-    # Clear previous results
-    coll_results.delete_many({})
-    print("Previous results cleared.")
+    # Prepare results in the specific order requested by the user
+    res_dict = {
+        "UPC": best_nielsen.get("UPC") if best_nielsen else None,
+        "ITEM": best_nielsen.get("ITEM") if best_nielsen else None,
+        "Main_UPC": best_nielsen.get("UPC") if best_nielsen else None,
+        "UPC_GroupName": mapping_items,
+        # Files keyed by Article_Code (no ArticleCode column) still fill ArticleCode: incremental
+        # runs replace an article's previous result rows by this field (see run_mapping)
+        "ArticleCode": item_7e.get("ArticleCode", item_7e.get("Article_Code")),
+        "GTIN": gtin,
+        "Article_Description": item_7e.get("ArticleDescription"),
+        # Remaining context fields
+        "Source": "7-Eleven",
+        "7E_Brand": item_7e.get("L4_Description_Brand"),
+        "7E_Variant": item_7e.get("7E_Variant"),
+        "7E_Flavour": item_7e.get("7E_flavour"),
+        "7E_Size": item_7e.get("7E_Nrmsize"),
+        "Match_Level": match_level,
+        "Match_Type": match_type,
+        "Matched_MAT": best_nielsen.get("MAT Nov'24") if best_nielsen else 0,
+        "MAPPING_UPC": mapping_upcs
+    }
+    return res_dict, best_nielsen
+
+
+def pending_changes():
+    """Merge the change sets of incremental 7-Eleven imports that have not been mapped yet (None if none)."""
+    db, _, _, _ = connect_db()
+    change_sets = list(db[COL_CHANGES].find({"mapped_at": None}).sort("created_at", 1))
+    if not change_sets:
+        return None
+    key_fields = {cs["key_field"] for cs in change_sets}
+    keys = {}
+    for cs in change_sets:
+        for key in cs["inserted"] + cs["updated"] + cs["deleted"]:
+            keys[str(key)] = key
+    return {
+        "change_set_ids": [cs["change_set_id"] for cs in change_sets],
+        # Change sets keyed on different columns cannot be merged; run_mapping falls back to a full run
+        "key_field": key_fields.pop() if len(key_fields) == 1 else None,
+        "keys": list(keys.values()),
+    }
+
+
+def run_mapping(changes=None):
+    """
+    Map 7-Eleven articles to Nielsen master stock, then rebuild the market-gap rows.
+
+    changes: merged change set from pending_changes(). Only those articles are re-mapped (their
+             previous rows are replaced, tombstoned articles just dropped); None re-maps everything.
+    """
+    db, coll_7e, coll_master, coll_results = connect_db()
+    live = {"deleted": {"$ne": True}}  # skip articles tombstoned by incremental imports
+    if changes and not changes.get("key_field"):
+        print("Change sets use different article keys; running a full mapping instead.")
+        changes = None
+
+    if changes is None:
+        # Clear previous results
+        coll_results.delete_many({})
+        print("Previous results cleared.")
+        query = live
+    else:
+        key_field = changes["key_field"]
+        result_field = "GTIN" if key_field == "GTIN" else "ArticleCode"
+        result_keys = [str(k) for k in changes["keys"]] if key_field == "GTIN" else changes["keys"]
+        removed = coll_results.delete_many({"Source": "7-Eleven", result_field: {"$in": result_keys}}).deleted_count
+        coll_results.delete_many({"Match_Level": "MARKET_HERO"})
+        print(f"Incremental mapping: {len(changes['keys'])} changed articles, {removed} previous results replaced.")
+        query = {**live, key_field: {"$in": changes["keys"]}}
     
     # 1. Load Data
     upc_lookup_n, attr_lookup_n = get_nielsen_lookup(coll_master)
-    seven_eleven_docs = list(coll_7e.find())
+    seven_eleven_docs = list(coll_7e.find(query))
     print(f"Starting mapping for {len(seven_eleven_docs)} 7-Eleven Articles...")
     
     # Pre-calculate unique brands for fuzzy matching performance
@@ -293,156 +487,16 @@ def run_mapping():
         if count % 500 == 0:
             print(f"  Processed {count}/{len(seven_eleven_docs)}...")
         
-        gtin = str(item_7e.get("GTIN"))
-        # Normalize GTIN for comparison (handle 13-digit vs 8-digit)
-        gtin_clean = re.sub(r"^0+", "", gtin)
-        
-        brand_7e = normalize_text(item_7e.get("L4_Description_Brand"))
-        variant_7e = normalize_text(item_7e.get("7E_Variant"))
-        flavour_7e = normalize_text(item_7e.get("7E_flavour") or "NA")
-        size_7e = parse_size(item_7e.get("7E_Nrmsize"))
-        mpack_7e = normalize_text(item_7e.get("7E_MPack") or "X1")
-
-        # Prepare strong detection keywords BEFORE UPC Match
-        full_desc_7e = normalize_text(item_7e.get("ArticleDescription") or "")
-        desc_clean = normalize_text(item_7e.get("ArticleDescription") or "")
-        desc_keywords = [w for w in desc_clean.split() if len(w) > 2 and w not in ["JULIES", "JULIE'S", "BISCUIT"]]
-        
-        # Determine relevant sub-brands for the target brand
-        target_br_norm = normalize_text(brand_7e)
-        target_sbs = []
-        # Check synonyms
-        if target_br_norm in BRAND_RULES:
-            target_sbs = BRAND_RULES[target_br_norm].get("SUB_BRANDS", [])
-        else:
-            for br_key, syns in BRAND_SYNONYMS.items():
-                if target_br_norm in syns or target_br_norm == br_key:
-                    target_sbs = BRAND_RULES.get(br_key, {}).get("SUB_BRANDS", [])
-                    break
-                    
-        strong_7e = [kw for kw in desc_keywords if kw in target_sbs or kw in FLAVOUR_CONFLICTS]
-        detected_sub_brand_7e = next((sb for sb in target_sbs if sb in full_desc_7e), None)
-        detected_flavour_7e = next((fl for fl in FLAVOUR_CONFLICTS if fl in full_desc_7e), flavour_7e)
-
-        potential_nielsen = []
-        
-        # --- Search Level 1: UPC Match (Flexible) ---
-        if gtin:
-            # Try exact match
-            if gtin in upc_lookup_n:
-                match_cand = upc_lookup_n[gtin]
-                if validate_match(full_desc_7e, match_cand, detected_flavour_7e, detected_sub_brand_7e, brand_7e, is_upc_match=True):
-                    potential_nielsen.append(match_cand)
-            # Try suffix match (STRICTER: Require at least 10 digits for suffix to avoid accidental short overlap)
-            elif len(gtin_clean) >= 10:
-                found_match = None
-                for u_n in upc_lookup_n.keys():
-                    u_n_clean = re.sub(r"^0+", "", u_n)
-                    if len(u_n_clean) >= 10 and (gtin_clean.endswith(u_n_clean) or u_n_clean.endswith(gtin_clean)):
-                        cand = upc_lookup_n[u_n]
-                        if validate_match(full_desc_7e, cand, detected_flavour_7e, detected_sub_brand_7e, brand_7e, is_upc_match=True):
-                            found_match = cand
-                            break
-                if found_match:
-                    potential_nielsen.append(found_match)
-        
-        if not potential_nielsen:
-            search_brands = [brand_7e] + BRAND_SYNONYMS.get(brand_7e, [])
-            search_variants = [variant_7e] + VARIANT_SYNONYMS.get(variant_7e, [])
-            
-            for br in search_brands:
-                # 1. Standard Attribute Match
-                for vr in search_variants:
-                    key = (br, vr, mpack_7e)
-                    potential_matches = attr_lookup_n.get(key, [])
-                    for m in potential_matches:
-                        m_size = parse_size(m.get("NRMSIZE") or m.get("size"))
-                        if abs(m_size - size_7e) <= 5.0:
-                            if validate_match(full_desc_7e, m, detected_flavour_7e, detected_sub_brand_7e, brand_7e):
-                                if m not in potential_nielsen:
-                                    potential_nielsen.append(m)
-
-                # 2. Smart Fallback for "NONE/NA/NONE" variants
-                if not potential_nielsen and (variant_7e == "NA" or variant_7e == "NONE" or flavour_7e != "NA" or "NONE" in variant_7e):
-                    brand_only_key = f"BRAND_ONLY_{(br, mpack_7e)}"
-                    pattern_matches = attr_lookup_n.get(brand_only_key, [])
-                    
-                    for m in pattern_matches:
-                        m_size = parse_size(m.get("NRMSIZE") or m.get("size"))
-                        if abs(m_size - size_7e) <= 5.0:
-                            if validate_match(full_desc_7e, m, detected_flavour_7e, detected_sub_brand_7e, brand_7e):
-                                # For fallback, we ALSO want some keyword overlap
-                                m_full = normalize_text(f"{m.get('ITEM')} {m.get('variant')}")
-                                matched_kws = [kw for kw in desc_keywords if kw in m_full]
-                                has_strong_match = any(kw in strong_7e for kw in matched_kws)
-                                
-                                if has_strong_match or len(matched_kws) >= 2:
-                                    if m not in potential_nielsen:
-                                        potential_nielsen.append(m)
-
-        # Try 3: Fuzzy Brand Fallback (MPack MUST still match)
-        if not potential_nielsen and brand_7e != "NA" and len(brand_7e) > 3:
-            best_brand = None
-            best_score = 0
-            for b_n in unique_b_n:
-                score = levenshtein_similarity(brand_7e, b_n)
-                if score > best_score:
-                    best_score = score
-                    best_brand = b_n
-            
-            if best_score >= 0.85:
-                # Still check variant or fallback with the fuzzy brand
-                brand_only_key = f"BRAND_ONLY_{(best_brand, mpack_7e)}"
-                matches = attr_lookup_n.get(brand_only_key, [])
-                for m in matches:
-                    m_size = parse_size(m.get("NRMSIZE") or m.get("size"))
-                    if abs(m_size - size_7e) <= 5.0:
-                        if validate_match(full_desc_7e, m, detected_flavour_7e, detected_sub_brand_7e, brand_7e):
-                            if m not in potential_nielsen:
-                                potential_nielsen.append(m)
-
-        # 2. Results Preparation
-        match_level = "GAP"
-        match_type = "No Match Found"
-        best_nielsen = None
-        
-        if potential_nielsen:
-            potential_nielsen.sort(key=lambda x: parse_mat(x), reverse=True)
-            best_nielsen = potential_nielsen[0]
+        res_dict, best_nielsen = map_article(item_7e, upc_lookup_n, attr_lookup_n, unique_b_n)
+        if best_nielsen:
             matched_master_ids.add(best_nielsen.get("_id"))
-            
-            if any(str(m.get("UPC")).strip().lstrip('0') == gtin_clean for m in potential_nielsen):
-                match_level = "LEVEL_1"
-                match_type = "Exact/Flexible UPC Match"
-            else:
-                match_level = "LEVEL_2"
-                match_type = "Attribute/Flavour Match"
-
-        mapping_upcs = "; ".join(list(set(str(m.get("UPC")) for m in potential_nielsen if m.get("UPC"))))
-        mapping_items = "; ".join(list(set(str(m.get("ITEM")) for m in potential_nielsen if m.get("ITEM"))))
-        
-        # Prepare results in the specific order requested by the user
-        res_dict = {
-            "UPC": best_nielsen.get("UPC") if best_nielsen else None,
-            "ITEM": best_nielsen.get("ITEM") if best_nielsen else None,
-            "Main_UPC": best_nielsen.get("UPC") if best_nielsen else None,
-            "UPC_GroupName": mapping_items,
-            "ArticleCode": item_7e.get("ArticleCode"),
-            "GTIN": gtin,
-            "Article_Description": item_7e.get("ArticleDescription"),
-            # Remaining context fields
-            "Source": "7-Eleven",
-            "7E_Brand": item_7e.get("L4_Description_Brand"),
-            "7E_Variant": item_7e.get("7E_Variant"),
-            "7E_Flavour": item_7e.get("7E_flavour"),
-            "7E_Size": item_7e.get("7E_Nrmsize"),
-            "Match_Level": match_level,
-            "Match_Type": match_type,
-            "Matched_MAT": best_nielsen.get("MAT Nov'24") if best_nielsen else 0,
-            "MAPPING_UPC": mapping_upcs
-        }
         results.append(res_dict)
 
+    # Articles kept from earlier runs still count as matches for the gap analysis
+    if changes is not None:
+        kept_upcs = set(coll_results.distinct("UPC", {"Source": "7-Eleven", "UPC": {"$ne": None}}))
+        matched_master_ids.update(d["_id"] for d in coll_master.find({"UPC": {"$in": list(kept_upcs)}}, {"_id": 1}))
+
     # --- Search Level 4: Market Gaps (Extra Master Items) ---
     print("Finding Market Gaps (Extra items in Nielsen)...")
     total_market_mat = 0
@@ -488,6 +542,11 @@ def run_mapping():
         }
         generate_qa_report(coll_results, metrics)
 
+    # A full run covers every pending change set
+    mapped = {"mapped_at": None} if changes is None else {"change_set_id": {"$in": changes["change_set_ids"]}}
+    db[COL_CHANGES].update_many(mapped, {"$set": {"mapped_at": datetime.utcnow().isoformat()}})
+    return {"mode": "full" if changes is None else "incremental", "articles_mapped": len(seven_eleven_docs)}
+
 def generate_qa_report(coll_results, metrics=None):
     print("\n--- Bi-Directional QA Report ---")
     total_7e = coll_results.count_documents({"Source": "7-Eleven"})
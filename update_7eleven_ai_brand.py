@@ -25,7 +25,7 @@ def extract_brands_batch(descriptions):
     user_message = f"Extract brands from these descriptions:\n" + "\n".join([f"- {d}" for d in descriptions])
     
     try:
-        response = flow2_client.chat_completion(system_prompt, user_message)
+        response = flow2_client.chat_completion(system_prompt, user_message, flow="7eleven")
         # Clean response if it contains markdown code blocks
         if "```json" in response:
             response = response.split("```json")[1].split("```")[0].strip()